@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Golden-output equivalence checks for the pipeline engines.
+Runs a reference engine (the row-by-row implementations by default) and a
+candidate engine of each stage on the same screen, each in a fresh
+process, then compares their JSON outputs file by file. Run stamps
+(date_created, lastUpdate) are ignored and numbers only have to agree
+within a tolerance. Reports per-file differences and the candidate's
+speedup over the reference.
+
+Usage:
+    python data-pipeline/benchmarks/check_equivalence.py
+    python data-pipeline/benchmarks/check_equivalence.py --checks process_screening_data \
+        build_heatmap_data --candidate streamed --scales bundled small
+"""
+
+import sys
+import math
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+import logging
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / "scripts"))
+
+from json_writer import loads_json, write_json_file
+from screening_data import load_screening_data, peak_rss_mb
+from run_benchmarks import SCALES, run_isolated, scale_csv, warm_cache
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+logger = logging.getLogger(__name__)
+
+# Keys holding run timestamps rather than results
+DEFAULT_IGNORED_KEYS = ['date_created', 'lastUpdate']
+
+DEFAULT_REL_TOL = 1e-9
+DEFAULT_ABS_TOL = 1e-12
+
+# Small partitions so the streamed engines really split the bundled screen
+STREAM_MEMORY_BUDGET_MB = 4
+STREAM_CHUNK_ROWS = 50_000
+
+def timed(function, *args, **kwargs):
+    """(result, seconds) of a call."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def datacards_in_memory(engine):
+    """process_screening_data engine building every datacard in memory."""
+    def run(csv_path, output_dir):
+        from process_data import process_screening_data, save_variant_datacards
+        variants, seconds = timed(process_screening_data, csv_path, engine=engine)
+        save_variant_datacards(variants, output_dir)
+        return seconds
+    return run
+
+def datacards_streamed(csv_path, output_dir):
+    """process_screening_data engine building datacards partition by partition (includes writing)."""
+    from process_data import stream_variant_datacards
+    manifest_path = Path(output_dir).parent / f".{Path(output_dir).name}_manifest.json"
+    _, seconds = timed(stream_variant_datacards, csv_path, output_dir, manifest_path,
+                       memory_budget_mb=STREAM_MEMORY_BUDGET_MB, chunk_rows=STREAM_CHUNK_ROWS)
+    manifest_path.unlink(missing_ok=True)
+    return seconds
+
+def dose_response_curves(csv_path):
+    """Dose axis, measured mask, replicate responses and averages of every variant-drug curve."""
+    from dose_response import build_dose_response_tensor, average_responses
+    tensor = build_dose_response_tensor(load_screening_data(csv_path))
+    return tensor['doses'], tensor['valid'], tensor['responses'], average_responses(tensor['responses'])
+
+def ic50_scalar(csv_path, output_dir):
+    """estimate_ic50 called once per curve."""
+    from process_data import estimate_ic50
+    doses, valid, _, avg_responses = dose_response_curves(csv_path)
+
+    def estimate_all():
+        return [estimate_ic50(doses[row_valid].tolist(), row[row_valid].tolist())
+                for row, row_valid in zip(avg_responses, valid)]
+
+    ic50, seconds = timed(estimate_all)
+    write_json_file(Path(output_dir) / "ic50.json", ic50)
+    return seconds
+
+def ic50_batch(csv_path, output_dir):
+    """estimate_ic50_batch over the whole dose-response matrix."""
+    from process_data import estimate_ic50_batch
+    doses, valid, _, avg_responses = dose_response_curves(csv_path)
+    (ic50, _), seconds = timed(estimate_ic50_batch, doses, avg_responses, valid)
+    write_json_file(Path(output_dir) / "ic50.json", [None if math.isnan(v) else v for v in ic50.tolist()])
+    return seconds
+
+def curve_ic50(csv_path):
+    """Curves plus their batch IC50 estimates, the shared input of the QC checks."""
+    from process_data import estimate_ic50_batch
+    doses, valid, responses, avg_responses = dose_response_curves(csv_path)
+    ic50, _ = estimate_ic50_batch(doses, avg_responses, valid)
+    return valid, responses, ic50
+
+def qc_scalar(csv_path, output_dir):
+    """get_qc_flags called once per curve."""
+    from process_data import get_qc_flags
+    valid, responses, ic50 = curve_ic50(csv_path)
+
+    def flag_all():
+        return [get_qc_flags(responses[i, valid[i], 0].tolist(), responses[i, valid[i], 1].tolist(),
+                             None if math.isnan(ic50[i]) else ic50[i])
+                for i in range(len(responses))]
+
+    flags, seconds = timed(flag_all)
+    write_json_file(Path(output_dir) / "qc_flags.json", flags)
+    return seconds
+
+def qc_mask(csv_path, output_dir):
+    """compute_qc_mask over every curve, decoded to flag lists."""
+    from quality_control import compute_qc_mask, decode_qc_flags
+    valid, responses, ic50 = curve_ic50(csv_path)
+
+    def flag_all():
+        mask = compute_qc_mask(responses, valid, ic50)
+        return [list(decode_qc_flags(m)) for m in mask.tolist()]
+
+    flags, seconds = timed(flag_all)
+    write_json_file(Path(output_dir) / "qc_flags.json", flags)
+    return seconds
+
+def heatmap_engine(engine, streaming=False):
+    """build_heatmap_data engine writing the nested heatmap_data.json (includes writing)."""
+    def run(csv_path, output_dir):
+        from generate_heatmap_data import generate_heatmap
+        _, seconds = timed(generate_heatmap, csv_path, Path(output_dir) / "heatmap_data.json", engine=engine,
+                           formats=['nested'], streaming=streaming, memory_budget_mb=STREAM_MEMORY_BUDGET_MB,
+                           chunk_rows=STREAM_CHUNK_ROWS)
+        return seconds
+    return run
+
+def search_entries_engine(engine):
+    """process_csv_data engine."""
+    def run(csv_path, output_dir):
+        from build_search_index import process_csv_data
+        (genes, drugs, variants), seconds = timed(process_csv_data, Path(csv_path), engine=engine)
+        write_json_file(Path(output_dir) / "search_entries.json",
+                        {'genes': list(genes.values()), 'drugs': list(drugs.values()), 'variants': variants})
+        return seconds
+    return run
+
+# Check name -> engine name -> function(csv_path, output_dir) that writes the
+# engine's outputs to output_dir and returns the seconds spent in the engine
+CHECKS = {
+    'process_screening_data': {
+        'legacy': datacards_in_memory('legacy'),
+        'vectorized': datacards_in_memory('vectorized'),
+        'streamed': datacards_streamed
+    },
+    'estimate_ic50': {
+        'scalar': ic50_scalar,
+        'batch': ic50_batch
+    },
+    'get_qc_flags': {
+        'scalar': qc_scalar,
+        'mask': qc_mask
+    },
+    'build_heatmap_data': {
+        'legacy': heatmap_engine('legacy'),
+        'vectorized': heatmap_engine('vectorized'),
+        'streamed': heatmap_engine('vectorized', streaming=True)
+    },
+    'process_csv_data': {
+        'legacy': search_entries_engine('legacy'),
+        'vectorized': search_entries_engine('vectorized')
+    }
+}
+
+# Check name -> (reference engine, candidate engine) compared by default
+DEFAULT_ENGINES = {
+    'process_screening_data': ('legacy', 'vectorized'),
+    'estimate_ic50': ('scalar', 'batch'),
+    'get_qc_flags': ('scalar', 'mask'),
+    'build_heatmap_data': ('legacy', 'vectorized'),
+    'process_csv_data': ('legacy', 'vectorized')
+}
+
+def run_engine(check, engine, csv_path, output_dir, verbose=False):
+    """Run one engine in this (fresh) process; returns its seconds and peak RSS."""
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    seconds = CHECKS[check][engine](csv_path, output_dir)
+    return {'seconds': round(seconds, 4), 'peak_rss_mb': peak_rss_mb()}
+
+def canonicalize(value, ignored_keys):
+    """value with ignored keys dropped at every level."""
+    if isinstance(value, dict):
+        return {key: canonicalize(item, ignored_keys) for key, item in value.items() if key not in ignored_keys}
+    if isinstance(value, list):
+        return [canonicalize(item, ignored_keys) for item in value]
+    return value
+
+def is_number(value):
+    """True for JSON numbers (bools are not numbers here)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def compare_json(reference, candidate, rel_tol=DEFAULT_REL_TOL, abs_tol=DEFAULT_ABS_TOL, max_diffs=10):
+    """Compare two canonical JSON values.
+
+    Returns (status, differences, difference count): status is
+    'identical', 'within_tolerance' when only numbers differ and all within
+    rel_tol/abs_tol, or 'different'. Dict key order is ignored; list order
+    is not. At most max_diffs differences are listed as
+    {'path', 'reference', 'candidate'}.
+    """
+    differences = []
+    state = {'count': 0, 'close': False}
+
+    def differ(path, old, new):
+        state['count'] += 1
+        if len(differences) < max_diffs:
+            differences.append({'path': path, 'reference': old, 'candidate': new})
+
+    def walk(old, new, path):
+        if is_number(old) and is_number(new):
+            if old == new or (isinstance(old, float) and isinstance(new, float) and math.isnan(old) and math.isnan(new)):
+                return
+            if math.isclose(old, new, rel_tol=rel_tol, abs_tol=abs_tol):
+                state['close'] = True
+            else:
+                differ(path, old, new)
+        elif isinstance(old, dict) and isinstance(new, dict):
+            for key in old:
+                if key in new:
+                    walk(old[key], new[key], f"{path}.{key}")
+                else:
+                    differ(f"{path}.{key}", old[key], '<missing>')
+            for key in new:
+                if key not in old:
+                    differ(f"{path}.{key}", '<missing>', new[key])
+        elif isinstance(old, list) and isinstance(new, list):
+            if len(old) != len(new):
+                differ(f"{path}.length", len(old), len(new))
+            for i, (old_item, new_item) in enumerate(zip(old, new)):
+                walk(old_item, new_item, f"{path}[{i}]")
+        elif type(old) is not type(new) or old != new:
+            differ(path, old, new)
+
+    walk(reference, candidate, '$')
+    if state['count']:
+        return 'different', differences, state['count']
+    return ('within_tolerance' if state['close'] else 'identical'), differences, 0
+
+def json_files(output_dir):
+    """Relative paths of the JSON files under output_dir, skipping hidden entries."""
+    output_dir = Path(output_dir)
+    return sorted(
+        path.relative_to(output_dir).as_posix() for path in output_dir.rglob('*.json')
+        if not any(part.startswith('.') for part in path.relative_to(output_dir).parts)
+    )
+
+def load_json(path):
+    """Parse a JSON file."""
+    with open(path, 'rb') as f:
+        return loads_json(f.read())
+
+def compare_outputs(reference_dir, candidate_dir, ignored_keys, rel_tol, abs_tol, max_diffs):
+    """Compare every JSON file of two output directories.
+
+    Returns {relative path: {'status', 'differences', 'difference_count'}}
+    with status 'missing' for files only the reference wrote and 'extra'
+    for files only the candidate wrote.
+    """
+    reference_files = set(json_files(reference_dir))
+    candidate_files = set(json_files(candidate_dir))
+    results = {}
+    for relative_path in sorted(reference_files | candidate_files):
+        if relative_path not in candidate_files:
+            results[relative_path] = {'status': 'missing', 'differences': [], 'difference_count': 0}
+            continue
+        if relative_path not in reference_files:
+            results[relative_path] = {'status': 'extra', 'differences': [], 'difference_count': 0}
+            continue
+        reference = canonicalize(load_json(Path(reference_dir) / relative_path), ignored_keys)
+        candidate = canonicalize(load_json(Path(candidate_dir) / relative_path), ignored_keys)
+        status, differences, count = compare_json(reference, candidate, rel_tol=rel_tol, abs_tol=abs_tol,
+                                                  max_diffs=max_diffs)
+        results[relative_path] = {'status': status, 'differences': differences, 'difference_count': count}
+    return results
+
+def status_counts(files):
+    """Number of files per comparison status."""
+    counts = {status: 0 for status in ['identical', 'within_tolerance', 'different', 'missing', 'extra']}
+    for result in files.values():
+        counts[result['status']] += 1
+    return counts
+
+def run_check(check, reference, candidate, csv_path, workdir, args):
+    """Run both engines of a check and compare their outputs; returns the check's report."""
+    timings = {}
+    for role, engine in [('reference', reference), ('candidate', candidate)]:
+        output_dir = Path(workdir) / role
+        runs = [run_isolated(run_engine, check, engine, csv_path, output_dir, args.verbose)
+                for _ in range(args.repeat)]
+        timings[role] = min(runs, key=lambda run: run['seconds'])
+
+    files = compare_outputs(Path(workdir) / 'reference', Path(workdir) / 'candidate', set(args.ignore_keys),
+                            args.rel_tol, args.abs_tol, args.max_diffs)
+    counts = status_counts(files)
+    reference_seconds = timings['reference']['seconds']
+    candidate_seconds = timings['candidate']['seconds']
+    return {
+        'reference': {'engine': reference, **timings['reference']},
+        'candidate': {'engine': candidate, **timings['candidate']},
+        'speedup': round(reference_seconds / candidate_seconds, 2) if candidate_seconds > 0 else None,
+        'equivalent': bool(files) and counts['different'] + counts['missing'] + counts['extra'] == 0,
+        'counts': counts,
+        'files': {path: result for path, result in files.items() if result['status'] != 'identical'}
+    }
+
+def log_check(case, report, max_files):
+    """Log a check's verdict, timings and the first differing files."""
+    counts = report['counts']
+    reference, candidate = report['reference'], report['candidate']
+    verdict = 'EQUIVALENT' if report['equivalent'] else 'DIFFERENT'
+    speedup = f"{report['speedup']}x" if report['speedup'] is not None else '-'
+    logger.info(f"{case}: {verdict} ({sum(counts.values())} files: {counts['identical']} identical, "
+                f"{counts['within_tolerance']} within tolerance, {counts['different']} different, "
+                f"{counts['missing']} missing, {counts['extra']} extra); "
+                f"{reference['engine']} {reference['seconds']:.3f}s, {candidate['engine']} "
+                f"{candidate['seconds']:.3f}s, speedup {speedup}")
+
+    shown = 0
+    for path, result in report['files'].items():
+        if result['status'] == 'within_tolerance':
+            continue
+        if shown == max_files:
+            logger.warning("  ... and more differing files (see --report)")
+            break
+        shown += 1
+        logger.warning(f"  {path}: {result['status']}"
+                       + (f" ({result['difference_count']} differences)" if result['difference_count'] else ''))
+        for difference in result['differences']:
+            logger.warning(f"    {difference['path']}: {difference['reference']!r} -> {difference['candidate']!r}")
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Check that candidate pipeline engines reproduce the reference outputs")
+    parser.add_argument('--checks', nargs='+', choices=list(CHECKS), default=list(CHECKS),
+                        help="Stages to check (default: all)")
+    parser.add_argument('--reference', default=None,
+                        help="Reference engine for every selected check (default: each check's reference, "
+                             + ", ".join(f"{check}={engines[0]}" for check, engines in DEFAULT_ENGINES.items()) + ")")
+    parser.add_argument('--candidate', default=None,
+                        help="Candidate engine for every selected check (default: each check's candidate, "
+                             + ", ".join(f"{check}={engines[1]}" for check, engines in DEFAULT_ENGINES.items()) + ")")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['bundled'],
+                        help="Input screens, as in run_benchmarks.py (default: bundled)")
+    parser.add_argument('--data-dir', type=Path, default=BENCHMARK_DIR / "results" / "data",
+                        help="Where synthetic screens are kept")
+    parser.add_argument('--rel-tol', type=float, default=DEFAULT_REL_TOL,
+                        help=f"Relative tolerance for numbers (default: {DEFAULT_REL_TOL})")
+    parser.add_argument('--abs-tol', type=float, default=DEFAULT_ABS_TOL,
+                        help=f"Absolute tolerance for numbers (default: {DEFAULT_ABS_TOL})")
+    parser.add_argument('--ignore-keys', nargs='*', default=DEFAULT_IGNORED_KEYS,
+                        help="Keys ignored at any depth (default: " + " ".join(DEFAULT_IGNORED_KEYS) + ")")
+    parser.add_argument('--max-diffs', type=int, default=10, help="Differences listed per file (default: 10)")
+    parser.add_argument('--max-files', type=int, default=10, help="Differing files logged per check (default: 10)")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Runs per engine; the fastest is kept (default: 1)")
+    parser.add_argument('--report', type=Path, default=None, help="Also write the full report to this JSON file")
+    parser.add_argument('--keep-outputs', type=Path, default=None,
+                        help="Keep each engine's outputs under this directory instead of a temporary one")
+    parser.add_argument('--verbose', action='store_true', help="Show the engines' own logging")
+    args = parser.parse_args(argv)
+
+    for option in ['reference', 'candidate']:
+        engine = getattr(args, option)
+        for check in args.checks:
+            if engine is not None and engine not in CHECKS[check]:
+                parser.error(f"--{option} {engine} is not an engine of {check} "
+                             f"(choose from {', '.join(CHECKS[check])})")
+    return args
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    root = args.keep_outputs or Path(tempfile.mkdtemp(prefix="equivalence_"))
+    reports = {}
+    try:
+        for scale in args.scales:
+            csv_path = scale_csv(scale, args.data_dir)
+            run_isolated(warm_cache, csv_path)
+
+            for check in args.checks:
+                reference = args.reference or DEFAULT_ENGINES[check][0]
+                candidate = args.candidate or DEFAULT_ENGINES[check][1]
+                case = f"{check}@{scale}"
+                workdir = root / case
+                if workdir.exists():
+                    shutil.rmtree(workdir)
+                reports[case] = run_check(check, reference, candidate, csv_path, workdir, args)
+                log_check(case, reports[case], args.max_files)
+    finally:
+        if args.keep_outputs is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.report:
+        args.report.parent.mkdir(parents=True, exist_ok=True)
+        write_json_file(args.report, {'rel_tol': args.rel_tol, 'abs_tol': args.abs_tol,
+                                      'ignored_keys': args.ignore_keys, 'checks': reports}, indent=2)
+        logger.info(f"Report saved: {args.report}")
+
+    failed = [case for case, report in reports.items() if not report['equivalent']]
+    if failed:
+        logger.error(f"Outputs differ for: {', '.join(failed)}")
+        sys.exit(1)
+    logger.info("All candidate outputs match their references")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Regression benchmarks for the data pipeline stages.
+Runs each stage on the bundled screen and on synthetic screens of
+increasing size, each in a fresh process, and records wall time, peak
+RSS, rows/sec and output bytes in a JSON history keyed by git commit.
+Rows are counted from each stage's own result in the stage's unit
+(loaded rows, datacards, IC50 curves, heatmap cells, search entries),
+which every result records as row_unit.
+Results are compared with an earlier run and slowdowns beyond a
+threshold are reported. Needs no network access.
+
+Usage:
+    python data-pipeline/benchmarks/run_benchmarks.py --scales bundled small medium
+    python data-pipeline/benchmarks/run_benchmarks.py --fail-on-regression   # in CI
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import tempfile
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCHMARK_DIR.parent.parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / "scripts"))
+
+from json_writer import write_json_file
+from screening_data import load_screening_data, peak_rss_mb
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+logger = logging.getLogger(__name__)
+
+# Bump when the history layout or what a stage measures changes
+HISTORY_VERSION = 3
+
+DEFAULT_HISTORY = BENCHMARK_DIR / "results" / "history.json"
+
+BUNDLED_CSV = PROJECT_ROOT / "data" / "raw" / "master_qDMS_df.csv"
+
+# Scale name -> synthetic screen generator options (None for the bundled CSV);
+# each gene adds about 54,000 rows with the generator's defaults
+SCALES = {
+    'bundled': None,
+    'small': ['--genes', '2'],
+    'medium': ['--genes', '10'],
+    'large': ['--genes', '40']
+}
+DEFAULT_SCALES = ['bundled', 'small', 'medium']
+
+def directory_bytes(path):
+    """Total size of the files under path."""
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+def bench_load(csv_path, workdir):
+    """Loading the screening data (from the warm parse cache)."""
+    start = time.perf_counter()
+    df = load_screening_data(csv_path)
+    return time.perf_counter() - start, len(df), None
+
+def bench_process_screening_data(csv_path, workdir):
+    """Building variant datacards in memory."""
+    from process_data import process_screening_data
+    start = time.perf_counter()
+    variants = process_screening_data(csv_path)
+    return time.perf_counter() - start, len(variants), None
+
+def bench_estimate_ic50(csv_path, workdir):
+    """estimate_ic50 called once per variant-drug curve."""
+    from process_data import estimate_ic50
+    from dose_response import build_dose_response_tensor, average_responses
+    tensor = build_dose_response_tensor(load_screening_data(csv_path))
+    avg_responses = average_responses(tensor['responses'])
+    curves = [(tensor['doses'][valid].tolist(), row[valid].tolist())
+              for row, valid in zip(avg_responses, tensor['valid'])]
+
+    start = time.perf_counter()
+    for doses, responses in curves:
+        estimate_ic50(doses, responses)
+    return time.perf_counter() - start, len(curves), None
+
+def bench_estimate_ic50_batch(csv_path, workdir):
+    """Batch IC50 estimation over every variant-drug curve."""
+    from process_data import estimate_ic50_batch
+    from dose_response import build_dose_response_tensor, average_responses
+    tensor = build_dose_response_tensor(load_screening_data(csv_path))
+    avg_responses = average_responses(tensor['responses'])
+
+    start = time.perf_counter()
+    estimate_ic50_batch(tensor['doses'], avg_responses, tensor['valid'])
+    return time.perf_counter() - start, len(avg_responses), None
+
+def bench_save_variant_datacards(csv_path, workdir):
+    """Writing the datacard files."""
+    from process_data import process_screening_data, save_variant_datacards
+    variants = process_screening_data(csv_path)
+    output_dir = Path(workdir) / "variants"
+
+    start = time.perf_counter()
+    save_variant_datacards(variants, output_dir)
+    return time.perf_counter() - start, len(variants), directory_bytes(output_dir)
+
+def bench_generate_heatmap(csv_path, workdir):
+    """Aggregating and writing the heatmap outputs."""
+    from generate_heatmap_data import generate_heatmap
+    output_dir = Path(workdir) / "heatmap"
+    output_dir.mkdir()
+
+    start = time.perf_counter()
+    heatmap_data = generate_heatmap(csv_path, output_dir / "heatmap_data.json")
+    seconds = time.perf_counter() - start
+    cells = sum(sum(counts.values()) for counts in heatmap_data['metadata']['data_counts'].values())
+    return seconds, cells, directory_bytes(output_dir)
+
+def bench_process_csv_data(csv_path, workdir):
+    """Building the search index entries."""
+    from build_search_index import process_csv_data
+    start = time.perf_counter()
+    genes, drugs, variants = process_csv_data(Path(csv_path))
+    return time.perf_counter() - start, len(genes) + len(drugs) + len(variants), None
+
+# Stage name -> (function(csv_path, workdir) returning (seconds, rows, output bytes or None),
+# what one row of that stage is)
+STAGES = {
+    'load': (bench_load, 'measurements'),
+    'process_screening_data': (bench_process_screening_data, 'datacards'),
+    'estimate_ic50': (bench_estimate_ic50, 'curves'),
+    'estimate_ic50_batch': (bench_estimate_ic50_batch, 'curves'),
+    'save_variant_datacards': (bench_save_variant_datacards, 'datacards'),
+    'generate_heatmap': (bench_generate_heatmap, 'heatmap cells'),
+    'process_csv_data': (bench_process_csv_data, 'search entries')
+}
+
+def run_case(stage, csv_path, verbose=False):
+    """Run one stage in this (fresh) process and return its measurements.
+
+    Peak RSS covers the whole process, including any setup the stage
+    needs before the timed part.
+    """
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    function, row_unit = STAGES[stage]
+    workdir = tempfile.mkdtemp(prefix=f"bench_{stage}_")
+    try:
+        seconds, rows, output_bytes = function(csv_path, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    peak_rss = peak_rss_mb()
+    return {
+        'wall_seconds': round(seconds, 4),
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+        'rows': rows,
+        'row_unit': row_unit,
+        'rows_per_sec': round(rows / seconds) if seconds > 0 else None,
+        'output_bytes': output_bytes
+    }
+
+def run_isolated(function, *args):
+    """Call function in a new spawned process so memory and caches start clean."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+def warm_cache(csv_path):
+    """Parse the CSV once so every stage reads the cached frame."""
+    load_screening_data(csv_path)
+
+def scale_csv(scale, data_dir, regenerate=False):
+    """CSV for a scale, generating the synthetic screen if needed."""
+    if SCALES[scale] is None:
+        return BUNDLED_CSV
+
+    csv_path = Path(data_dir) / f"synthetic_bench_{scale}.csv"
+    if regenerate or not csv_path.exists():
+        from generate_synthetic_screen import parse_args as generator_args, write_screen
+        logger.info(f"Generating the {scale} benchmark screen")
+        write_screen(generator_args(SCALES[scale] + ['--missing-rate', '0.02', '--seed', '0',
+                                                     '--output', str(csv_path)]))
+    return csv_path
+
+def run_benchmarks(stages, scales, data_dir, repeat=1, regenerate=False, verbose=False):
+    """Run every stage at every scale; returns {"stage@scale": measurements}.
+
+    With repeat > 1 the fastest wall time and largest peak RSS are kept.
+    """
+    results = {}
+    for scale in scales:
+        csv_path = scale_csv(scale, data_dir, regenerate=regenerate)
+        run_isolated(warm_cache, csv_path)
+
+        for stage in stages:
+            runs = [run_isolated(run_case, stage, csv_path, verbose) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run['wall_seconds'])
+            rss = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+            result = results[f"{stage}@{scale}"] = {**best, 'peak_rss_mb': max(rss) if rss else None}
+            logger.info(f"{stage}@{scale}: {result['wall_seconds']:.3f}s, "
+                        f"{result['rows_per_sec'] or 0:,} {result['row_unit']}/sec, peak RSS {result['peak_rss_mb']} MB")
+    return results
+
+def git_revision():
+    """(commit hash, whether the working tree has uncommitted changes)."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(status)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+def load_history(history_path):
+    """Benchmark history, or an empty one."""
+    history_path = Path(history_path)
+    if history_path.exists():
+        try:
+            with open(history_path, 'r') as f:
+                history = json.load(f)
+            if history.get('version') == HISTORY_VERSION:
+                return history
+            logger.warning(f"Starting a new history: {history_path} has another version")
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Starting a new history: cannot read {history_path}: {e}")
+    return {'version': HISTORY_VERSION, 'runs': {}}
+
+def current_run_key():
+    """History key of this working tree: the commit, or "<commit>-dirty"."""
+    commit, dirty = git_revision()
+    return f"{commit}-dirty" if dirty else commit
+
+def record_run(history, key, results):
+    """Add results to history under key.
+
+    Results for a key are merged, so benchmarking scales separately is fine.
+    """
+    commit, dirty = git_revision()
+    run = history['runs'].setdefault(key, {'commit': commit, 'dirty': dirty, 'results': {}})
+    run['timestamp'] = datetime.now(timezone.utc).isoformat()
+    run['machine'] = {'platform': platform.platform(), 'python': platform.python_version(),
+                      'cpus': os.cpu_count()}
+    run['results'].update(results)
+
+def baseline_run_key(history, current_key):
+    """Most recent run other than current_key, else current_key's earlier results, else None."""
+    others = [(run['timestamp'], key) for key, run in history['runs'].items() if key != current_key]
+    if others:
+        return max(others)[1]
+    return current_key if current_key in history['runs'] else None
+
+def find_regressions(current, baseline, threshold, min_seconds):
+    """Cases whose wall time or peak RSS grew by more than threshold.
+
+    Wall time changes smaller than min_seconds are treated as noise.
+    Returns (case, metric, baseline value, current value) tuples.
+    """
+    regressions = []
+    for case, result in current.items():
+        previous = baseline.get(case)
+        if not previous:
+            continue
+        for metric in ('wall_seconds', 'peak_rss_mb'):
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None or new <= old * (1 + threshold):
+                continue
+            if metric == 'wall_seconds' and new - old < min_seconds:
+                continue
+            regressions.append((case, metric, old, new))
+    return regressions
+
+def log_comparison(current, baseline):
+    """Log each case next to its baseline."""
+    logger.info(f"{'case':<36} {'seconds':>9} {'baseline':>9} {'change':>8} {'rows/sec':>12} {'row unit':<15} "
+                f"{'RSS MB':>8}")
+    for case, result in current.items():
+        old = baseline.get(case, {}).get('wall_seconds')
+        change = f"{(result['wall_seconds'] / old - 1) * 100:+.0f}%" if old else '-'
+        logger.info(f"{case:<36} {result['wall_seconds']:>9.3f} {old if old else '-':>9} {change:>8} "
+                    f"{result['rows_per_sec'] or 0:>12,} {result.get('row_unit', '-'):<15} "
+                    f"{result['peak_rss_mb'] or 0:>8.0f}")
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline stages")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help="Stages to benchmark (default: all)")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=DEFAULT_SCALES,
+                        help="Input scales: the bundled CSV or synthetic screens of about 0.1M, 0.5M "
+                             "and 2M rows (default: bundled small medium)")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Runs per case; the fastest is kept (default: 1)")
+    parser.add_argument('--history', type=Path, default=DEFAULT_HISTORY,
+                        help="JSON history file (default: data-pipeline/benchmarks/results/history.json)")
+    parser.add_argument('--data-dir', type=Path, default=BENCHMARK_DIR / "results" / "data",
+                        help="Where synthetic benchmark screens are kept")
+    parser.add_argument('--regenerate', action='store_true', help="Regenerate the synthetic screens")
+    parser.add_argument('--baseline', default=None,
+                        help="History key to compare against (default: the previous run)")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown or memory growth reported as a regression (default: 0.2)")
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help="Ignore wall time changes smaller than this (default: 0.05)")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Exit with status 1 when a regression is found")
+    parser.add_argument('--no-record', action='store_true', help="Do not write the results to the history")
+    parser.add_argument('--verbose', action='store_true', help="Show the stages' own logging")
+    return parser.parse_args(argv)
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    results = run_benchmarks(args.stages, args.scales, args.data_dir, repeat=args.repeat,
+                             regenerate=args.regenerate, verbose=args.verbose)
+
+    history = load_history(args.history)
+    key = current_run_key()
+    baseline_key = args.baseline or baseline_run_key(history, key)
+    if baseline_key and baseline_key not in history['runs']:
+        logger.error(f"Baseline {baseline_key} is not in {args.history}")
+        sys.exit(1)
+    baseline = dict(history['runs'][baseline_key]['results']) if baseline_key else {}
+    record_run(history, key, results)
+
+    logger.info(f"Results for {key}" + (f" against {baseline_key}" if baseline_key else " (no baseline yet)"))
+    log_comparison(results, baseline)
+
+    if not args.no_record:
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        write_json_file(args.history, history, indent=2)
+        logger.info(f"History saved: {args.history}")
+
+    regressions = find_regressions(results, baseline, args.threshold, args.min_seconds)
+    for case, metric, old, new in regressions:
+        logger.warning(f"Regression in {case}: {metric} {old} -> {new} ({(new / old - 1) * 100:+.0f}%)")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Unified runner for the Atlas BioTech data pipeline.
+Loads the screening data once and runs validation, datacard generation,
+search index, heatmap and measurement store stages as a dependency graph
+in one process, running independent stages concurrently over the shared
+frame.
+
+Usage:
+    python data-pipeline/scripts/atlas_pipeline.py build
+    (or `python -m atlas_pipeline build` from data-pipeline/scripts)
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+
+from screening_data import load_screening_data
+from validate_data import validate_project_data
+from process_data import add_datacard_arguments, generate_datacards
+from build_search_index import build_search_index
+from generate_heatmap_data import generate_heatmap
+from measurement_store import build_store
+from stage_timers import stage_timer
+from run_profile import DEFAULT_REPORT_DIR, PROFILE_DIR_NAME, add_profile_arguments, cpu_profile, profile_run
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s',
+                    force=True)
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+def pipeline_paths(project_root=PROJECT_ROOT):
+    """Input and output locations used by the pipeline stages."""
+    data_output_dir = project_root / "public" / "data" / "v1.0"
+    return {
+        'project_root': project_root,
+        'csv_path': project_root / "data" / "raw" / "master_qDMS_df.csv",
+        'data_output_dir': data_output_dir,
+        'variants_dir': data_output_dir / "variants",
+        'search_index': data_output_dir / "search_index.json",
+        'heatmap': data_output_dir / "heatmap_data.json",
+        'measurement_store': project_root / "data" / "processed" / "measurements",
+        'report_dir': DEFAULT_REPORT_DIR
+    }
+
+def run_validation(paths, args):
+    """Validation stage; raises if any check fails."""
+    if not validate_project_data(paths['project_root'], paths['csv_path']):
+        raise RuntimeError("Data validation failed")
+
+def run_datacards(paths, args):
+    """Datacard stage."""
+    return generate_datacards(paths['csv_path'], paths['data_output_dir'], args)
+
+def run_search_index(paths, args):
+    """Search index stage."""
+    build_search_index(paths['csv_path'], paths['variants_dir'], paths['search_index'])
+
+def run_heatmap(paths, args):
+    """Heatmap stage."""
+    generate_heatmap(paths['csv_path'], paths['heatmap'])
+
+def run_measurement_store(paths, args):
+    """Measurement store stage."""
+    build_store(paths['csv_path'], paths['measurement_store'])
+
+# Stage name -> (stages it depends on, function). Validation reads the
+# previous search index, so it has to finish before that file is rewritten.
+STAGES = {
+    'validate': ([], run_validation),
+    'datacards': (['validate'], run_datacards),
+    'search_index': (['validate'], run_search_index),
+    'heatmap': (['validate'], run_heatmap),
+    'measurements': ([], run_measurement_store)
+}
+
+# Stages nothing deployed depends on; a plain build leaves them out and
+# --include (or --only) runs them
+OPTIONAL_STAGES = ['measurements']
+
+def select_stages(only=None, skip=None, include=None):
+    """Stage names to run, dropping dependencies on stages that are not run."""
+    if only:
+        wanted = set(only)
+    else:
+        wanted = {name for name in STAGES if name not in OPTIONAL_STAGES} | set(include or [])
+    selected = [name for name in STAGES if name in wanted and name not in (skip or [])]
+    return {name: [dep for dep in STAGES[name][0] if dep in selected] for name in selected}
+
+def run_stages(stages, paths, args, max_parallel=None):
+    """Run stages as soon as their dependencies finish.
+
+    Returns ({stage: seconds}, failed stage names). Stages depending on a
+    failed stage are skipped.
+    """
+    timings = {}
+    failed = []
+    pending = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_parallel or len(stages) or 1,
+                            thread_name_prefix='stage') as executor:
+        while pending or running:
+            for name, deps in list(pending.items()):
+                if any(dep in failed for dep in deps):
+                    logger.warning(f"Skipping {name}: a stage it depends on failed")
+                    failed.append(name)
+                    del pending[name]
+                elif all(dep in timings for dep in deps):
+                    logger.info(f"Starting stage {name}")
+                    running[executor.submit(timed, run_stage, name, paths, args)] = name
+                    del pending[name]
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                    logger.info(f"Finished stage {name} in {timings[name]:.2f}s")
+                except Exception as e:
+                    logger.error(f"Stage {name} failed: {e}")
+                    failed.append(name)
+
+    return timings, failed
+
+def run_stage(name, paths, args):
+    """Run one stage, under cProfile in its own thread with --profile-cpu."""
+    with stage_timer(f"stage:{name}"):
+        if getattr(args, 'profile_cpu', False):
+            with cpu_profile(paths['report_dir'] / PROFILE_DIR_NAME / f"atlas_pipeline.{name}.pstats"):
+                return STAGES[name][1](paths, args)
+        return STAGES[name][1](paths, args)
+
+def timed(function, *args):
+    """Call function and return how many seconds it took."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def log_timings(timings, load_seconds, total_seconds):
+    """Log a per-stage timing summary."""
+    logger.info("Stage timings:")
+    logger.info(f"  {'load':<14} {load_seconds:8.2f}s")
+    for name, seconds in timings.items():
+        logger.info(f"  {name:<14} {seconds:8.2f}s")
+    logger.info(f"  {'total':<14} {total_seconds:8.2f}s")
+
+def build(args):
+    """Load the screening data once and run the selected stages."""
+    paths = pipeline_paths()
+    start = time.perf_counter()
+
+    if not paths['csv_path'].exists():
+        logger.error(f"Data file not found: {paths['csv_path']}")
+        return 1
+
+    # Every stage reads the screening data through load_screening_data,
+    # which returns this same in-memory frame for the rest of the run
+    df = load_screening_data(paths['csv_path'])
+    load_seconds = time.perf_counter() - start
+    logger.info(f"Loaded {len(df)} rows once for all stages in {load_seconds:.2f}s")
+
+    stages = select_stages(args.only, args.skip, args.include)
+    timings, failed = run_stages(stages, paths, args, max_parallel=args.max_parallel)
+    log_timings(timings, load_seconds, time.perf_counter() - start)
+
+    if failed:
+        logger.error(f"❌ Pipeline failed: {', '.join(failed)}")
+        return 1
+    logger.info("✅ Pipeline completed!")
+    return 0
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Atlas BioTech data pipeline runner")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Validate the data and build every pipeline output")
+    build_parser.add_argument('--only', nargs='+', choices=list(STAGES),
+                              help="Run only these stages")
+    build_parser.add_argument('--skip', nargs='+', choices=list(STAGES), default=[],
+                              help="Stages to leave out")
+    build_parser.add_argument('--include', nargs='+', choices=OPTIONAL_STAGES, default=[],
+                              help="Optional stages to run as well (not part of a plain build)")
+    build_parser.add_argument('--max-parallel', type=int, default=None,
+                              help="Most stages to run at once (default: all that are ready)")
+    add_datacard_arguments(build_parser.add_argument_group('datacard options'))
+    add_profile_arguments(build_parser.add_argument_group('profiling options'))
+    return parser.parse_args(argv)
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    if args.command == 'build':
+        with profile_run('atlas_pipeline', pipeline_paths()['report_dir'], profile=args.profile,
+                         cpu=args.profile_cpu, memory_top=args.profile_memory):
+            status = build(args)
+        sys.exit(status)
+
+if __name__ == "__main__":
+    main()
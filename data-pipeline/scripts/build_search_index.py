@@ -7,17 +7,139 @@ Creates searchable index from processed variant and drug data.
 import os
 import sys
 import json
+import argparse
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from datetime import datetime, timezone
 import logging
 
+from screening_data import load_screening_data, default_cache_dir
+from variant_scanner import scan_variant_summaries
+from search_tokens import SHARD_ROOT_NAME, build_sharded_index
+from search_columnar import encode_columnar_index
+from json_writer import write_json_file, write_json_tree
+from stage_timers import stage_timer
+from run_profile import add_profile_arguments, profile_run
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def process_csv_data(csv_path):
-    """Extract genes, drugs, and variant info from CSV data."""
+# Sharded index (root index plus one variant shard per gene), next to search_index.json
+SHARDED_INDEX_DIR_NAME = "search"
+COLUMNAR_INDEX_NAME = "search_index_columnar.json"
+
+# Summaries of parsed variant files, kept with the screening data cache
+VARIANT_SCAN_CACHE_NAME = "variant_summaries.json"
+
+OUTPUT_FORMATS = ['full', 'sharded', 'columnar']
+DEFAULT_FORMATS = ['full', 'sharded']
+
+VARIANT_COLUMNS = ['Gene', 'ref_aa', 'protein_start', 'alt_aa']
+
+def drug_variant_counts(df):
+    """Number of unique variants tested with each drug, from one groupby."""
+    if 'Drug' not in df.columns:
+        return {}
+    if not all(col in df.columns for col in VARIANT_COLUMNS):
+        return df.groupby('Drug', observed=True).size().to_dict()
+
+    variant_groups = df.groupby(['Drug'] + VARIANT_COLUMNS, observed=True).size()
+    return variant_groups.groupby(level='Drug', observed=True).size().to_dict()
+
+def variant_search_entries(df):
+    """Variant entries for search, one per gene + variant_string.
+
+    Entries follow the order in which variants first appear in df, and
+    drugs_tested lists each variant's drugs in first-appearance order.
+    """
+    if not all(col in df.columns for col in ['ref_aa', 'protein_start', 'alt_aa']):
+        return []
+
+    columns = [col for col in VARIANT_COLUMNS + ['Drug'] if col in df.columns]
+    # Deduplicate on the (categorical) columns first so strings are only
+    # built for distinct variant-drug pairs
+    pairs = (df[columns]
+             .dropna(subset=['ref_aa', 'protein_start', 'alt_aa'])
+             .drop_duplicates()
+             .reset_index(drop=True))
+
+    gene = pairs['Gene'].astype(object) if 'Gene' in pairs.columns else pd.Series('', index=pairs.index)
+    drug = pairs['Drug'].astype(object) if 'Drug' in pairs.columns else pd.Series('', index=pairs.index)
+    variant_id = (pairs['ref_aa'].astype(str) + pairs['protein_start'].astype(str)
+                  + pairs['alt_aa'].astype(str))
+    entries = pd.DataFrame({
+        'variant_key': gene.astype(str) + '_' + variant_id,
+        'gene': gene,
+        'variant_string': variant_id,
+        'drug': drug
+    }).drop_duplicates(['variant_key', 'drug'])
+
+    if entries.empty:
+        return []
+
+    # Codes number variants in order of first appearance; a stable sort by
+    # code keeps each variant's drugs in their original order
+    codes, _ = pd.factorize(entries['variant_key'])
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    drugs_tested = np.split(entries['drug'].to_numpy()[order], starts[1:])
+    first = entries.iloc[order[starts]]
+
+    return [
+        {
+            'gene': gene,
+            'variant_string': variant_string,
+            'protein_change': f"p.{variant_string}",
+            'consequence': 'missense_variant',
+            'drugs_tested': drugs.tolist()
+        }
+        for gene, variant_string, drugs in zip(first['gene'], first['variant_string'], drugs_tested)
+    ]
+
+def drug_variant_counts_legacy(df):
+    """Drug by drug reference implementation of drug_variant_counts."""
+    counts = {}
+    for drug in (df['Drug'].unique() if 'Drug' in df.columns else []):
+        drug_variants = df[df['Drug'] == drug]
+        if all(col in df.columns for col in VARIANT_COLUMNS):
+            counts[drug] = drug_variants.groupby(VARIANT_COLUMNS, observed=True).ngroups
+        else:
+            counts[drug] = len(drug_variants)
+    return counts
+
+def variant_search_entries_legacy(df):
+    """Row-by-row reference implementation of variant_search_entries."""
+    variants_dict = {}
+    for _, row in df.iterrows():
+        if pd.notna(row.get('ref_aa')) and pd.notna(row.get('alt_aa')) and pd.notna(row.get('protein_start')):
+            variant_id = f"{row.get('ref_aa', '')}{row.get('protein_start', '')}{row.get('alt_aa', '')}"
+            gene = row.get('Gene', '')
+            drug = row.get('Drug', '')
+            
+            # Create unique key for variant
+            variant_key = f"{gene}_{variant_id}"
+            
+            if variant_key not in variants_dict:
+                variants_dict[variant_key] = {
+                    'gene': gene,
+                    'variant_string': variant_id,
+                    'protein_change': f"p.{variant_id}",
+                    'consequence': 'missense_variant',
+                    'drugs_tested': [drug]
+                }
+            elif drug not in variants_dict[variant_key]['drugs_tested']:
+                variants_dict[variant_key]['drugs_tested'].append(drug)
+    
+    return list(variants_dict.values())
+
+@stage_timer('search_entries')
+def process_csv_data(csv_path, engine='vectorized'):
+    """Extract genes, drugs, and variant info from CSV data.
+    
+    engine='legacy' uses the row-by-row reference implementations.
+    """
     if not csv_path.exists():
         logger.warning(f"CSV file not found: {csv_path}")
         return {}, {}, []
@@ -26,19 +148,15 @@ def process_csv_data(csv_path):
     
     try:
         # Load CSV data
-        df = pd.read_csv(csv_path)
+        df = load_screening_data(csv_path)
         
         # Extract unique drugs
         drugs = {}
         unique_drugs = df['Drug'].unique() if 'Drug' in df.columns else []
+        drug_counts = drug_variant_counts_legacy(df) if engine == 'legacy' else drug_variant_counts(df)
         
         for drug in unique_drugs:
-            drug_variants = df[df['Drug'] == drug]
-            # Count unique variants (based on gene + ref_aa + position + alt_aa combination)
-            if all(col in df.columns for col in ['Gene', 'ref_aa', 'protein_start', 'alt_aa']):
-                unique_variant_count = drug_variants.groupby(['Gene', 'ref_aa', 'protein_start', 'alt_aa']).ngroups
-            else:
-                unique_variant_count = len(drug_variants)
+            unique_variant_count = drug_counts.get(drug, 0)
             
             # Create drug entry with basic information
             drugs[drug] = {
@@ -83,10 +201,10 @@ def process_csv_data(csv_path):
         # Extract unique genes
         genes = {}
         unique_genes = df['Gene'].unique() if 'Gene' in df.columns else []
+        gene_rows = df.groupby('Gene', observed=True).size() if 'Gene' in df.columns else {}
         
         for gene in unique_genes:
-            gene_variants = df[df['Gene'] == gene]
-            variant_count = len(gene_variants)
+            variant_count = int(gene_rows.get(gene, 0))
             
             genes[gene] = {
                 'symbol': gene,
@@ -97,31 +215,10 @@ def process_csv_data(csv_path):
             }
         
         # Create variant entries for search (deduplicate by gene + variant_string)
-        variants_dict = {}
-        for _, row in df.iterrows():
-            if pd.notna(row.get('ref_aa')) and pd.notna(row.get('alt_aa')) and pd.notna(row.get('protein_start')):
-                variant_id = f"{row.get('ref_aa', '')}{row.get('protein_start', '')}{row.get('alt_aa', '')}"
-                protein_change = f"p.{row.get('ref_aa', '')}{row.get('protein_start', '')}{row.get('alt_aa', '')}"
-                gene = row.get('Gene', '')
-                drug = row.get('Drug', '')
-                
-                # Create unique key for variant
-                variant_key = f"{gene}_{variant_id}"
-                
-                if variant_key not in variants_dict:
-                    variants_dict[variant_key] = {
-                        'gene': gene,
-                        'variant_string': variant_id,
-                        'protein_change': protein_change,
-                        'consequence': 'missense_variant',
-                        'drugs_tested': [drug]
-                    }
-                else:
-                    # Add drug if not already in list
-                    if drug not in variants_dict[variant_key]['drugs_tested']:
-                        variants_dict[variant_key]['drugs_tested'].append(drug)
-        
-        variants = list(variants_dict.values())
+        if engine == 'legacy':
+            variants = variant_search_entries_legacy(df)
+        else:
+            variants = variant_search_entries(df)
         
         logger.info(f"Processed {len(genes)} genes, {len(drugs)} drugs, {len(variants)} variants from CSV")
         return genes, drugs, variants
@@ -130,8 +227,13 @@ def process_csv_data(csv_path):
         logger.error(f"Error processing CSV: {str(e)}")
         return {}, {}, []
 
-def collect_genes_from_variants(variants_dir):
-    """Extract gene information from variant files (legacy)."""
+def collect_genes_from_variants(variants_dir, cache_path=None, workers=None):
+    """Extract gene information from variant files (legacy).
+
+    Reads flat {Gene}_{variant}.json datacards, per-gene directories and
+    shards in parallel; see variant_scanner. A variant found in more than
+    one file is counted once.
+    """
     genes = {}
     drugs = {}
     variants = []
@@ -140,75 +242,66 @@ def collect_genes_from_variants(variants_dir):
         logger.warning(f"Variants directory not found: {variants_dir}")
         return {}, {}, []
     
-    # Walk through gene directories
-    for gene_dir in variants_dir.iterdir():
-        if not gene_dir.is_dir():
+    seen = set()
+    for summary in scan_variant_summaries(variants_dir, cache_path=cache_path, workers=workers):
+        gene_symbol = summary['gene']
+        variant_string = summary['variant_string']
+        if (gene_symbol, variant_string) in seen:
             continue
+        seen.add((gene_symbol, variant_string))
         
-        gene_symbol = gene_dir.name
-        variant_count = 0
-        
-        # Process variants for this gene
-        for variant_file in gene_dir.glob("*.json"):
-            variant_count += 1
-            
-            # Load variant data for search index
-            try:
-                with open(variant_file, 'r') as f:
-                    variant_data = json.load(f)
-                
-                # Collect drugs from variant data
-                for drug in variant_data.get('drugs_tested', []):
-                    if drug not in drugs:
-                        drugs[drug] = {
-                            'name': drug,
-                            'synonyms': [],
-                            'fda_status': 'Investigational',
-                            'target_class': 'Unknown',
-                            'mechanism': 'Unknown',
-                            'variant_count': 0
-                        }
-                    drugs[drug]['variant_count'] += 1
-                
-                # Create search-optimized variant entry
-                variants.append({
-                    'gene': gene_symbol,
-                    'variant_string': variant_data.get('variant_string', ''),
-                    'protein_change': variant_data.get('protein_change', ''),
-                    'ic50': variant_data.get('ic50_estimate', 'N/A'),
-                    'qc_pass': variant_data.get('qc_pass', False),
-                    'searchable_text': f"{gene_symbol} {variant_data.get('variant_string', '')} {variant_data.get('protein_change', '')}"
-                })
-            except Exception as e:
-                logger.warning(f"Failed to process variant file {variant_file}: {e}")
+        # Collect drugs from variant data
+        for drug in summary['drugs_tested']:
+            if drug not in drugs:
+                drugs[drug] = {
+                    'name': drug,
+                    'synonyms': [],
+                    'fda_status': 'Investigational',
+                    'target_class': 'Unknown',
+                    'mechanism': 'Unknown',
+                    'variant_count': 0
+                }
+            drugs[drug]['variant_count'] += 1
         
-        if variant_count > 0:
+        if gene_symbol not in genes:
             genes[gene_symbol] = {
                 'symbol': gene_symbol,
                 'name': f'{gene_symbol} gene',
                 'synonyms': [],
                 'chromosome': '',
-                'variant_count': variant_count
+                'variant_count': 0
             }
+        genes[gene_symbol]['variant_count'] += 1
+        
+        # Create search-optimized variant entry
+        variants.append({
+            'gene': gene_symbol,
+            'variant_string': variant_string,
+            'protein_change': summary['protein_change'],
+            'ic50': summary['ic50'],
+            'qc_pass': summary['qc_pass'],
+            'searchable_text': f"{gene_symbol} {variant_string} {summary['protein_change']}"
+        })
     
     return genes, drugs, variants
 
-def main():
-    """Main search index building routine."""
-    project_root = Path(__file__).parent.parent.parent
-    variants_dir = project_root / "public" / "data" / "v1.0" / "variants"
-    csv_path = project_root / "data" / "raw" / "master_qDMS_df.csv"
-    output_file = project_root / "public" / "data" / "v1.0" / "search_index.json"
+def build_search_index(csv_path, variants_dir, output_file, formats=DEFAULT_FORMATS, engine='vectorized'):
+    """Build the search index from the CSV (or variant files) and save it.
     
+    formats picks the files to write: the full search_index.json, the
+    sharded search/ directory and/or the columnar search_index_columnar.json.
+    Returns the search index.
+    """
     logger.info("Building search index...")
     
     # First try to process CSV data
-    genes, drugs, variants = process_csv_data(csv_path)
+    genes, drugs, variants = process_csv_data(csv_path, engine=engine)
     
     # If CSV processing didn't yield results, fall back to variant files
     if not genes and not drugs:
         logger.info("No CSV data found, falling back to variant files...")
-        genes, drugs, variants = collect_genes_from_variants(variants_dir)
+        cache_path = default_cache_dir(csv_path) / VARIANT_SCAN_CACHE_NAME
+        genes, drugs, variants = collect_genes_from_variants(variants_dir, cache_path=cache_path)
     
     # Add default drugs if none found
     if not drugs:
@@ -257,11 +350,53 @@ def main():
     output_file.parent.mkdir(parents=True, exist_ok=True)
     
     # Save search index
-    with open(output_file, 'w') as f:
-        json.dump(search_index, f, indent=2, ensure_ascii=False)
-    
-    logger.info(f"Search index saved: {output_file}")
+    if 'full' in formats:
+        with stage_timer('write'), open(output_file, 'w') as f:
+            json.dump(search_index, f, indent=2, ensure_ascii=False)
+        logger.info(f"Search index saved: {output_file}")
     logger.info(f"Index contains: {len(genes)} genes, {len(drugs)} drugs, {len(variants)} variants")
+    
+    # Save the sharded index next to it for clients that load variants on demand
+    if 'sharded' in formats:
+        shards_dir = output_file.with_name(SHARDED_INDEX_DIR_NAME)
+        write_json_tree(build_sharded_index(search_index), shards_dir)
+        root_file = shards_dir / SHARD_ROOT_NAME
+        logger.info(f"Sharded index saved: {shards_dir} (root {root_file.stat().st_size / 1e3:.1f} kB)")
+    
+    if 'columnar' in formats:
+        try:
+            columnar_index = encode_columnar_index(search_index)
+        except ValueError as e:
+            logger.warning(f"Skipping columnar search index: {e}")
+        else:
+            columnar_file = output_file.with_name(COLUMNAR_INDEX_NAME)
+            write_json_file(columnar_file, columnar_index)
+            logger.info(f"Columnar index saved: {columnar_file} ({columnar_file.stat().st_size / 1e3:.1f} kB)")
+    return search_index
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Build the search index from the qDMS screening data")
+    parser.add_argument('--format', nargs='+', choices=OUTPUT_FORMATS, default=DEFAULT_FORMATS,
+                        help="Search index files to write: the full search_index.json, a search/ directory "
+                             "with a root index and per-gene variant shards, and/or search_index_columnar.json "
+                             "with variants as parallel arrays (default: full sharded)")
+    parser.add_argument('--engine', choices=['vectorized', 'legacy'], default='vectorized',
+                        help="Search entry extraction engine (default: vectorized)")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    """Main search index building routine."""
+    args = parse_args()
+    project_root = Path(__file__).parent.parent.parent
+    variants_dir = project_root / "public" / "data" / "v1.0" / "variants"
+    csv_path = project_root / "data" / "raw" / "master_qDMS_df.csv"
+    output_file = project_root / "public" / "data" / "v1.0" / "search_index.json"
+    
+    with profile_run('build_search_index', profile=args.profile, cpu=args.profile_cpu,
+                     memory_top=args.profile_memory):
+        build_search_index(csv_path, variants_dir, output_file, formats=args.format, engine=args.engine)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
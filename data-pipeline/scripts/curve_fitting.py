@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Four-parameter logistic (4PL / Hill) dose-response fitting.
+Fits every variant-drug curve of a screen across a process pool, with
+rows grouped into chunks so each task amortizes its pickling overhead.
+"""
+
+import os
+import warnings
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import curve_fit, OptimizeWarning
+import logging
+
+from stage_timers import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# z-score for the 95% confidence interval on log10(IC50)
+CI_Z = 1.959964
+
+DEFAULT_CHUNK_SIZE = 256
+
+# Unique doses a curve needs so the 4-parameter model keeps one residual
+# degree of freedom for r_squared and the IC50 confidence interval
+MIN_FIT_DOSES = 5
+
+def four_parameter_logistic(log_dose, top, bottom, log_ic50, hill_slope):
+    """4PL model evaluated on log10 doses."""
+    return bottom + (top - bottom) / (1 + 10 ** ((log_dose - log_ic50) * hill_slope))
+
+def four_parameter_logistic_jacobian(log_dose, top, bottom, log_ic50, hill_slope):
+    """Partial derivatives of the 4PL model with respect to each parameter."""
+    power = 10 ** ((log_dose - log_ic50) * hill_slope)
+    denominator = 1 + power
+    shape = 1 / denominator
+    slope_term = (top - bottom) * power * np.log(10) / denominator ** 2
+    return np.column_stack([
+        shape,
+        1 - shape,
+        slope_term * hill_slope,
+        -slope_term * (log_dose - log_ic50)
+    ])
+
+def initial_guesses(doses, responses, measured, ic50_guess):
+    """Compute starting parameters for every row at once.
+
+    Returns a (n_rows, 4) array of top, bottom, log10(IC50) and Hill slope,
+    warm-started from the interpolated IC50 where one is available.
+    """
+    masked = np.where(measured, responses, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        top = np.nanmean(masked[:, 0, :], axis=1)
+        bottom = np.nanmean(masked[:, -1, :], axis=1)
+        top = np.where(np.isfinite(top), top, np.nanmax(masked, axis=(1, 2)))
+        bottom = np.where(np.isfinite(bottom), bottom, np.nanmin(masked, axis=(1, 2)))
+
+    default_ic50 = np.sqrt(doses.min() * doses.max())
+    ic50_start = np.where(np.isfinite(ic50_guess) & (ic50_guess > 0), ic50_guess, default_ic50)
+
+    return np.column_stack([top, bottom, np.log10(ic50_start), np.ones(len(top))])
+
+def fit_chunk(log_doses, responses, measured, guesses, log_dose_bounds):
+    """Fit a chunk of rows; runs inside a worker process."""
+    n_rows = len(responses)
+    params = np.full((n_rows, 4), np.nan)
+    log_ic50_se = np.full(n_rows, np.nan)
+    r_squared = np.full(n_rows, np.nan)
+    converged = np.zeros(n_rows, dtype=bool)
+
+    lower = [-np.inf, -np.inf, log_dose_bounds[0], 0.1]
+    upper = [np.inf, np.inf, log_dose_bounds[1], 10.0]
+
+    for i in range(n_rows):
+        x = np.broadcast_to(log_doses[:, None], measured[i].shape)[measured[i]]
+        y = responses[i][measured[i]]
+        if len(np.unique(x)) < MIN_FIT_DOSES:
+            continue
+
+        p0 = np.clip(guesses[i], lower, upper)
+        try:
+            with np.errstate(over='ignore', invalid='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', OptimizeWarning)
+                popt, pcov = curve_fit(four_parameter_logistic, x, y, p0=p0,
+                                       jac=four_parameter_logistic_jacobian,
+                                       bounds=(lower, upper), max_nfev=2000)
+        except (RuntimeError, ValueError):
+            continue
+
+        params[i] = popt
+        if np.isfinite(pcov[2, 2]):
+            log_ic50_se[i] = np.sqrt(pcov[2, 2])
+
+        # A parameter pinned at a bound or an undefined IC50 variance means
+        # the optimizer stopped without finding a real minimum
+        at_bound = np.isclose(popt, lower) | np.isclose(popt, upper)
+        converged[i] = np.isfinite(pcov[2, 2]) and not at_bound.any()
+
+        with np.errstate(over='ignore'):
+            residuals = y - four_parameter_logistic(x, *popt)
+        total = np.sum((y - y.mean()) ** 2)
+        if total > 0:
+            r_squared[i] = 1 - np.sum(residuals ** 2) / total
+
+    return params, log_ic50_se, r_squared, converged
+
+@stage_timer('fit')
+def fit_dose_response_curves(doses, responses, measured, ic50_guess, workers=None,
+                             chunk_size=DEFAULT_CHUNK_SIZE):
+    """Fit a 4PL curve to every row of a dose-response tensor.
+
+    doses is the shared dose axis, responses and measured are
+    (n_rows, n_doses, n_replicates) arrays and ic50_guess holds the
+    interpolated IC50 used to warm-start each fit. Rows with fewer than
+    MIN_FIT_DOSES measured doses are left unfitted. Returns a dict of
+    per-row arrays: top, bottom, ic50, hill_slope, ic50_ci_low,
+    ic50_ci_high, r_squared, fitted and converged.
+    """
+    doses = np.asarray(doses, dtype=np.float64)
+    n_rows = len(responses)
+
+    # Zero doses cannot be placed on a log axis
+    dose_mask = doses > 0
+    if dose_mask.sum() < MIN_FIT_DOSES:
+        logger.warning(f"Fewer than {MIN_FIT_DOSES} positive doses; skipping curve fitting")
+        return empty_fits(n_rows)
+    doses = doses[dose_mask]
+    responses = responses[:, dose_mask, :]
+    measured = measured[:, dose_mask, :]
+
+    log_doses = np.log10(doses)
+    log_dose_bounds = (log_doses.min() - 3, log_doses.max() + 3)
+    guesses = initial_guesses(doses, responses, measured, ic50_guess)
+
+    workers = workers or os.cpu_count() or 1
+    chunks = [
+        (log_doses, responses[start:start + chunk_size], measured[start:start + chunk_size],
+         guesses[start:start + chunk_size], log_dose_bounds)
+        for start in range(0, n_rows, chunk_size)
+    ]
+    logger.info(f"Fitting {n_rows} dose-response curves in {len(chunks)} chunks with {workers} workers")
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [fit_chunk(*chunk) for chunk in chunks]
+    else:
+        # Spawn workers: the pipeline runner calls this from a thread, and
+        # forking a multi-threaded process can deadlock on inherited locks
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = list(executor.map(fit_chunk, *zip(*chunks)))
+
+    if not results:
+        return empty_fits(0)
+
+    params = np.concatenate([r[0] for r in results])
+    log_ic50_se = np.concatenate([r[1] for r in results])
+    r_squared = np.concatenate([r[2] for r in results])
+    converged = np.concatenate([r[3] for r in results])
+    fits = build_fits(params, log_ic50_se, r_squared, converged)
+    logger.info(f"Converged {int(fits['converged'].sum())} of {n_rows} curve fits")
+    return fits
+
+def build_fits(params, log_ic50_se, r_squared, converged):
+    """Convert raw fit parameters into the per-row result arrays.
+
+    fitted marks rows curve_fit ran on and returned parameters for;
+    converged marks fits where curve_fit succeeded, every bounded
+    parameter stayed off its bounds and the IC50 variance is finite.
+    """
+    log_ic50 = params[:, 2]
+    with np.errstate(over='ignore', invalid='ignore'):
+        ci_low = 10 ** (log_ic50 - CI_Z * log_ic50_se)
+        ci_high = 10 ** (log_ic50 + CI_Z * log_ic50_se)
+    return {
+        'top': params[:, 0],
+        'bottom': params[:, 1],
+        'ic50': 10 ** log_ic50,
+        'hill_slope': params[:, 3],
+        'ic50_ci_low': ci_low,
+        'ic50_ci_high': ci_high,
+        'r_squared': r_squared,
+        'fitted': np.isfinite(log_ic50),
+        'converged': converged
+    }
+
+def empty_fits(n_rows):
+    """Return unconverged fit results for n_rows rows."""
+    return build_fits(np.full((n_rows, 4), np.nan), np.full(n_rows, np.nan), np.full(n_rows, np.nan),
+                      np.zeros(n_rows, dtype=bool))
+
+def fit_summary(fits, i):
+    """Return the JSON-ready fit record for row i."""
+    def value(name):
+        v = float(fits[name][i])
+        return v if np.isfinite(v) else None
+
+    return {
+        'model': '4PL',
+        'fitted': bool(fits['fitted'][i]),
+        'converged': bool(fits['converged'][i]),
+        'ic50': value('ic50'),
+        'ic50_ci_low': value('ic50_ci_low'),
+        'ic50_ci_high': value('ic50_ci_high'),
+        'top': value('top'),
+        'bottom': value('bottom'),
+        'hill_slope': value('hill_slope'),
+        'r_squared': value('r_squared')
+    }
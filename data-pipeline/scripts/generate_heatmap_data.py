@@ -5,12 +5,23 @@ This script processes the qDMS data and creates a 2D matrix showing
 net growth rate values for each position-amino acid combination.
 """
 
+import sys
 import pandas as pd
 import numpy as np
 import json
+import time
+import argparse
 import logging
 from pathlib import Path
 
+from heatmap_tensor import (assign_dose_levels, build_heatmap_tensor, heatmap_value_ranges, tensor_to_matrices, tensor_to_compact,
+                            build_split_files, write_heatmap_binary, DOSE_LEVELS)
+from json_writer import write_json_file, write_json_tree
+from stage_timers import stage_timer
+from run_profile import add_profile_arguments, profile_run
+from screening_data import (load_screening_data, iter_screening_partitions, peak_rss_mb, UnsortedInputError,
+                            DEFAULT_MEMORY_BUDGET_MB, DEFAULT_CHUNK_ROWS)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,36 +29,100 @@ logger = logging.getLogger(__name__)
 # Constants
 AMINO_ACIDS = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
 
-def main():
-    """Main processing function"""
-    
-    # Set up paths
-    base_path = Path(__file__).parent.parent.parent
-    input_path = base_path / "data" / "raw" / "master_qDMS_df.csv"
-    output_path = base_path / "public" / "data" / "v1.0" / "heatmap_data.json"
-    
-    # Ensure output directory exists
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+COMPACT_FILE_NAME = "heatmap_compact.json"
+BINARY_HEADER_NAME = "heatmap_tensors.json"
+BINARY_DATA_NAME = "heatmap_tensors.bin"
+SPLIT_DIR_NAME = "heatmap"
+
+# Heat map files generate_heatmap can write, and those written by default
+OUTPUT_FORMATS = ['nested', 'compact', 'split', 'binary']
+DEFAULT_FORMATS = ['nested', 'compact', 'split']
+
+# Columns the heatmap statistics are grouped by
+STAT_COLUMNS = ['species', 'protein_start', 'alt_aa', 'ref_aa', 'conc', 'Gene', 'Drug']
+
+@stage_timer('group')
+def aggregate_heatmap_stats(df):
+    """Mean, std and count of netgr_obs per species, drug and concentration."""
+    # Filter to canonical amino acids only
+    df_canonical = df[df['alt_aa'].isin(AMINO_ACIDS)]
+    df_canonical = df_canonical[df_canonical['conc'].notna()]
     
-    logger.info(f"Loading data from: {input_path}")
+    # Calculate aggregated statistics; dose levels are assigned afterwards
+    # from each drug's full concentration series
+    aggregated_stats = df_canonical.groupby(STAT_COLUMNS, observed=True)['netgr_obs'].agg(['mean', 'std', 'count']).reset_index()
+    return aggregated_stats, len(df_canonical)
+
+def stream_heatmap_stats(input_path, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, chunk_rows=DEFAULT_CHUNK_ROWS,
+                         assume_sorted=False):
+    """Aggregate heatmap statistics one partition of the CSV at a time.
     
-    # Load data
-    df = pd.read_csv(input_path)
-    logger.info(f"Loaded {len(df)} measurements")
+    Partitions hold whole positions, so every group's statistics come from
+    a single partition and match the in-memory result exactly.
+    """
+    partition_stats = []
+    measurements = 0
+    canonical = 0
+    for partition in iter_screening_partitions(input_path, memory_budget_mb=memory_budget_mb,
+                                               chunk_rows=chunk_rows, assume_sorted=assume_sorted):
+        stats, partition_canonical = aggregate_heatmap_stats(partition)
+        partition_stats.append(stats)
+        measurements += len(partition)
+        canonical += partition_canonical
     
-    # Filter to canonical amino acids only
-    df_canonical = df[df['alt_aa'].isin(AMINO_ACIDS)]
-    logger.info(f"Filtered to {len(df_canonical)} measurements with canonical amino acids")
+    # Restore the group order of a single groupby over the whole frame
+    aggregated_stats = pd.concat(partition_stats, ignore_index=True)
+    aggregated_stats = aggregated_stats.sort_values(STAT_COLUMNS, kind='stable', ignore_index=True)
+    return aggregated_stats, measurements, canonical
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Generate heat map data from the qDMS screening data")
+    parser.add_argument('--engine', choices=['vectorized', 'legacy'], default='vectorized',
+                        help="Heat map matrix builder (default: vectorized)")
+    parser.add_argument('--format', nargs='+', choices=OUTPUT_FORMATS, default=DEFAULT_FORMATS,
+                        help="Heat map files to write: nested heatmap_data.json, the flat-array "
+                             "heatmap_compact.json, a heatmap/ directory with a manifest and one file per "
+                             "drug, and/or Float32/Uint16 heatmap_tensors.bin with its JSON header "
+                             "(default: nested compact split)")
+    parser.add_argument('--split-doses', action='store_true',
+                        help="With the split format, write one file per drug and dose level")
+    parser.add_argument('--doses', type=float, nargs='+', default=None,
+                        help="Concentrations (μM) to use as dose levels for every drug; other concentrations "
+                             "are dropped (default: each drug's own concentration series)")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Read the CSV in chunks instead of loading it all at once")
+    parser.add_argument('--memory-budget-mb', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"Target peak memory for --streaming (default: {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"CSV rows read per chunk with --streaming (default: {DEFAULT_CHUNK_ROWS})")
+    parser.add_argument('--sorted-input', action='store_true',
+                        help="With --streaming, the CSV is sorted by Gene and protein_start, so no spill files are needed")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+@stage_timer('matrices')
+def build_heatmap_data(aggregated_stats, dose_axis, engine='vectorized', tensor=None):
+    """Build the per-drug position vs amino acid matrices from aggregated statistics.
     
-    # Create dose level categories
-    dose_mapping = {5: 'low', 30: 'medium', 100: 'high'}
-    df_canonical['dose_level'] = df_canonical['conc'].map(dose_mapping)
-    df_canonical = df_canonical[df_canonical['dose_level'].notna()]
+    aggregated_stats needs a dose_level column (see assign_dose_levels).
+    """
+    if engine == 'legacy':
+        if dose_axis['levels'] != DOSE_LEVELS:
+            raise ValueError(f"The legacy heat map builder only supports the dose levels {DOSE_LEVELS}")
+        return build_heatmap_data_legacy(aggregated_stats, dose_axis)
     
-    # Calculate aggregated statistics
-    aggregated_stats = df_canonical.groupby(['species', 'protein_start', 'alt_aa', 'ref_aa', 'dose_level', 'Gene', 'Drug'])['netgr_obs'].agg(['mean', 'std', 'count']).reset_index()
-    logger.info(f"Calculated statistics for {len(aggregated_stats)} species-drug-dose combinations")
+    if tensor is None:
+        tensor = build_heatmap_tensor(aggregated_stats, AMINO_ACIDS, dose_levels=dose_axis['levels'])
+    drug_value_ranges, drug_data_counts = heatmap_value_ranges(tensor)
+    drug_matrices = tensor_to_matrices(tensor)
     
+    gene = aggregated_stats['Gene'].iloc[0]
+    return assemble_heatmap_data(gene, tensor['positions'].tolist(), tensor['drugs'], drug_matrices,
+                                 drug_value_ranges, drug_data_counts, dose_axis)
+
+def build_heatmap_data_legacy(aggregated_stats, dose_axis):
+    """Row-by-row reference implementation of build_heatmap_data."""
     # Get all positions with data and reference amino acids per position
     all_positions = sorted(aggregated_stats['protein_start'].unique())
     position_ref_aa = {}
@@ -55,12 +130,8 @@ def main():
         position = int(row['protein_start'])
         position_ref_aa[position] = row['ref_aa']
     
-    logger.info(f"Position range: {min(all_positions)} to {max(all_positions)}")
-    logger.info(f"Total positions with data: {len(all_positions)}")
-    
     # Get unique drugs
     unique_drugs = sorted(aggregated_stats['Drug'].unique())
-    logger.info(f"Drugs found: {unique_drugs}")
     
     # Create position vs amino acid matrix PER DRUG
     drug_matrices = {}
@@ -119,22 +190,6 @@ def main():
         
         drug_matrices[drug] = position_aa_matrix
     
-    # Create variant lookup (shared across drugs)
-    variant_lookup = {}
-    # Use first drug's matrix to build variant lookup
-    first_drug_matrix = drug_matrices[unique_drugs[0]]
-    for position_str, aa_data in first_drug_matrix.items():
-        position = int(position_str)
-        for aa, dose_data in aa_data.items():
-            ref_aa = dose_data.get('ref_aa', 'X')
-            variant_id = f"{ref_aa}{position}{aa}"
-            variant_lookup[f"{position}_{aa}"] = {
-                'id': variant_id,
-                'position': position,
-                'amino_acid': aa,
-                'variant_string': variant_id
-            }
-    
     # Calculate value ranges per drug
     drug_value_ranges = {}
     drug_data_counts = {}
@@ -168,8 +223,47 @@ def main():
         drug_value_ranges[drug] = value_range
         drug_data_counts[drug] = data_counts
     
-    # Get metadata
     gene = aggregated_stats['Gene'].iloc[0]
+    return assemble_heatmap_data(gene, all_positions, unique_drugs, drug_matrices, drug_value_ranges, drug_data_counts,
+                                 dose_axis)
+
+def build_variant_lookup(matrix):
+    """Variant lookup shared across drugs, built from one drug's matrix."""
+    variant_lookup = {}
+    for position_str, aa_data in matrix.items():
+        position = int(position_str)
+        for aa, dose_data in aa_data.items():
+            ref_aa = dose_data.get('ref_aa', 'X')
+            variant_id = f"{ref_aa}{position}{aa}"
+            variant_lookup[f"{position}_{aa}"] = {
+                'id': variant_id,
+                'position': position,
+                'amino_acid': aa,
+                'variant_string': variant_id
+            }
+    return variant_lookup
+
+def dose_column_descriptions(dose_axis):
+    """data_columns entries describing each dose level."""
+    descriptions = {}
+    for level, dose in enumerate(dose_axis['levels']):
+        concentrations = {series[level] for series in dose_axis['concentrations'].values() if level < len(series)}
+        if len(concentrations) == 1:
+            descriptions[dose] = f"Mean netgr_obs values at {concentrations.pop():g} μM concentration across replicates"
+        else:
+            descriptions[dose] = (f"Mean netgr_obs values at each drug's dose level {level + 1} "
+                                  f"(see dose_concentrations) across replicates")
+    return descriptions
+
+def assemble_heatmap_data(gene, all_positions, unique_drugs, drug_matrices, drug_value_ranges, drug_data_counts,
+                          dose_axis):
+    """Wrap per-drug matrices, value ranges and counts with metadata."""
+    logger.info(f"Position range: {min(all_positions)} to {max(all_positions)}")
+    logger.info(f"Total positions with data: {len(all_positions)}")
+    logger.info(f"Drugs found: {unique_drugs}")
+    
+    # Use first drug's matrix to build variant lookup
+    variant_lookup = build_variant_lookup(drug_matrices[unique_drugs[0]])
     
     # Count total unique variants across all drugs
     total_variants = len(variant_lookup)
@@ -189,21 +283,20 @@ def main():
         'value_ranges': drug_value_ranges,
         'data_counts': drug_data_counts,
         'description': 'Mean netgr_obs values by protein position, amino acid substitution, drug, and dose level',
-        'dose_levels': ['low', 'medium', 'high'],
+        'dose_levels': dose_axis['levels'],
+        'dose_concentrations': dose_axis['concentrations'],
         'data_columns': {
-            'low': 'Mean netgr_obs values at 5 μM concentration across replicates',
-            'medium': 'Mean netgr_obs values at 30 μM concentration across replicates', 
-            'high': 'Mean netgr_obs values at 100 μM concentration across replicates',
+            **dose_column_descriptions(dose_axis),
             'std': 'Standard deviation across replicates for each concentration',
             'count': 'Number of replicates/measurements for each concentration',
             'ref_aa': 'Reference (wild-type) amino acid at this position'
         }
     }
     
-    logger.info(f"Generated heat map matrices: {len(all_positions)} positions × {len(AMINO_ACIDS)} amino acids × {len(unique_drugs)} drugs × 3 dose levels")
+    logger.info(f"Generated heat map matrices: {len(all_positions)} positions × {len(AMINO_ACIDS)} amino acids × {len(unique_drugs)} drugs × {len(dose_axis['levels'])} dose levels")
     for drug in unique_drugs:
         counts = drug_data_counts[drug]
-        logger.info(f"{drug} data points - Low: {counts['low']}, Medium: {counts['medium']}, High: {counts['high']}")
+        logger.info(f"{drug} data points - " + ", ".join(f"{dose.capitalize()}: {count}" for dose, count in counts.items()))
     
     # Assemble final data with drug-specific matrices
     heatmap_data = {
@@ -213,13 +306,92 @@ def main():
         'variant_lookup': variant_lookup
     }
     
+    return heatmap_data
+
+def generate_heatmap(input_path, output_path, engine='vectorized', formats=DEFAULT_FORMATS, split_doses=False,
+                     doses=None, streaming=False, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, chunk_rows=DEFAULT_CHUNK_ROWS,
+                     assume_sorted=False):
+    """Aggregate the screening data into heatmap matrices and save them.
+    
+    output_path is the nested heatmap_data.json; the other formats are
+    written next to it. Returns the heatmap data.
+    """
+    # Ensure output directory exists
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    logger.info(f"Loading data from: {input_path}")
+    
+    if streaming:
+        aggregated_stats, measurements, canonical = stream_heatmap_stats(
+            input_path, memory_budget_mb=memory_budget_mb, chunk_rows=chunk_rows, assume_sorted=assume_sorted)
+    else:
+        df = load_screening_data(input_path)
+        measurements = len(df)
+        aggregated_stats, canonical = aggregate_heatmap_stats(df)
+    logger.info(f"Loaded {measurements} measurements")
+    logger.info(f"Filtered to {canonical} measurements with canonical amino acids")
+    logger.info(f"Calculated statistics for {len(aggregated_stats)} species-drug-dose combinations")
+    
+    aggregated_stats, dose_axis = assign_dose_levels(aggregated_stats, doses=doses)
+    for drug, concentrations in dose_axis['concentrations'].items():
+        logger.info(f"{drug} dose series (μM): {concentrations}")
+    
+    start = time.perf_counter()
+    needs_tensor = engine != 'legacy' or any(fmt in formats for fmt in ['compact', 'split', 'binary'])
+    tensor = build_heatmap_tensor(aggregated_stats, AMINO_ACIDS, dose_levels=dose_axis['levels']) if needs_tensor else None
+    heatmap_data = build_heatmap_data(aggregated_stats, dose_axis, engine=engine, tensor=tensor)
+    logger.info(f"Built heat map matrices with the {engine} engine in {time.perf_counter() - start:.2f}s")
+    metadata = heatmap_data['metadata']
+    
     # Save to file
-    with open(output_path, 'w') as f:
-        json.dump(heatmap_data, f, indent=2, default=str)
+    if 'nested' in formats:
+        with stage_timer('write'), open(output_path, 'w') as f:
+            json.dump(heatmap_data, f, indent=2, default=str)
+        logger.info(f"Heat map data saved: {output_path}")
+    
+    if 'compact' in formats:
+        compact_path = output_path.with_name(COMPACT_FILE_NAME)
+        write_json_file(compact_path, tensor_to_compact(tensor, metadata))
+        logger.info(f"Compact heat map data saved: {compact_path} "
+                    f"({compact_path.stat().st_size / 1e6:.2f} MB)")
+    
+    if 'split' in formats:
+        split_dir = output_path.with_name(SPLIT_DIR_NAME)
+        write_json_tree(build_split_files(tensor, metadata, split_doses=split_doses), split_dir)
+        logger.info(f"Per-drug heat map files saved: {split_dir}")
+    
+    if 'binary' in formats:
+        header_path = output_path.with_name(BINARY_HEADER_NAME)
+        data_path = output_path.with_name(BINARY_DATA_NAME)
+        write_heatmap_binary(tensor, metadata, header_path, data_path)
+        logger.info(f"Binary heat map tensors saved: {data_path} ({data_path.stat().st_size / 1e6:.2f} MB), "
+                    f"header {header_path}")
     
-    logger.info(f"Heat map data saved: {output_path}")
     logger.info(f"Generated data for {len(AMINO_ACIDS)} amino acids")
     logger.info(f"Total variants processed: {metadata['total_variants']}")
+    if streaming:
+        logger.info(f"Peak RSS: {peak_rss_mb() or 0:.0f} MB")
+    return heatmap_data
+
+def main():
+    """Main processing function"""
+    args = parse_args()
+    
+    # Set up paths
+    base_path = Path(__file__).parent.parent.parent
+    input_path = base_path / "data" / "raw" / "master_qDMS_df.csv"
+    output_path = base_path / "public" / "data" / "v1.0" / "heatmap_data.json"
+    
+    with profile_run('generate_heatmap_data', profile=args.profile,
+                     cpu=args.profile_cpu, memory_top=args.profile_memory):
+        try:
+            generate_heatmap(input_path, output_path, engine=args.engine, formats=args.format,
+                             split_doses=args.split_doses, doses=args.doses, streaming=args.streaming,
+                             memory_budget_mb=args.memory_budget_mb, chunk_rows=args.chunk_rows,
+                             assume_sorted=args.sorted_input)
+        except UnsortedInputError as e:
+            logger.error(f"{e}: {input_path}")
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
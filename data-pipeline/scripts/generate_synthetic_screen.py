@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Synthetic qDMS screen generator for load testing the pipeline.
+Writes CSVs with the master_qDMS_df.csv schema at any scale: genes of
+configurable length, variants per position, drugs, dose series, cell
+lines and replicates, with sigmoidal dose responses and randomly missing
+replicates. Rows are generated and written one block at a time, so tens
+of millions of rows never have to fit in memory. Screens are written
+outside data/raw by default, so validation and the pipeline never pick
+them up.
+
+Usage:
+    python data-pipeline/scripts/generate_synthetic_screen.py --genes 20 --drugs 4 \
+        --output data-pipeline/benchmarks/results/data/synthetic_qDMS_df.csv
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import logging
+
+from screening_data import SCREENING_COLUMNS
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = Path(__file__).parent.parent / "benchmarks" / "results" / "data" / "synthetic_qDMS_df.csv"
+
+AMINO_ACIDS = list('ACDEFGHIKLMNPQRSTVWY')
+
+# Drugs of the bundled screen come first, then generated names
+KNOWN_DRUGS = ['Imatinib', 'Hollyniacine', 'Dasatinib', 'Nilotinib']
+
+DEFAULT_DOSES = [5.0, 30.0, 100.0]
+
+# Response model: net growth of a variant at concentration c is
+# growth * (1 - c**hill / (c**hill + ic50**hill)) + noise
+WILD_TYPE_GROWTH = 0.06
+MEDIAN_IC50 = 20.0
+RESISTANT_FRACTION = 0.05
+NOISE_STD = 0.004
+
+def drug_names(count):
+    """Names for count drugs."""
+    return KNOWN_DRUGS[:count] + [f"Drug{i + 1}" for i in range(len(KNOWN_DRUGS), count)]
+
+def gene_names(count):
+    """Names for count genes."""
+    return [f"GENE{i + 1}" for i in range(count)]
+
+def gene_variants(rng, length, variants_per_position, first_position=1):
+    """Variant table of one gene: ref_aa, protein_start, alt_aa, species, type, synSNP.
+
+    Each position gets a random reference residue and variants_per_position
+    distinct alternate residues (the reference itself is a synonymous
+    variant), ordered by position then alt_aa.
+    """
+    positions = np.arange(first_position, first_position + length)
+    ref = rng.integers(0, len(AMINO_ACIDS), size=length)
+
+    # A random permutation of residues per position, keeping the first few
+    alts = np.argsort(rng.random((length, len(AMINO_ACIDS))), axis=1)[:, :variants_per_position]
+    alts.sort(axis=1)
+
+    amino_acids = np.array(AMINO_ACIDS)
+    ref_aa = amino_acids[np.repeat(ref, variants_per_position)]
+    alt_aa = amino_acids[alts.ravel()]
+    protein_start = np.repeat(positions, variants_per_position)
+    synonymous = ref_aa == alt_aa
+
+    return pd.DataFrame({
+        'species': np.char.add(np.char.add(ref_aa, protein_start.astype(str)), alt_aa),
+        'type': np.where(synonymous | (rng.random(len(ref_aa)) < 0.2), 'snp', 'mnv'),
+        'synSNP': synonymous,
+        'ref_aa': ref_aa,
+        'protein_start': protein_start,
+        'alt_aa': alt_aa
+    })
+
+def variant_response_params(rng, variants):
+    """Per-variant growth rate, IC50 and Hill slope for one drug and cell line.
+
+    Synonymous variants grow like wild type; other variants lose some
+    fitness, and a small fraction are strongly resistant to the drug.
+    """
+    count = len(variants)
+    synonymous = variants['synSNP'].to_numpy()
+    fitness = np.where(synonymous, 1.0, rng.beta(5, 2, size=count))
+    growth = WILD_TYPE_GROWTH * fitness * rng.lognormal(0, 0.1)
+
+    ic50 = MEDIAN_IC50 * rng.lognormal(0, 0.5, size=count) * rng.lognormal(0, 0.3)
+    resistant = ~synonymous & (rng.random(count) < RESISTANT_FRACTION)
+    ic50[resistant] *= rng.uniform(10, 50, size=int(resistant.sum()))
+
+    hill = rng.uniform(0.8, 2.0, size=count)
+    return growth, ic50, hill
+
+def sigmoidal_response(conc, growth, ic50, hill):
+    """Net growth rate at conc for each variant."""
+    inhibition = conc ** hill / (conc ** hill + ic50 ** hill)
+    return growth * (1 - inhibition)
+
+def count_rows(args):
+    """Rows the screen would have with no missing replicates."""
+    positions = args.genes * (args.min_length + args.max_length) / 2
+    return int(positions * args.variants_per_position * args.drugs * len(args.doses)
+               * len(args.cell_lines) * args.replicates)
+
+def iter_screen_blocks(args):
+    """Yield DataFrames of screen rows (without the index column), one block at a time.
+
+    Blocks follow the bundled screen's order: for every gene, cell line
+    and drug, each concentration and replicate lists the gene's variants.
+    """
+    rng = np.random.default_rng(args.seed)
+    drugs = drug_names(args.drugs)
+
+    for gene in gene_names(args.genes):
+        length = int(rng.integers(args.min_length, args.max_length + 1))
+        variants = gene_variants(rng, length, args.variants_per_position, first_position=args.first_position)
+
+        for cell_line in args.cell_lines:
+            for drug in drugs:
+                growth, ic50, hill = variant_response_params(rng, variants)
+                for conc in args.doses:
+                    expected = sigmoidal_response(conc, growth, ic50, hill)
+                    for rep in range(1, args.replicates + 1):
+                        observed = expected + rng.normal(0, NOISE_STD, size=len(variants))
+                        present = rng.random(len(variants)) >= args.missing_rate
+
+                        block = variants[present].copy()
+                        block['conc'] = conc
+                        block['netgr_obs'] = observed[present]
+                        block['cell_line'] = cell_line
+                        block['rep'] = rep
+                        block['Gene'] = gene
+                        block['Drug'] = drug
+                        yield block
+
+def write_screen(args):
+    """Generate the screen and stream it to args.output. Returns the row count."""
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(f".{output.name}.tmp")
+    logger.info(f"Generating about {count_rows(args):,} rows into {output}")
+
+    start = time.perf_counter()
+    rows = 0
+    pending = []
+    pending_rows = 0
+
+    def flush(f):
+        nonlocal rows, pending, pending_rows
+        if not pending:
+            return
+        chunk = pd.concat(pending, ignore_index=True)
+        chunk.insert(0, 'index', np.arange(rows, rows + len(chunk)))
+        chunk[SCREENING_COLUMNS].to_csv(f, header=(rows == 0), index=False, float_format='%.9g')
+        rows += len(chunk)
+        pending, pending_rows = [], 0
+        elapsed = time.perf_counter() - start
+        logger.info(f"Wrote {rows:,} rows ({rows / elapsed:,.0f} rows/sec)")
+
+    with open(tmp_path, 'w', newline='') as f:
+        for block in iter_screen_blocks(args):
+            pending.append(block)
+            pending_rows += len(block)
+            if pending_rows >= args.chunk_rows:
+                flush(f)
+        flush(f)
+        if rows == 0:
+            f.write(','.join(SCREENING_COLUMNS) + '\n')
+    os.replace(tmp_path, output)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Generated {rows:,} rows ({output.stat().st_size / 1e6:.1f} MB) in {elapsed:.1f}s")
+    return rows
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Generate a synthetic qDMS screen CSV for load testing")
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT,
+                        help="CSV file to write (default: data-pipeline/benchmarks/results/data/synthetic_qDMS_df.csv)")
+    parser.add_argument('--genes', type=int, default=1, help="Number of genes (default: 1)")
+    parser.add_argument('--min-length', type=int, default=300,
+                        help="Shortest screened protein region in residues (default: 300)")
+    parser.add_argument('--max-length', type=int, default=600,
+                        help="Longest screened protein region in residues (default: 600)")
+    parser.add_argument('--first-position', type=int, default=1,
+                        help="Protein position of the first screened residue (default: 1)")
+    parser.add_argument('--variants-per-position', type=int, default=10,
+                        help=f"Alternate residues per position, 1-{len(AMINO_ACIDS)} (default: 10)")
+    parser.add_argument('--drugs', type=int, default=2, help="Number of drugs (default: 2)")
+    parser.add_argument('--doses', type=float, nargs='+', default=DEFAULT_DOSES,
+                        help="Concentration series in μM (default: 5 30 100)")
+    parser.add_argument('--cell-lines', nargs='+', default=['K562'],
+                        help="Cell lines screened with every drug (default: K562)")
+    parser.add_argument('--replicates', type=int, default=2, help="Replicates per measurement (default: 2)")
+    parser.add_argument('--missing-rate', type=float, default=0.0,
+                        help="Fraction of replicate measurements left out (default: 0)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--chunk-rows', type=int, default=500_000,
+                        help="Rows buffered before each write (default: 500000)")
+    args = parser.parse_args(argv)
+
+    if not 1 <= args.variants_per_position <= len(AMINO_ACIDS):
+        parser.error(f"--variants-per-position must be between 1 and {len(AMINO_ACIDS)}")
+    if not 1 <= args.min_length <= args.max_length:
+        parser.error("--min-length must be at least 1 and no more than --max-length")
+    if args.first_position + args.max_length > np.iinfo(np.int16).max:
+        parser.error("Protein positions must fit the screening data's int16 protein_start column")
+    if not 1 <= args.replicates <= np.iinfo(np.int8).max:
+        parser.error("--replicates must fit the screening data's int8 rep column")
+    if not 0 <= args.missing_rate < 1:
+        parser.error("--missing-rate must be in [0, 1)")
+    return args
+
+def main():
+    """Main entry point."""
+    write_screen(parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Dense heatmap tensors for the position vs amino acid heat map.
+Scatters the aggregated statistics into (drug, position, amino acid,
+dose level) arrays in one pass, so value ranges and data counts are
+array reductions and the nested JSON is only built at the end.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import logging
+
+from json_writer import dumps_json, write_bytes_atomic, write_json_file, content_hash, safe_file_stem
+from stage_timers import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Names used when there are exactly three dose levels
+DOSE_LEVELS = ['low', 'medium', 'high']
+
+# Bump when the compact heatmap layout changes
+COMPACT_FORMAT_VERSION = 1
+
+# Bump when the split heatmap layout changes
+SPLIT_FORMAT_VERSION = 1
+
+SPLIT_MANIFEST_NAME = "manifest.json"
+
+# Bump when the binary heatmap layout changes
+BINARY_FORMAT_VERSION = 1
+
+# Little-endian dtypes of the arrays in the binary heatmap blob, in file order
+BINARY_ARRAYS = {'mean': '<f4', 'std': '<f4', 'count': '<u2'}
+
+# Array offsets are padded to this many bytes so typed-array views line up
+BINARY_ALIGNMENT = 8
+
+# first_row value of cells without data; sorts after every real row
+NO_ROW = np.iinfo(np.int64).max
+
+def dose_level_names(count):
+    """Names of count dose levels, lowest concentration first."""
+    if count == len(DOSE_LEVELS):
+        return list(DOSE_LEVELS)
+    return [f"dose_{level + 1}" for level in range(count)]
+
+def assign_dose_levels(aggregated_stats, doses=None):
+    """Map each row's concentration onto an indexed dose-level axis.
+
+    Without doses, every drug's own sorted concentration series defines
+    its levels, so level i is the drug's i-th lowest concentration. With
+    doses, that series is used for every drug and other concentrations
+    are dropped. Returns (rows with a dose_level column, dose axis) where
+    the dose axis is {'levels': names, 'concentrations': {drug: [conc per level]}}.
+    """
+    conc = aggregated_stats['conc'].to_numpy(dtype=np.float64)
+    drugs = aggregated_stats['Drug'].astype(str).to_numpy()
+
+    if doses is None:
+        level = aggregated_stats.groupby('Drug', observed=True)['conc'].rank(method='dense').to_numpy(dtype=np.int64) - 1
+    else:
+        series = np.sort(np.asarray(doses, dtype=np.float64))
+        level = np.searchsorted(series, conc)
+        level[(level >= len(series)) | (series[np.minimum(level, len(series) - 1)] != conc)] = -1
+
+    keep = level >= 0
+    concentrations = {}
+    for drug in sorted(set(drugs[keep])):
+        drug_levels = keep & (drugs == drug)
+        by_level = pd.Series(conc[drug_levels]).groupby(level[drug_levels]).first()
+        concentrations[drug] = by_level.sort_index().tolist()
+
+    n_levels = int(level.max()) + 1 if keep.any() else 0
+    levels = dose_level_names(len(doses) if doses is not None else n_levels)
+    stats = aggregated_stats[keep].assign(dose_level=np.asarray(levels, dtype=object)[level[keep]])
+    return stats, {'levels': levels, 'concentrations': concentrations}
+
+def axis_codes(values, axis):
+    """Position of each value on axis, -1 for values not on it."""
+    codes, uniques = pd.factorize(values)
+    lookup = pd.Index(axis).get_indexer(pd.Index(uniques).astype(str))
+    return np.where(codes >= 0, lookup[codes], -1)
+
+@stage_timer('tensor')
+def build_heatmap_tensor(aggregated_stats, amino_acids, dose_levels=DOSE_LEVELS, dtype=np.float64):
+    """Scatter aggregated statistics into dense heatmap arrays.
+
+    aggregated_stats has one row per (position, alt_aa, dose_level, Drug)
+    with mean, std and count columns. Returns a dict with:
+      drugs, positions, amino_acids, dose_levels - the axes
+      ref_aa     - reference amino acid per position
+      mean, std  - (drug, position, amino acid, dose) arrays, NaN where empty
+      count      - same shape, 0 where empty
+      first_row  - (drug, position, amino acid) row of aggregated_stats
+                   that first filled each cell, NO_ROW where empty; used to
+                   keep the JSON key order of the row-by-row builder
+    """
+    drugs = sorted(str(drug) for drug in pd.unique(aggregated_stats['Drug']))
+    positions = np.sort(pd.unique(aggregated_stats['protein_start'])).astype(np.int64)
+
+    drug_idx = axis_codes(aggregated_stats['Drug'], drugs)
+    pos_idx = np.searchsorted(positions, aggregated_stats['protein_start'].to_numpy(dtype=np.int64))
+    aa_idx = axis_codes(aggregated_stats['alt_aa'], amino_acids)
+    dose_idx = axis_codes(aggregated_stats['dose_level'], dose_levels)
+
+    # NumPy assigns repeated indices in order, so the last row seen wins
+    ref_codes, ref_values = pd.factorize(aggregated_stats['ref_aa'])
+    position_ref = np.full(len(positions), -1, dtype=np.int64)
+    position_ref[pos_idx] = ref_codes
+    ref_aa = np.array([str(ref_values[code]) if code >= 0 else 'X' for code in position_ref], dtype=object)
+
+    rows = np.flatnonzero((aa_idx >= 0) & (dose_idx >= 0))
+    shape = (len(drugs), len(positions), len(amino_acids), len(dose_levels))
+    cell = np.ravel_multi_index((drug_idx[rows], pos_idx[rows], aa_idx[rows], dose_idx[rows]), shape)
+
+    mean = np.full(shape, np.nan, dtype=dtype)
+    std = np.full(shape, np.nan, dtype=dtype)
+    count = np.zeros(shape, dtype=np.int64)
+    mean.flat[cell] = aggregated_stats['mean'].to_numpy()[rows]
+    std.flat[cell] = aggregated_stats['std'].to_numpy()[rows]
+    count.flat[cell] = aggregated_stats['count'].to_numpy()[rows]
+
+    # Assigning in reverse leaves each cell holding its first row
+    first_row = np.full(shape[:3], NO_ROW, dtype=np.int64)
+    first_row.flat[cell[::-1] // len(dose_levels)] = rows[::-1]
+
+    return {
+        'drugs': drugs,
+        'positions': positions,
+        'amino_acids': list(amino_acids),
+        'dose_levels': list(dose_levels),
+        'ref_aa': ref_aa,
+        'mean': mean,
+        'std': std,
+        'count': count,
+        'first_row': first_row
+    }
+
+def heatmap_value_ranges(tensor):
+    """Per-drug value ranges and data counts of a heatmap tensor.
+
+    Returns (value_ranges, data_counts) keyed by drug. Ranges cover every
+    dose plus each dose level that has data; drugs without data get 0/0.
+    """
+    mean = tensor['mean']
+    present = ~np.isnan(mean)
+    per_dose_count = present.sum(axis=(1, 2))
+    dose_min = np.min(mean, axis=(1, 2), initial=np.inf, where=present)
+    dose_max = np.max(mean, axis=(1, 2), initial=-np.inf, where=present)
+
+    value_ranges = {}
+    data_counts = {}
+    for d, drug in enumerate(tensor['drugs']):
+        has_dose = per_dose_count[d] > 0
+        value_range = {
+            'min': float(dose_min[d].min()) if has_dose.any() else 0,
+            'max': float(dose_max[d].max()) if has_dose.any() else 0
+        }
+        for i, dose in enumerate(tensor['dose_levels']):
+            if has_dose[i]:
+                value_range[dose] = {'min': float(dose_min[d, i]), 'max': float(dose_max[d, i])}
+        value_ranges[drug] = value_range
+        data_counts[drug] = dict(zip(tensor['dose_levels'], per_dose_count[d].tolist()))
+    return value_ranges, data_counts
+
+def nullable_list(values):
+    """Array as nested lists with NaN replaced by None."""
+    values = values.astype(object)
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+def tensor_to_matrices(tensor):
+    """Convert a heatmap tensor into the nested per-drug matrices JSON.
+
+    Positions and amino acids with data come first, in the order their
+    rows appear in the aggregated statistics, followed by the empty ones
+    in axis order.
+    """
+    amino_acids = tensor['amino_acids']
+    dose_levels = tensor['dose_levels']
+    position_keys = [str(position) for position in tensor['positions'].tolist()]
+    ref_aa = tensor['ref_aa'].tolist()
+    means = nullable_list(tensor['mean'])
+    stds = nullable_list(tensor['std'])
+    counts = tensor['count'].tolist()
+
+    matrices = {}
+    for d, drug in enumerate(tensor['drugs']):
+        first_row = tensor['first_row'][d]
+        position_order = np.argsort(first_row.min(axis=1), kind='stable').tolist()
+        aa_order = np.argsort(first_row, axis=1, kind='stable').tolist()
+
+        matrix = {}
+        for p in position_order:
+            cells = {}
+            for a in aa_order[p]:
+                cell = {
+                    dose: {'value': means[d][p][a][i], 'std': stds[d][p][a][i], 'count': counts[d][p][a][i]}
+                    for i, dose in enumerate(dose_levels)
+                }
+                cell['ref_aa'] = ref_aa[p]
+                cells[amino_acids[a]] = cell
+            matrix[position_keys[p]] = cells
+        matrices[drug] = matrix
+    return matrices
+
+def compact_dose_arrays(tensor, d, i):
+    """Flat value/std/count lists of one drug and dose level."""
+    return {
+        'value': nullable_list(tensor['mean'][d, :, :, i].ravel()),
+        'std': nullable_list(tensor['std'][d, :, :, i].ravel()),
+        'count': tensor['count'][d, :, :, i].ravel().tolist()
+    }
+
+def tensor_to_compact(tensor, metadata):
+    """Encode a heatmap tensor as flat per-drug, per-dose arrays.
+
+    Each of value/std/count is a row-major [position][amino_acid] list
+    with null (or 0 for count) in empty cells, so cell (p, a) is at index
+    p * len(amino_acids) + a. ref_aa has one character per position.
+    """
+    drugs = {}
+    for d, drug in enumerate(tensor['drugs']):
+        drugs[drug] = {dose: compact_dose_arrays(tensor, d, i) for i, dose in enumerate(tensor['dose_levels'])}
+
+    return {
+        'format': 'compact',
+        'version': COMPACT_FORMAT_VERSION,
+        'metadata': metadata,
+        'positions': tensor['positions'].tolist(),
+        'amino_acids': tensor['amino_acids'],
+        'dose_levels': tensor['dose_levels'],
+        'ref_aa': ''.join(tensor['ref_aa'].tolist()),
+        'drugs': drugs
+    }
+
+def build_split_files(tensor, metadata, split_doses=False):
+    """Build a heatmap manifest plus one matrix file per drug (or drug and dose).
+
+    Matrix files hold {dose_level: {value, std, count}} in the compact
+    row-major layout. The manifest carries the axes, ref_aa and metadata
+    (drugs, value ranges) and lists each drug's files with their content
+    hash, so clients fetch only the drug and dose on screen and can cache
+    by hash. Returns {relative path: bytes or object} including the manifest.
+    """
+    files = {}
+    drug_files = {}
+    for d, drug in enumerate(tensor['drugs']):
+        if split_doses:
+            groups = [(f"{safe_file_stem(drug)}_{safe_file_stem(dose)}.json", [i]) for i, dose in enumerate(tensor['dose_levels'])]
+        else:
+            groups = [(f"{safe_file_stem(drug)}.json", list(range(len(tensor['dose_levels']))))]
+
+        drug_files[drug] = []
+        for name, dose_indexes in groups:
+            doses = [tensor['dose_levels'][i] for i in dose_indexes]
+            data = dumps_json({dose: compact_dose_arrays(tensor, d, i) for dose, i in zip(doses, dose_indexes)})
+            files[name] = data
+            drug_files[drug].append({'path': name, 'doses': doses, 'hash': content_hash(data), 'bytes': len(data)})
+
+    files[SPLIT_MANIFEST_NAME] = {
+        'format': 'split',
+        'version': SPLIT_FORMAT_VERSION,
+        'metadata': metadata,
+        'positions': tensor['positions'].tolist(),
+        'amino_acids': tensor['amino_acids'],
+        'dose_levels': tensor['dose_levels'],
+        'ref_aa': ''.join(tensor['ref_aa'].tolist()),
+        'files': drug_files
+    }
+    return files
+
+def write_heatmap_binary(tensor, metadata, header_path, data_path):
+    """Write the mean/std/count tensors as one little-endian binary blob.
+
+    mean and std are Float32 (NaN where empty) and count is Uint16, each
+    stored C-order with shape (drug, position, amino acid, dose level).
+    The JSON header at header_path records the axes, shape and the byte
+    offset of each array in data_path. Returns the header.
+    """
+    header_path = Path(header_path)
+    data_path = Path(data_path)
+    shape = list(tensor['mean'].shape)
+
+    parts = []
+    arrays = {}
+    offset = 0
+    for name, dtype in BINARY_ARRAYS.items():
+        values = tensor[name]
+        if name == 'count':
+            values = np.minimum(values, np.iinfo(np.uint16).max)
+        data = np.ascontiguousarray(values, dtype=dtype).tobytes()
+        padding = -len(data) % BINARY_ALIGNMENT
+        arrays[name] = {'dtype': np.dtype(dtype).name, 'offset': offset, 'bytes': len(data)}
+        parts.extend([data, b'\0' * padding])
+        offset += len(data) + padding
+
+    header = {
+        'format': 'binary',
+        'version': BINARY_FORMAT_VERSION,
+        'byte_order': 'little',
+        'data_file': data_path.name,
+        'shape': shape,
+        'axes': {
+            'drugs': tensor['drugs'],
+            'positions': tensor['positions'].tolist(),
+            'amino_acids': tensor['amino_acids'],
+            'dose_levels': tensor['dose_levels']
+        },
+        'ref_aa': ''.join(tensor['ref_aa'].tolist()),
+        'arrays': arrays,
+        'metadata': metadata
+    }
+
+    write_bytes_atomic(data_path, b''.join(parts))
+    write_json_file(header_path, header)
+    return header
+
+def load_heatmap_binary(header_path, mode='r'):
+    """Memory-map a binary heatmap written by write_heatmap_binary.
+
+    Returns the header dict with an added 'tensors' entry mapping mean,
+    std and count to np.memmap arrays of the header's shape.
+    """
+    header_path = Path(header_path)
+    with open(header_path, 'r') as f:
+        header = json.load(f)
+
+    if header.get('format') != 'binary' or header.get('version') != BINARY_FORMAT_VERSION:
+        raise ValueError(f"{header_path} is not a version {BINARY_FORMAT_VERSION} binary heatmap header")
+
+    data_path = header_path.with_name(header['data_file'])
+    shape = tuple(header['shape'])
+    header['tensors'] = {
+        name: np.memmap(data_path, dtype=BINARY_ARRAYS[name], mode=mode, offset=array['offset'], shape=shape)
+        for name, array in header['arrays'].items()
+    }
+    return header
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Change detection for incremental datacard rebuilds.
+Hashes the rows of every (Gene, ref_aa, protein_start, alt_aa, Drug) group
+and compares them with the manifest from the previous run, so only the
+datacards whose input rows changed need to be rebuilt.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import logging
+
+from dose_response import GROUP_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Bump when datacard contents change for reasons other than input rows
+MANIFEST_VERSION = 1
+
+def variant_keys_for_groups(keys):
+    """Build the Gene_variant datacard key for each group key row."""
+    return (keys['Gene'].astype(str) + '_' + keys['ref_aa'].astype(str)
+            + keys['protein_start'].astype(str) + keys['alt_aa'].astype(str))
+
+def compute_group_hashes(df):
+    """Hash the rows of every variant-drug group.
+
+    Returns (row_variant_keys, groups): the datacard key of each row (None
+    for rows with incomplete keys) and a DataFrame with variant_key, drug
+    and hash columns, one row per group. Row order within a group is part
+    of the hash because later duplicate measurements win.
+    """
+    grouped = df.groupby(GROUP_COLUMNS, observed=True, sort=True, dropna=True)
+    group_ids = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    keys = grouped.size().index.to_frame(index=False)
+
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    in_group = group_ids >= 0
+    ids = group_ids[in_group]
+    rank = pd.Series(ids).groupby(ids).cumcount().to_numpy().astype(np.uint64)
+
+    # Order-sensitive sum of row hashes per group; uint64 arithmetic wraps
+    weighted = row_hashes[in_group] * (rank * np.uint64(2) + np.uint64(1))
+    order = np.argsort(ids, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(ids[order]) != 0])
+    sums = np.add.reduceat(weighted[order], starts) if len(order) else np.empty(0, dtype=np.uint64)
+
+    variant_keys = variant_keys_for_groups(keys)
+    groups = pd.DataFrame({
+        'variant_key': variant_keys.to_numpy(),
+        'drug': keys['Drug'].astype(str).to_numpy(),
+        'hash': [f"{h:016x}" for h in sums.tolist()]
+    })
+
+    row_variant_keys = np.full(len(df), None, dtype=object)
+    row_variant_keys[in_group] = groups['variant_key'].to_numpy()[ids]
+    return row_variant_keys, groups
+
+def build_manifest(groups, settings):
+    """Build the manifest recording each datacard's group hashes."""
+    variants = {}
+    for variant_key, drug, group_hash in groups.itertuples(index=False, name=None):
+        variants.setdefault(variant_key, {})[drug] = group_hash
+
+    return {
+        'version': MANIFEST_VERSION,
+        'settings': settings,
+        'variants': variants
+    }
+
+def load_manifest(manifest_path):
+    """Load the previous run's manifest, or None if unavailable."""
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return None
+
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return None
+
+def manifest_matches(manifest, previous_manifest):
+    """Whether a previous manifest was built with the same version and settings."""
+    return (previous_manifest is not None
+            and previous_manifest.get('version') == manifest['version']
+            and previous_manifest.get('settings') == manifest['settings'])
+
+def plan_rebuild(manifest, previous_manifest, existing_files):
+    """Work out which datacards to rebuild and which to delete.
+
+    Returns (changed, orphaned) sets of datacard keys. Everything is
+    rebuilt when there is no usable previous manifest or the processing
+    settings differ.
+    """
+    current = manifest['variants']
+
+    if not manifest_matches(manifest, previous_manifest):
+        logger.info("No matching manifest from a previous run; rebuilding all datacards")
+        return set(current), {key for key in existing_files if key not in current}
+
+    previous = previous_manifest.get('variants', {})
+    changed = {
+        key for key, drugs in current.items()
+        if previous.get(key) != drugs or key not in existing_files
+    }
+    orphaned = {key for key in existing_files if key not in current}
+    return changed, orphaned
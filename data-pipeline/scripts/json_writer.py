@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Fast JSON output helpers for the data pipeline.
+Encodes NumPy-containing structures without a recursive conversion pass
+and writes many small files concurrently. A full build of a directory
+goes into a new versioned sibling (.variants.v<id>/) that a symlink swap
+switches into place with one atomic rename, so readers see either the
+old or the new tree. Each version lists the files the pipeline generated,
+so files it never wrote are carried over into the next version.
+"""
+
+import os
+import re
+import json
+import hashlib
+import time
+import shutil
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from stage_timers import stage_timer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Hidden file listing the files the last build generated in a directory
+GENERATED_LIST_NAME = ".generated.json"
+
+def numpy_default(obj):
+    """json.dumps fallback for NumPy scalars and arrays."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.bool_):
+        return bool(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def replace_non_finite(obj):
+    """Copy of obj with NaN and infinite floats replaced by None."""
+    if isinstance(obj, dict):
+        return {key: replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [replace_non_finite(value) for value in obj]
+    if isinstance(obj, np.ndarray):
+        return replace_non_finite(obj.tolist())
+    if isinstance(obj, (float, np.floating)):
+        return float(obj) if np.isfinite(obj) else None
+    return obj
+
+@stage_timer('serialize')
+def dumps_json(obj, indent=None):
+    """Encode obj as UTF-8 JSON bytes, using orjson when it is installed.
+
+    Both encoders produce the same output: NaN and infinite floats become
+    null (bare NaN is not valid JSON), and indent may only be None for
+    compact output or 2, the one indent orjson supports.
+    """
+    if indent not in (None, 0, 2):
+        raise ValueError(f"indent must be None or 2, not {indent!r}")
+
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=numpy_default, option=option)
+
+    options = {'indent': indent} if indent else {'separators': (',', ':')}
+    try:
+        text = json.dumps(obj, default=numpy_default, ensure_ascii=False, allow_nan=False, **options)
+    except ValueError:
+        # Only documents holding non-finite floats pay for the extra pass
+        text = json.dumps(replace_non_finite(obj), default=numpy_default, ensure_ascii=False,
+                          allow_nan=False, **options)
+    return text.encode('utf-8')
+
+def loads_json(data):
+    """Decode JSON bytes or text, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def content_hash(data):
+    """Short content hash used for cache busting."""
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def safe_file_stem(name):
+    """File-name-safe version of a name such as a gene or drug."""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+@stage_timer('write')
+def write_bytes_atomic(path, data):
+    """Write a single file via a temporary file and rename."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def write_json_file(path, obj, indent=None):
+    """Encode obj and write it to path atomically."""
+    write_bytes_atomic(path, dumps_json(obj, indent=indent))
+
+def load_generated_names(output_dir):
+    """Relative paths the previous build recorded as generated in output_dir."""
+    list_path = Path(output_dir) / GENERATED_LIST_NAME
+    try:
+        with open(list_path, 'rb') as f:
+            return set(loads_json(f.read()))
+    except FileNotFoundError:
+        return set()
+    except (OSError, ValueError, TypeError) as e:
+        logger.warning(f"Ignoring unreadable file listing {list_path}: {e}")
+        return set()
+
+def remove_generated_files(output_dir, names):
+    """Delete generated files and any directories they leave empty."""
+    output_dir = Path(output_dir)
+    for name in names:
+        path = output_dir / name
+        path.unlink(missing_ok=True)
+        for parent in path.parents:
+            if parent == output_dir:
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+
+def record_generated_files(output_dir, names):
+    """Save the listing of files generated in output_dir."""
+    write_json_file(Path(output_dir) / GENERATED_LIST_NAME, sorted(names))
+
+def version_prefix(output_dir):
+    """Name prefix of the versioned directories behind output_dir."""
+    return f".{Path(output_dir).name}.v"
+
+def current_version_dir(output_dir):
+    """Versioned directory output_dir currently points at, or None."""
+    output_dir = Path(output_dir)
+    if output_dir.is_symlink():
+        return output_dir.parent / os.readlink(output_dir)
+    return None
+
+def prepare_version_dir(output_dir):
+    """Create an empty versioned directory for a new build of output_dir.
+
+    Versions left behind by interrupted builds are removed first.
+    """
+    output_dir = Path(output_dir)
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    current = current_version_dir(output_dir)
+    for entry in output_dir.parent.glob(f"{version_prefix(output_dir)}*"):
+        if entry.is_dir() and not entry.is_symlink() and entry != current:
+            shutil.rmtree(entry)
+
+    version_dir = output_dir.with_name(f"{version_prefix(output_dir)}{time.time_ns():x}")
+    version_dir.mkdir()
+    return version_dir
+
+def carry_over_files(source_dir, version_dir, names):
+    """Link files the pipeline never generated from source_dir into version_dir.
+
+    Files listed as generated by the previous build, hidden files and paths
+    the new build wrote itself (names) are skipped. Returns the carried names.
+    """
+    generated = load_generated_names(source_dir)
+    carried = []
+    for path in Path(source_dir).rglob('*'):
+        relative = path.relative_to(source_dir)
+        name = relative.as_posix()
+        if not path.is_file() or name in generated or name in names:
+            continue
+        if any(part.startswith('.') for part in relative.parts):
+            continue
+
+        target = version_dir / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+        carried.append(name)
+    return carried
+
+def switch_directory(version_dir, output_dir, names):
+    """Point output_dir at a fully written version directory.
+
+    names holds every relative path the build wrote. output_dir becomes a
+    symlink to version_dir, replaced with a single rename; the version it
+    pointed at before is then deleted. A plain output_dir (from before
+    versioned builds) is renamed aside once first, which is the only step
+    that briefly leaves output_dir missing.
+    """
+    version_dir, output_dir = Path(version_dir), Path(output_dir)
+    names = set(names)
+
+    previous = current_version_dir(output_dir)
+    source = previous or (output_dir if output_dir.is_dir() else None)
+    if source is not None and source.is_dir():
+        carried = carry_over_files(source, version_dir, names)
+        if carried:
+            logger.info(f"Kept {len(carried)} files not generated by the pipeline in {output_dir}")
+    record_generated_files(version_dir, names)
+
+    link_path = output_dir.with_name(f".{output_dir.name}.link.tmp")
+    link_path.unlink(missing_ok=True)
+    os.symlink(version_dir.name, link_path, target_is_directory=True)
+
+    if output_dir.is_dir() and previous is None:
+        previous = output_dir.with_name(f"{version_prefix(output_dir)}0-plain")
+        logger.info(f"Moving plain directory {output_dir} aside to switch to versioned builds")
+        os.rename(output_dir, previous)
+    os.replace(link_path, output_dir)
+
+    if previous is not None and previous != version_dir:
+        shutil.rmtree(previous, ignore_errors=True)
+
+def write_files(files, target_dir, workers=None, indent=None, atomic=False):
+    """Encode and write files under target_dir using a thread pool.
+
+    Returns (file count, total bytes). With atomic, each file is written
+    via a temporary file so readers never see a partial file.
+    """
+    for parent in {Path(name).parent for name in files}:
+        (target_dir / parent).mkdir(parents=True, exist_ok=True)
+
+    def write_one(item):
+        name, obj = item
+        data = obj if isinstance(obj, bytes) else dumps_json(obj, indent=indent)
+        if atomic:
+            write_bytes_atomic(target_dir / name, data)
+        else:
+            with stage_timer('write'), open(target_dir / name, 'wb') as f:
+                f.write(data)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        total_bytes = sum(executor.map(write_one, files.items()))
+    return len(files), total_bytes
+
+def log_write_rate(count, total_bytes, output_dir, elapsed):
+    """Log how many files were written and at what rate."""
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    logger.info(f"Wrote {count} files ({total_bytes / 1e6:.1f} MB) to {output_dir} "
+                f"in {elapsed:.2f}s ({rate:.0f} files/sec)")
+
+def write_json_tree(files, output_dir, workers=None, indent=None):
+    """Write a directory of JSON files and switch it into place.
+
+    files maps paths relative to output_dir to the objects to encode
+    (bytes are written as they are). Everything is written into a new
+    versioned directory first, so output_dir only ever shows a complete
+    build; see switch_directory. Returns the number of files written.
+    """
+    output_dir = Path(output_dir)
+    version_dir = prepare_version_dir(output_dir)
+
+    start = time.perf_counter()
+    count, total_bytes = write_files(files, version_dir, workers=workers, indent=indent)
+    switch_directory(version_dir, output_dir, files.keys())
+    log_write_rate(count, total_bytes, output_dir, time.perf_counter() - start)
+    return count
+
+def update_json_tree(files, output_dir, workers=None, indent=None, remove=()):
+    """Rewrite some files of an existing directory in place.
+
+    Writes go through output_dir into the current version. Each file is
+    replaced atomically; names in remove are deleted.
+    Returns the number of files written.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    count, total_bytes = write_files(files, output_dir, workers=workers, indent=indent, atomic=True)
+    remove_generated_files(output_dir, remove)
+    record_generated_files(output_dir, (load_generated_names(output_dir) | set(files)) - set(remove))
+    log_write_rate(count, total_bytes, output_dir, time.perf_counter() - start)
+    return count
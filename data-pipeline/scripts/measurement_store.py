@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped store of the qDMS screening measurements.
+Writes every netgr_obs as Float32, sorted by (Gene, Drug, protein_start,
+alt_aa, conc, rep), into one binary file with small offset tables per
+gene/drug pair and position, described by a JSON header. Slices for one
+drug, position or variant are then found with a binary search and read
+through np.memmap; readers need neither the CSV nor pandas.
+
+Usage:
+    python data-pipeline/scripts/measurement_store.py build
+    python data-pipeline/scripts/measurement_store.py query BCR-ABL Imatinib 315 --alt-aa I
+"""
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+import logging
+
+from json_writer import write_bytes_atomic, write_json_file
+from stage_timers import stage_timer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bump when the store layout changes
+STORE_FORMAT_VERSION = 1
+
+STORE_HEADER_NAME = "measurements.json"
+STORE_DATA_NAME = "measurements.bin"
+
+# Row order of the measurements; cell_line only breaks ties
+SORT_COLUMNS = ['Gene', 'Drug', 'protein_start', 'alt_aa', 'conc', 'rep', 'cell_line']
+
+# Little-endian dtypes of the per-row arrays; *_code columns index the header tables
+ROW_ARRAYS = {
+    'netgr_obs': '<f4',
+    'alt_aa_code': '<u2',
+    'conc_code': '<u2',
+    'rep': '<i1',
+    'cell_line_code': '<u2'
+}
+
+# Per-block arrays, one block per (gene, drug, position); block_start has a
+# trailing entry holding the row count
+BLOCK_ARRAYS = {
+    'position': '<i4',
+    'block_start': '<i8'
+}
+
+# Byte alignment of each array in the data file
+STORE_ALIGNMENT = 8
+
+def table_codes(series):
+    """(sorted table of the distinct values as strings, code of each row)."""
+    series = series.astype('category')
+    codes = series.cat.codes.to_numpy()
+    observed = np.unique(codes[codes >= 0])
+    names = series.cat.categories[observed].astype(str).to_numpy()
+    order = np.argsort(names, kind='stable')
+
+    lookup = np.full(len(series.cat.categories), -1, dtype=np.int64)
+    lookup[observed[order]] = np.arange(len(order))
+    return names[order].tolist(), np.where(codes >= 0, lookup[codes], -1)
+
+@stage_timer('store')
+def build_measurement_store(df):
+    """Sorted row arrays, block arrays and lookup tables of a screening frame.
+
+    Rows without a Gene, Drug, protein_start, alt_aa, conc or rep are left
+    out. Returns (arrays, tables, pairs) where pairs lists the row and block
+    range of every gene/drug pair in store order.
+    """
+    required = ['Gene', 'Drug', 'protein_start', 'alt_aa', 'conc', 'rep', 'netgr_obs']
+    missing = [col for col in required if col not in df.columns]
+    if missing:
+        raise ValueError(f"Screening data is missing columns: {missing}")
+
+    keep = df[required[:-1]].notna().all(axis=1).to_numpy()
+    if not keep.all():
+        logger.warning(f"Leaving out {int((~keep).sum())} rows without a complete measurement key")
+    rows = df[keep]
+
+    tables = {}
+    tables['genes'], gene = table_codes(rows['Gene'])
+    tables['drugs'], drug = table_codes(rows['Drug'])
+    tables['amino_acids'], alt_aa = table_codes(rows['alt_aa'])
+    if 'cell_line' in rows.columns:
+        tables['cell_lines'], cell_line = table_codes(rows['cell_line'])
+    else:
+        tables['cell_lines'], cell_line = [''], np.zeros(len(rows), dtype=np.int64)
+    concentrations, conc = np.unique(rows['conc'].to_numpy(dtype=np.float64), return_inverse=True)
+    tables['concentrations'] = concentrations.tolist()
+    position = rows['protein_start'].to_numpy().astype(np.int64)
+    rep = rows['rep'].to_numpy().astype(np.int64)
+
+    # np.lexsort sorts by its last key first
+    order = np.lexsort((cell_line, rep, conc, alt_aa, position, drug, gene))
+    gene, drug, position = gene[order], drug[order], position[order]
+
+    row_count = len(order)
+    new_block = np.r_[True, (np.diff(gene) != 0) | (np.diff(drug) != 0) | (np.diff(position) != 0)][:row_count]
+    block_first_row = np.flatnonzero(new_block)
+    block_gene, block_drug = gene[block_first_row], drug[block_first_row]
+    new_pair = np.r_[True, (np.diff(block_gene) != 0) | (np.diff(block_drug) != 0)][:len(block_first_row)]
+    pair_first_block = np.flatnonzero(new_pair)
+
+    arrays = {
+        'netgr_obs': rows['netgr_obs'].to_numpy(dtype=np.float64)[order],
+        'alt_aa_code': alt_aa[order],
+        'conc_code': conc[order],
+        'rep': rep[order],
+        'cell_line_code': cell_line[order],
+        'position': position[block_first_row],
+        'block_start': np.r_[block_first_row, row_count]
+    }
+
+    block_bounds = np.r_[pair_first_block, len(block_first_row)]
+    pairs = [
+        {
+            'gene': tables['genes'][block_gene[first]],
+            'drug': tables['drugs'][block_drug[first]],
+            'rows': [int(arrays['block_start'][first]), int(arrays['block_start'][last])],
+            'blocks': [int(first), int(last)]
+        }
+        for first, last in zip(block_bounds[:-1], block_bounds[1:])
+    ]
+    return arrays, tables, pairs
+
+def write_measurement_store(df, store_dir, source=None):
+    """Write the measurement store of a screening frame to store_dir.
+
+    source is recorded in the header (see measurement_store_is_current).
+    Returns the header.
+    """
+    arrays, tables, pairs = build_measurement_store(df)
+    for name, table in [('alt_aa_code', 'amino_acids'), ('conc_code', 'concentrations'),
+                        ('cell_line_code', 'cell_lines')]:
+        if len(tables[table]) > np.iinfo(ROW_ARRAYS[name]).max:
+            raise ValueError(f"Too many distinct {table} for the store's {ROW_ARRAYS[name]} codes")
+
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    parts = []
+    layout = {}
+    offset = 0
+    for name, dtype in {**ROW_ARRAYS, **BLOCK_ARRAYS}.items():
+        data = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+        padding = -len(data) % STORE_ALIGNMENT
+        layout[name] = {'dtype': np.dtype(dtype).name, 'offset': offset, 'length': len(arrays[name])}
+        parts.extend([data, b'\0' * padding])
+        offset += len(data) + padding
+
+    header = {
+        'format': 'measurements',
+        'version': STORE_FORMAT_VERSION,
+        'byte_order': 'little',
+        'data_file': STORE_DATA_NAME,
+        'rows': len(arrays['netgr_obs']),
+        'blocks': len(arrays['position']),
+        'sort_order': SORT_COLUMNS,
+        'tables': tables,
+        'arrays': layout,
+        'pairs': pairs,
+        'source': source
+    }
+
+    write_bytes_atomic(store_dir / STORE_DATA_NAME, b''.join(parts))
+    write_json_file(store_dir / STORE_HEADER_NAME, header)
+    logger.info(f"Measurement store saved: {store_dir} ({header['rows']} rows, {header['blocks']} position "
+                f"blocks, {offset / 1e6:.1f} MB)")
+    return header
+
+def read_store_header(store_dir):
+    """Header of the store in store_dir, or None if there is none."""
+    header_path = Path(store_dir) / STORE_HEADER_NAME
+    if not header_path.exists():
+        return None
+    with open(header_path, 'r') as f:
+        header = json.load(f)
+    if header.get('format') != 'measurements' or header.get('version') != STORE_FORMAT_VERSION:
+        raise ValueError(f"{header_path} is not a version {STORE_FORMAT_VERSION} measurement store header")
+    return header
+
+def measurement_store_is_current(store_dir, source):
+    """True if store_dir holds a readable store built from source."""
+    try:
+        header = read_store_header(store_dir)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Rebuilding unreadable measurement store {store_dir}: {e}")
+        return False
+    return (header is not None and header.get('source') == source
+            and (Path(store_dir) / header['data_file']).exists())
+
+def open_measurement_store(store_dir, mode='r'):
+    """Memory-map a store written by write_measurement_store.
+
+    Returns the header dict with added 'columns' (np.memmap arrays by
+    name) and 'pair_index' ((gene, drug) -> pair) entries. Nothing is read
+    from the data file until a slice of it is used.
+    """
+    header = read_store_header(store_dir)
+    if header is None:
+        raise FileNotFoundError(f"No measurement store in {store_dir}")
+
+    data_path = Path(store_dir) / header['data_file']
+    header['columns'] = {
+        name: (np.memmap(data_path, dtype=array['dtype'], mode=mode, offset=array['offset'],
+                         shape=(array['length'],))
+               if array['length'] else np.zeros(0, dtype=array['dtype']))
+        for name, array in header['arrays'].items()
+    }
+    header['pair_index'] = {(pair['gene'], pair['drug']): pair for pair in header['pairs']}
+    header['amino_acid_codes'] = {aa: i for i, aa in enumerate(header['tables']['amino_acids'])}
+    return header
+
+def measurement_rows(store, gene, drug, position=None, alt_aa=None):
+    """(start, end) rows of a gene/drug pair, optionally narrowed to a position and alt_aa.
+
+    Returns an empty range when nothing was measured.
+    """
+    pair = store['pair_index'].get((gene, drug))
+    if pair is None:
+        return 0, 0
+    start, end = pair['rows']
+    if position is None:
+        if alt_aa is not None:
+            raise ValueError("alt_aa needs a position")
+        return start, end
+
+    first_block, last_block = pair['blocks']
+    positions = store['columns']['position'][first_block:last_block]
+    i = int(np.searchsorted(positions, position))
+    if i == len(positions) or positions[i] != position:
+        return start, start
+    block_start = store['columns']['block_start']
+    start, end = int(block_start[first_block + i]), int(block_start[first_block + i + 1])
+    if alt_aa is None:
+        return start, end
+
+    code = store['amino_acid_codes'].get(alt_aa)
+    if code is None:
+        return start, start
+    alt_codes = store['columns']['alt_aa_code'][start:end]
+    return start + int(np.searchsorted(alt_codes, code, 'left')), start + int(np.searchsorted(alt_codes, code, 'right'))
+
+def query_measurements(store, gene, drug, position=None, alt_aa=None):
+    """np.memmap slices of every row array for a gene/drug pair, position or variant."""
+    start, end = measurement_rows(store, gene, drug, position=position, alt_aa=alt_aa)
+    return {name: store['columns'][name][start:end] for name in ROW_ARRAYS}
+
+def query_position(store, gene, position, alt_aa=None):
+    """query_measurements for every drug measured at a gene position, keyed by drug."""
+    results = {}
+    for drug in store['tables']['drugs']:
+        measurements = query_measurements(store, gene, drug, position=position, alt_aa=alt_aa)
+        if len(measurements['netgr_obs']):
+            results[drug] = measurements
+    return results
+
+def decode_measurements(store, measurements):
+    """Measurements with codes replaced by their table values (copies, not memmaps)."""
+    tables = store['tables']
+    return {
+        'netgr_obs': np.asarray(measurements['netgr_obs']),
+        'alt_aa': np.asarray(tables['amino_acids'], dtype=object)[measurements['alt_aa_code']],
+        'conc': np.asarray(tables['concentrations'])[measurements['conc_code']],
+        'rep': np.asarray(measurements['rep']),
+        'cell_line': np.asarray(tables['cell_lines'], dtype=object)[measurements['cell_line_code']]
+    }
+
+def build_store(csv_path, store_dir, force=False):
+    """Write the store for csv_path unless it is already current. Returns True if it was written."""
+    # Imported here so reading a store does not pull in pandas
+    from screening_data import compute_cache_key, load_screening_data
+
+    if not Path(csv_path).exists():
+        raise FileNotFoundError(f"Data file not found: {csv_path}")
+
+    source = {'file': Path(csv_path).name, 'key': compute_cache_key(csv_path)}
+    if not force and measurement_store_is_current(store_dir, source):
+        logger.info(f"Measurement store {store_dir} is up to date")
+        return False
+    write_measurement_store(load_screening_data(csv_path), store_dir, source=source)
+    return True
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    project_root = Path(__file__).parent.parent.parent
+    parser = argparse.ArgumentParser(description="Build or query the memory-mapped measurement store")
+    parser.add_argument('--store', type=Path, default=project_root / "data" / "processed" / "measurements",
+                        help="Store directory (default: data/processed/measurements)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Write the store from the screening CSV")
+    build_parser.add_argument('--input', type=Path, default=project_root / "data" / "raw" / "master_qDMS_df.csv",
+                              help="Screening CSV (default: data/raw/master_qDMS_df.csv)")
+    build_parser.add_argument('--force', action='store_true', help="Rebuild even if the store is current")
+
+    query_parser = commands.add_parser('query', help="Print the measurements of a gene/drug pair")
+    query_parser.add_argument('gene')
+    query_parser.add_argument('drug')
+    query_parser.add_argument('position', type=int, nargs='?', default=None)
+    query_parser.add_argument('--alt-aa', default=None, help="Only this alternate amino acid")
+    return parser.parse_args(argv)
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    if args.command == 'build':
+        build_store(args.input, args.store, force=args.force)
+        return
+
+    store = open_measurement_store(args.store)
+    start = time.perf_counter()
+    measurements = query_measurements(store, args.gene, args.drug, position=args.position, alt_aa=args.alt_aa)
+    seconds = time.perf_counter() - start
+
+    rows = decode_measurements(store, measurements)
+    print(f"{'alt_aa':>6} {'conc':>10} {'rep':>4} {'cell_line':>10} {'netgr_obs':>12}")
+    for alt_aa, conc, rep, cell_line, value in zip(rows['alt_aa'], rows['conc'], rows['rep'],
+                                                   rows['cell_line'], rows['netgr_obs']):
+        print(f"{alt_aa:>6} {conc:>10g} {rep:>4} {cell_line:>10} {value:>12.6f}")
+    logger.info(f"{len(rows['netgr_obs'])} measurements found in {seconds * 1e6:.0f} µs")
+    if not len(rows['netgr_obs']):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
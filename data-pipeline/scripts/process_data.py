@@ -8,16 +8,32 @@ Handles row-per-variant-dose-replicate CSV structure.
 import os
 import sys
 import json
+import time
+import argparse
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import datetime, timezone
 import logging
 
+from screening_data import (load_screening_data, iter_screening_partitions, peak_rss_mb, UnsortedInputError,
+                            DEFAULT_MEMORY_BUDGET_MB, DEFAULT_CHUNK_ROWS)
+from dose_response import build_dose_response_tensor, average_responses
+from curve_fitting import fit_dose_response_curves, fit_summary, DEFAULT_CHUNK_SIZE, MIN_FIT_DOSES
+from json_writer import (write_json_tree, update_json_tree, write_json_file, write_files, prepare_version_dir,
+                         switch_directory, log_write_rate)
+from variant_shards import (build_shard_files, add_index_files, load_shard_indexes, sharded_datacard_keys,
+                            merge_shard_indexes, new_shard_index, shard_of_key, DEFAULT_SHARD_SIZE)
+from incremental_build import compute_group_hashes, build_manifest, load_manifest, manifest_matches, plan_rebuild
+from stage_timers import stage_timer
+from run_profile import add_profile_arguments, profile_run
+from quality_control import compute_qc_mask, decode_qc_flags, summarize_qc_mask, DEFAULT_QC_THRESHOLDS
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@stage_timer('ic50')
 def estimate_ic50(doses, responses):
     """Estimate IC50 from dose-response data."""
     if len(doses) < 2 or not doses:
@@ -54,6 +70,62 @@ def estimate_ic50(doses, responses):
         logger.warning(f"Error estimating IC50: {e}")
         return None
 
+@stage_timer('ic50')
+def estimate_ic50_batch(doses, responses, valid=None):
+    """Estimate IC50 for every row of a dose-response matrix at once.
+
+    doses is either a dose axis shared by all rows or a matrix matching
+    responses; valid marks which points of each row were measured.
+    Returns an IC50 array (NaN where estimate_ic50 would return None) and
+    a flag array marking rows that fell back to the middle dose.
+    """
+    responses = np.asarray(responses, dtype=np.float64)
+    doses = np.broadcast_to(np.asarray(doses, dtype=np.float64), responses.shape)
+    if valid is None:
+        valid = np.ones(responses.shape, dtype=bool)
+
+    n_rows, n_points = responses.shape
+    ic50 = np.full(n_rows, np.nan)
+    fallback = np.zeros(n_rows, dtype=bool)
+    if n_points < 2:
+        return ic50, fallback
+
+    # Pack each row's measured points to the left, in ascending dose order
+    order = np.lexsort((doses, ~valid), axis=1)
+    x = np.take_along_axis(doses, order, axis=1)
+    y = np.take_along_axis(responses, order, axis=1)
+    n_valid = valid.sum(axis=1)
+    rows = np.arange(n_rows)
+
+    # IC50 is where growth rate is 50% of the maximum (uninhibited) response
+    max_response = np.max(np.where(valid, responses, -np.inf), axis=1)
+    target = (max_response * 0.5)[:, None]
+
+    y1, y2 = y[:, :-1], y[:, 1:]
+    x1, x2 = x[:, :-1], x[:, 1:]
+    in_row = np.arange(n_points - 1)[None, :] < (n_valid - 1)[:, None]
+    brackets = in_row & (((y1 >= target) & (target >= y2)) | ((y2 >= target) & (target >= y1)))
+
+    # First bracketing interval per row
+    has_bracket = brackets.any(axis=1)
+    first = np.argmax(brackets, axis=1)
+    by1, by2 = y1[rows, first], y2[rows, first]
+    bx1, bx2 = x1[rows, first], x2[rows, first]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interpolated = bx1 + (target[:, 0] - by1) * (bx2 - bx1) / (by2 - by1)
+    interpolated = np.where(by2 != by1, np.maximum(interpolated, 0), bx1)
+
+    # If no interpolation possible, fall back to the middle dose
+    middle = x[rows, np.minimum(n_valid // 2, n_points - 1)]
+
+    estimable = n_valid >= 2
+    ic50 = np.where(estimable & has_bracket, interpolated, ic50)
+    fallback = estimable & ~has_bracket
+    ic50 = np.where(fallback, middle, ic50)
+    return ic50, fallback
+
+@stage_timer('qc')
 def get_qc_flags(responses_rep1, responses_rep2, ic50):
     """Generate QC flags based on data quality."""
     flags = []
@@ -78,12 +150,13 @@ def get_qc_flags(responses_rep1, responses_rep2, ic50):
     
     return flags
 
-def process_screening_data(csv_path):
+def process_screening_data(csv_path, engine='vectorized', fit_curves=False, fit_workers=None,
+                           fit_chunk_size=DEFAULT_CHUNK_SIZE, qc_thresholds=None):
     """Process K562 screening CSV data with proper format handling."""
     logger.info(f"Processing screening data from {csv_path}")
     
     try:
-        df = pd.read_csv(csv_path)
+        df = load_screening_data(csv_path)
         logger.info(f"Loaded {len(df)} rows of data")
     except Exception as e:
         logger.error(f"Failed to read CSV file: {e}")
@@ -99,11 +172,137 @@ def process_screening_data(csv_path):
     logger.info(f"Found {len(unique_drugs)} unique drugs: {list(unique_drugs)}")
     logger.info(f"Found {len(unique_concs)} unique concentrations: {unique_concs}")
     
+    return assemble_variants(df, engine, fit_curves=fit_curves, fit_workers=fit_workers,
+                             fit_chunk_size=fit_chunk_size, qc_thresholds=qc_thresholds)
+
+@stage_timer('datacards')
+def assemble_variants(df, engine='vectorized', **options):
+    """Build variant datacards with the chosen engine; options go to build_variants."""
+    if engine == 'legacy':
+        return build_variants_legacy(df)
+    return build_variants(df, **options)
+
+def column_values(df, column, default):
+    """Return a column as a list, or a list of defaults if it is missing."""
+    if column in df.columns:
+        return df[column].tolist()
+    return [default] * len(df)
+
+def build_variants(df, fit_curves=False, fit_workers=None, fit_chunk_size=DEFAULT_CHUNK_SIZE,
+                   qc_thresholds=None):
+    """Build variant datacards from a dose-response tensor of the whole screen.
+
+    With fit_curves, a 4PL model is also fitted to every variant-drug
+    curve and its parameters are stored under 'fit' in ic50_values.
+    """
+    tensor = build_dose_response_tensor(df)
+    keys = tensor['keys']
+    doses = tensor['doses']
+    responses = tensor['responses']
+    valid = tensor['valid']
+    avg_responses = average_responses(responses)
+    replicate_counts = tensor['replicate_count'].tolist()
+    
+    logger.info(f"Processing {len(keys)} unique variant-drug combinations...")
+    
+    ic50_estimates, ic50_fallback = estimate_ic50_batch(doses, avg_responses, valid)
+    logger.info(f"Estimated IC50 for {int(np.isfinite(ic50_estimates).sum())} combinations "
+                f"({int(ic50_fallback.sum())} fell back to the middle dose)")
+    
+    fits = None
+    if fit_curves:
+        fits = fit_dose_response_curves(doses, responses, tensor['measured'], ic50_estimates,
+                                        workers=fit_workers, chunk_size=fit_chunk_size)
+    
+    qc_mask = compute_qc_mask(responses, valid, ic50_estimates, qc_thresholds)
+    logger.info(f"QC flag counts: {summarize_qc_mask(qc_mask)}")
+    qc_flag_lists = {int(m): decode_qc_flags(m) for m in np.unique(qc_mask)}
+    qc_mask = qc_mask.tolist()
+    
+    ic50_estimates = [None if np.isnan(v) else v for v in ic50_estimates.tolist()]
+    
+    # Per-group metadata comes from the first row of each group
+    first_rows = tensor['frame'].iloc[tensor['first_row']]
+    is_synonymous = column_values(first_rows, 'synSNP', False)
+    variant_types = column_values(first_rows, 'type', 'unknown')
+    species = column_values(first_rows, 'species', 'unknown')
+    
+    variants = {}
+    processed_count = 0
+    
+    for i, (gene_name, ref_aa, position, alt_aa, drug_name) in enumerate(keys.itertuples(index=False, name=None)):
+        variant_string = f"{ref_aa}{position}{alt_aa}"
+        variant_key = f"{gene_name}_{variant_string}"
+        
+        row_valid = valid[i]
+        if not row_valid.any():
+            logger.warning(f"No valid dose data for variant {variant_string}")
+            continue
+        
+        # Materialize Python lists only for serialization
+        row_doses = doses[row_valid].tolist()
+        responses_rep1 = responses[i, row_valid, 0].tolist()
+        responses_rep2 = responses[i, row_valid, 1].tolist()
+        row_avg = avg_responses[i, row_valid].tolist()
+        
+        ic50_estimated = ic50_estimates[i]
+        actual_reps = replicate_counts[i]
+        
+        ic50_entry = {
+            'drug': drug_name,
+            'ic50': ic50_estimated if ic50_estimated else 0,
+            'replicate_count': actual_reps,
+            'dose_response_data': {
+                'doses': row_doses,
+                'responses_rep1': responses_rep1,
+                'responses_rep2': responses_rep2,
+                'avg_responses': row_avg
+            },
+            'qc_flags': list(qc_flag_lists[qc_mask[i]])
+        }
+        if fits is not None:
+            ic50_entry['fit'] = fit_summary(fits, i)
+        
+        # Check if variant already exists (multiple drugs for same variant)
+        if variant_key in variants:
+            variants[variant_key]['drugs_tested'].append(drug_name)
+            variants[variant_key]['ic50_values'].append(ic50_entry)
+        else:
+            variants[variant_key] = {
+                'gene': gene_name,
+                'variant_string': variant_string,
+                'protein_change': f"p.{variant_string}",
+                'transcript_id': 'UNKNOWN',  # Not provided in K562 data
+                'position': position,
+                'consequence': 'missense_variant',  # Assuming all are missense
+                'drugs_tested': [drug_name],
+                'model_system': 'K562 cells',
+                'ic50_values': [ic50_entry],
+                'replicate_count': actual_reps,
+                'qc_flags': [],
+                'publication_doi': '',
+                'plots': [],
+                'metadata': {
+                    'date_created': datetime.now(timezone.utc).isoformat(),
+                    'version': '2.0',
+                    'is_synonymous': bool(is_synonymous[i]),
+                    'variant_type': variant_types[i],
+                    'species_context': species[i]
+                }
+            }
+        
+        processed_count += 1
+    
+    logger.info(f"Successfully processed {processed_count} variants from screening data")
+    return variants
+
+def build_variants_legacy(df):
+    """Build variant datacards group by group (reference implementation)."""
     variants = {}
     processed_count = 0
     
     # Group by variant to aggregate dose-response data
-    variant_groups = df.groupby(['Gene', 'ref_aa', 'protein_start', 'alt_aa', 'Drug'])
+    variant_groups = df.groupby(['Gene', 'ref_aa', 'protein_start', 'alt_aa', 'Drug'], observed=True)
     
     logger.info(f"Processing {len(variant_groups)} unique variant-drug combinations...")
     
@@ -232,44 +431,260 @@ def process_screening_data(csv_path):
     logger.info(f"Successfully processed {processed_count} variants from screening data")
     return variants
 
-def json_serializable(obj):
-    """Convert numpy types to native Python types for JSON serialization."""
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [json_serializable(v) for v in obj]
+def datacard_files(variants, layout='files', shard_size=DEFAULT_SHARD_SIZE, indent=None):
+    """Map output paths to datacard contents for the chosen layout."""
+    if layout == 'shards':
+        files, indexes = build_shard_files(variants, shard_size=shard_size, indent=indent)
+        return add_index_files(files, indexes)
+    return {f"{variant_key}.json": variant_data for variant_key, variant_data in variants.items()}
+
+def save_variant_datacards(variants, output_dir, workers=None, indent=None, layout='files',
+                           shard_size=DEFAULT_SHARD_SIZE):
+    """Save variant datacards as individual JSON files or position-sharded bundles."""
+    logger.info(f"Saving {len(variants)} variant datacards to {output_dir} ({layout} layout)")
+    
+    files = datacard_files(variants, layout=layout, shard_size=shard_size, indent=indent)
+    
+    try:
+        saved_count = write_json_tree(files, output_dir, workers=workers, indent=indent)
+    except Exception as e:
+        logger.error(f"Failed to save variant datacards: {e}")
+        return
+    
+    logger.info(f"Successfully saved {saved_count} variant datacards")
+
+def manifest_settings(engine, options, indent, layout='files', shard_size=DEFAULT_SHARD_SIZE):
+    """Processing settings that affect datacard contents."""
+    return {
+        'engine': engine,
+        'fit_curves': bool(options.get('fit_curves', False)),
+        'qc_thresholds': {**DEFAULT_QC_THRESHOLDS, **(options.get('qc_thresholds') or {})},
+        'indent': indent,
+        'layout': layout,
+        'shard_size': shard_size if layout == 'shards' else None
+    }
+
+def existing_datacards(output_dir):
+    """Datacard keys that currently have a file in output_dir."""
+    if not output_dir.exists():
+        return set()
+    return {entry.name[:-len('.json')] for entry in os.scandir(output_dir)
+            if entry.is_file() and entry.name.endswith('.json') and not entry.name.startswith('.')}
+
+def write_manifest(df, manifest_path, settings):
+    """Record the group hashes of a full build for later incremental runs."""
+    _, groups = compute_group_hashes(df)
+    write_json_file(manifest_path, build_manifest(groups, settings))
+
+def update_variant_datacards(csv_path, output_dir, manifest_path, engine='vectorized',
+                             workers=None, indent=None, layout='files', shard_size=DEFAULT_SHARD_SIZE,
+                             **options):
+    """Rebuild only the datacards whose input rows changed since the last run."""
+    try:
+        df = load_screening_data(csv_path)
+    except Exception as e:
+        logger.error(f"Failed to read CSV file: {e}")
+        return 0
+    
+    row_variant_keys, groups = compute_group_hashes(df)
+    manifest = build_manifest(groups, manifest_settings(engine, options, indent, layout, shard_size))
+    previous_manifest = load_manifest(manifest_path)
+    
+    if not manifest_matches(manifest, previous_manifest):
+        logger.info("Settings changed since the last run; rebuilding all datacards")
+        variants = assemble_variants(df, engine, **options)
+        save_variant_datacards(variants, output_dir, workers=workers, indent=indent,
+                               layout=layout, shard_size=shard_size)
+        write_json_file(manifest_path, manifest)
+        return len(variants)
+    
+    if layout == 'shards':
+        shard_indexes = load_shard_indexes(output_dir)
+        existing = sharded_datacard_keys(shard_indexes)
+    else:
+        existing = existing_datacards(output_dir)
+    
+    changed, orphaned = plan_rebuild(manifest, previous_manifest, existing)
+    logger.info(f"Incremental build: {len(changed)} changed, {len(orphaned)} orphaned, "
+                f"{len(manifest['variants']) - len(changed)} unchanged datacards")
+    
+    # A shard is rewritten whole, so rebuild every datacard sharing a shard with a change
+    rebuild = changed
+    if layout == 'shards':
+        affected_shards = {shard_of_key(key, shard_size) for key in changed | orphaned} - {None}
+        rebuild = {key for key in manifest['variants'] if shard_of_key(key, shard_size) in affected_shards}
+    
+    variants = {}
+    if rebuild:
+        rebuild_rows = pd.Series(row_variant_keys).isin(rebuild).to_numpy()
+        variants = assemble_variants(df[rebuild_rows], engine, **options)
+    
+    if layout == 'shards':
+        files, rebuilt_indexes = build_shard_files(variants, shard_size=shard_size, indent=indent)
+        indexes, removed = merge_shard_indexes(shard_indexes, rebuilt_indexes, affected_shards, shard_size)
+        add_index_files(files, {gene: indexes[gene] for gene, _ in affected_shards if gene in indexes})
     else:
-        return obj
+        files = datacard_files(variants)
+        removed = [f"{variant_key}.json" for variant_key in orphaned]
+    
+    update_json_tree(files, output_dir, workers=workers, indent=indent, remove=removed)
+    write_json_file(manifest_path, manifest)
+    return len(variants)
 
-def save_variant_datacards(variants, output_dir):
-    """Save individual variant datacards as JSON files."""
-    logger.info(f"Saving {len(variants)} variant datacards to {output_dir}")
+def stream_variant_datacards(csv_path, output_dir, manifest_path, engine='vectorized', workers=None,
+                             indent=None, layout='files', shard_size=DEFAULT_SHARD_SIZE,
+                             memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, chunk_rows=DEFAULT_CHUNK_ROWS,
+                             assume_sorted=False, **options):
+    """Build datacards partition by partition so peak memory stays bounded."""
+    output_dir = Path(output_dir)
+    version_dir = prepare_version_dir(output_dir)
     
-    saved_count = 0
-    for variant_key, variant_data in variants.items():
-        filename = f"{variant_key}.json"
-        filepath = output_dir / filename
+    # Shards are only complete if a whole shard's positions share a partition
+    position_bucket = shard_size if layout == 'shards' else 1
+    partitions = iter_screening_partitions(csv_path, memory_budget_mb=memory_budget_mb, chunk_rows=chunk_rows,
+                                           position_bucket=position_bucket, assume_sorted=assume_sorted)
+    
+    start = time.perf_counter()
+    group_frames = []
+    shard_indexes = {}
+    variant_count = 0
+    file_count = 0
+    total_bytes = 0
+    written_names = set()
+    
+    for partition in partitions:
+        variants = assemble_variants(partition, engine, **options)
+        group_frames.append(compute_group_hashes(partition)[1])
         
-        try:
-            # Convert numpy types to native Python types
-            serializable_data = json_serializable(variant_data)
-            
-            with open(filepath, 'w') as f:
-                json.dump(serializable_data, f, indent=2)
-            saved_count += 1
-        except Exception as e:
-            logger.error(f"Failed to save variant datacard {filename}: {e}")
+        if layout == 'shards':
+            files, indexes = build_shard_files(variants, shard_size=shard_size, indent=indent)
+            for gene, index in indexes.items():
+                merged = shard_indexes.setdefault(gene, new_shard_index(gene, shard_size))
+                merged['shards'].update(index['shards'])
+                merged['variants'].update(index['variants'])
+        else:
+            files = datacard_files(variants)
+        
+        written, written_bytes = write_files(files, version_dir, workers=workers, indent=indent)
+        written_names.update(files)
+        variant_count += len(variants)
+        file_count += written
+        total_bytes += written_bytes
+        logger.info(f"Streamed {variant_count} datacards so far (peak RSS {peak_rss_mb() or 0:.0f} MB)")
     
-    logger.info(f"Successfully saved {saved_count} variant datacards")
+    if shard_indexes:
+        index_files = add_index_files({}, shard_indexes)
+        written, written_bytes = write_files(index_files, version_dir, indent=indent)
+        written_names.update(index_files)
+        file_count += written
+        total_bytes += written_bytes
+    
+    switch_directory(version_dir, output_dir, written_names)
+    log_write_rate(file_count, total_bytes, output_dir, time.perf_counter() - start)
+    
+    groups = pd.concat(group_frames, ignore_index=True) if group_frames else pd.DataFrame(columns=['variant_key', 'drug', 'hash'])
+    write_json_file(manifest_path, build_manifest(groups, manifest_settings(engine, options, indent, layout, shard_size)))
+    logger.info(f"Peak RSS: {peak_rss_mb() or 0:.0f} MB")
+    return variant_count
+
+def add_datacard_arguments(parser):
+    """Add the datacard build options to an argument parser."""
+    parser.add_argument('--engine', choices=['vectorized', 'legacy'], default='vectorized',
+                        help="Dose-response assembly engine (default: vectorized)")
+    parser.add_argument('--fit-curves', action='store_true',
+                        help="Fit a 4-parameter logistic model to every variant-drug curve with at least "
+                             f"{MIN_FIT_DOSES} measured doses; other curves are reported as not fitted")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes for curve fitting (default: CPU count)")
+    parser.add_argument('--fit-chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Curves per curve-fitting work unit (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--write-workers', type=int, default=None,
+                        help="Threads used to write datacards (default: Python's thread pool default)")
+    parser.add_argument('--indent', type=int, choices=[2], default=None,
+                        help="Indent datacard JSON by 2 spaces (default: compact)")
+    parser.add_argument('--layout', choices=['files', 'shards'], default='files',
+                        help="Write one file per variant or position-sharded bundles (default: files)")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help=f"Protein positions per shard with --layout shards (default: {DEFAULT_SHARD_SIZE})")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--incremental', action='store_true',
+                      help="Only rebuild datacards whose input rows changed since the last run")
+    mode.add_argument('--streaming', action='store_true',
+                      help="Read the CSV in chunks and build datacards partition by partition")
+    parser.add_argument('--memory-budget-mb', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"Target peak memory for --streaming (default: {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"CSV rows read per chunk with --streaming (default: {DEFAULT_CHUNK_ROWS})")
+    parser.add_argument('--sorted-input', action='store_true',
+                        help="With --streaming, the CSV is sorted by Gene and protein_start, so no spill files are needed")
+    parser.add_argument('--max-replicate-difference', type=float,
+                        default=DEFAULT_QC_THRESHOLDS['max_replicate_difference'],
+                        help="Replicate difference above which high_replicate_variation is flagged")
+    parser.add_argument('--flat-tolerance', type=float,
+                        default=DEFAULT_QC_THRESHOLDS['flat_response_tolerance'],
+                        help="Response spread at or below which flat_dose_response is flagged")
+    return parser
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Convert screening CSV data to variant datacards.")
+    add_datacard_arguments(parser)
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def generate_datacards(data_file, data_output_dir, args):
+    """Build the variant datacards and manifest with the options in args.
+    
+    Returns the number of datacards written (rebuilt, for incremental runs).
+    """
+    variants_dir = data_output_dir / "variants"
+    manifest_path = data_output_dir / "variants_manifest.json"
+    data_output_dir.mkdir(parents=True, exist_ok=True)
+    
+    build_options = {
+        'fit_curves': args.fit_curves,
+        'fit_workers': args.workers,
+        'fit_chunk_size': args.fit_chunk_size,
+        'qc_thresholds': {
+            'max_replicate_difference': args.max_replicate_difference,
+            'flat_response_tolerance': args.flat_tolerance
+        }
+    }
+    
+    if args.streaming:
+        streamed = stream_variant_datacards(data_file, variants_dir, manifest_path, engine=args.engine,
+                                            workers=args.write_workers, indent=args.indent, layout=args.layout,
+                                            shard_size=args.shard_size, memory_budget_mb=args.memory_budget_mb,
+                                            chunk_rows=args.chunk_rows, assume_sorted=args.sorted_input,
+                                            **build_options)
+        logger.info(f"Successfully processed and saved {streamed} variants")
+        return streamed
+    
+    if args.incremental:
+        rebuilt = update_variant_datacards(data_file, variants_dir, manifest_path, engine=args.engine,
+                                           workers=args.write_workers, indent=args.indent,
+                                           layout=args.layout, shard_size=args.shard_size, **build_options)
+        logger.info(f"Rebuilt {rebuilt} variant datacards")
+        return rebuilt
+    
+    # Process the screening data
+    variants = process_screening_data(data_file, engine=args.engine, **build_options)
+    
+    if variants:
+        # Save individual variant datacards
+        save_variant_datacards(variants, variants_dir, workers=args.write_workers, indent=args.indent,
+                               layout=args.layout, shard_size=args.shard_size)
+        write_manifest(load_screening_data(data_file), manifest_path,
+                       manifest_settings(args.engine, build_options, args.indent, args.layout, args.shard_size))
+        logger.info(f"Successfully processed and saved {len(variants)} variants")
+    else:
+        logger.warning("No variants were processed")
+    return len(variants)
 
 def main():
     """Main processing function."""
+    args = parse_args()
+    
     # Setup paths
     script_dir = Path(__file__).parent
     project_root = script_dir.parent.parent
@@ -278,10 +693,6 @@ def main():
     
     logger.info("Starting data processing...")
     
-    # Create output directories
-    variants_dir = data_output_dir / "variants"
-    variants_dir.mkdir(parents=True, exist_ok=True)
-    
     # Look for screening data CSV file
     data_file = data_raw_dir / "master_qDMS_df.csv"
     
@@ -289,17 +700,14 @@ def main():
         logger.error(f"Data file not found: {data_file}")
         sys.exit(1)
     
-    # Process the screening data
-    variants = process_screening_data(data_file)
-    
-    if variants:
-        # Save individual variant datacards
-        save_variant_datacards(variants, variants_dir)
-        logger.info(f"Successfully processed and saved {len(variants)} variants")
-    else:
-        logger.warning("No variants were processed")
-    
+    with profile_run('process_data', profile=args.profile, cpu=args.profile_cpu,
+                     memory_top=args.profile_memory):
+        try:
+            generate_datacards(data_file, data_output_dir, args)
+        except UnsortedInputError as e:
+            logger.error(f"{e}: {data_file}")
+            sys.exit(1)
     logger.info("Data processing completed!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Columnar QC flag computation for dose-response data.
+Evaluates every QC check for all variant-drug rows in one pass over the
+response tensor and stores the result as a bitmask per row.
+"""
+
+import numpy as np
+import logging
+
+from stage_timers import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Flag names in bit order; decoding preserves this order
+QC_FLAGS = [
+    'insufficient_replicates',
+    'high_replicate_variation',
+    'no_ic50_estimate',
+    'flat_dose_response'
+]
+
+QC_BITS = {flag: 1 << bit for bit, flag in enumerate(QC_FLAGS)}
+
+DEFAULT_QC_THRESHOLDS = {
+    # Largest allowed |rep1 - rep2| at any dose
+    'max_replicate_difference': 0.5,
+    # Responses within this distance of the first dose count as flat
+    'flat_response_tolerance': 0.0
+}
+
+@stage_timer('qc')
+def compute_qc_mask(responses, valid, ic50, thresholds=None):
+    """Compute the QC bitmask for every row of a dose-response tensor.
+
+    responses is the (n_rows, n_doses, 2) rep1/rep2 tensor, valid marks the
+    doses kept for each row and ic50 holds NaN where no estimate exists.
+    """
+    thresholds = {**DEFAULT_QC_THRESHOLDS, **(thresholds or {})}
+    rep1 = responses[:, :, 0]
+    rep2 = responses[:, :, 1]
+    has_data = valid.any(axis=1)
+    mask = np.zeros(len(responses), dtype=np.uint8)
+
+    mask[~has_data] |= QC_BITS['insufficient_replicates']
+
+    # Check for large replicate differences
+    max_diff = np.max(np.where(valid, np.abs(rep1 - rep2), -np.inf), axis=1)
+    mask[has_data & (max_diff > thresholds['max_replicate_difference'])] |= QC_BITS['high_replicate_variation']
+
+    # Check for missing IC50
+    mask[np.isnan(ic50)] |= QC_BITS['no_ic50_estimate']
+
+    # Check for unusual dose-response patterns
+    first = rep1[np.arange(len(rep1)), np.argmax(valid, axis=1)][:, None]
+    flat = np.all(~valid | (np.abs(rep1 - first) <= thresholds['flat_response_tolerance']), axis=1)
+    mask[has_data & flat] |= QC_BITS['flat_dose_response']
+
+    return mask
+
+def decode_qc_flags(mask):
+    """Expand a QC bitmask into its list of flag names."""
+    return [flag for flag in QC_FLAGS if mask & QC_BITS[flag]]
+
+def summarize_qc_mask(mask):
+    """Count how many rows carry each QC flag."""
+    return {flag: int(np.count_nonzero(mask & QC_BITS[flag])) for flag in QC_FLAGS}
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Run reports for the pipeline scripts.
+The stage timers in stage_timers (load, group, ic50, qc, serialize,
+write, ...) are always collected; with --profile a script also writes
+them to run_report.json under data-pipeline/benchmarks/results/profiling,
+optionally with cProfile dumps and tracemalloc's top allocations. Reports
+stay out of public/ so they are never deployed with the site.
+"""
+
+import sys
+import time
+import cProfile
+import pstats
+import platform
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import logging
+
+from json_writer import loads_json, write_json_file
+from screening_data import peak_rss_mb
+from stage_timers import stage_times, reset_stage_times
+
+logger = logging.getLogger(__name__)
+
+# Bump when the report layout changes
+RUN_REPORT_VERSION = 1
+
+RUN_REPORT_NAME = "run_report.json"
+PROFILE_DIR_NAME = "profiles"
+
+# Reports stay out of public/data/v1.0, which Vite would copy into the site
+DEFAULT_REPORT_DIR = Path(__file__).parent.parent / "benchmarks" / "results" / "profiling"
+REPORT_DIR_LABEL = "data-pipeline/benchmarks/results/profiling"
+
+# Functions listed in the report from each cProfile dump
+TOP_FUNCTIONS = 20
+
+# pstats files dumped during the current profiled run
+_cpu_profiles = []
+
+def add_profile_arguments(parser):
+    """Add the profiling options to an argument parser."""
+    parser.add_argument('--profile', action='store_true',
+                        help=f"Write per-stage timings and peak memory to {REPORT_DIR_LABEL}/{RUN_REPORT_NAME} "
+                             f"(not next to the outputs in public/data/v1.0, so reports are never deployed)")
+    parser.add_argument('--profile-cpu', action='store_true',
+                        help=f"Also dump cProfile statistics to {REPORT_DIR_LABEL}/{PROFILE_DIR_NAME}/*.pstats "
+                             f"(implies --profile)")
+    parser.add_argument('--profile-memory', type=int, nargs='?', const=10, default=0, metavar='N',
+                        help="Also trace allocations and report the top N sites (default: 10; implies --profile)")
+    return parser
+
+def top_functions(stats_path, limit=TOP_FUNCTIONS):
+    """Most expensive functions of a pstats dump by cumulative time."""
+    stats = pstats.Stats(str(stats_path))
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': f"{Path(file).name}:{line}({name})",
+            'calls': calls,
+            'tottime': round(tottime, 4),
+            'cumtime': round(cumtime, 4)
+        }
+        for (file, line, name), (_, calls, tottime, cumtime, _) in rows
+    ]
+
+@contextmanager
+def cpu_profile(stats_path):
+    """cProfile the calling thread for the duration of the block and dump the stats."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(stats_path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(stats_path))
+        _cpu_profiles.append(Path(stats_path))
+
+def memory_report(limit):
+    """Peak traced memory and the top allocation sites still held."""
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    top = snapshot.statistics('lineno')[:limit]
+    return {
+        'peak_traced_mb': round(peak / 1e6, 1),
+        'top_allocations': [
+            {
+                'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                'size_mb': round(stat.size / 1e6, 3),
+                'count': stat.count
+            }
+            for stat in top
+        ]
+    }
+
+def write_run_report(report, report_dir):
+    """Store report under its script's name in report_dir/run_report.json."""
+    report_path = Path(report_dir) / RUN_REPORT_NAME
+    reports = {'version': RUN_REPORT_VERSION, 'runs': {}}
+    if report_path.exists():
+        try:
+            with open(report_path, 'rb') as f:
+                previous = loads_json(f.read())
+            if previous.get('version') == RUN_REPORT_VERSION:
+                reports = previous
+        except (OSError, ValueError) as e:
+            logger.warning(f"Replacing unreadable run report {report_path}: {e}")
+
+    reports['runs'][report['script']] = report
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    write_json_file(report_path, reports, indent=2)
+    return report_path
+
+def log_stage_times(stages):
+    """Log the per-stage timings."""
+    logger.info("Stage timings (inclusive, summed over threads):")
+    for name, entry in sorted(stages.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        logger.info(f"  {name:<14} {entry['seconds']:8.3f}s  {entry['calls']:>8} calls")
+
+@contextmanager
+def profile_run(script, report_dir=DEFAULT_REPORT_DIR, profile=False, cpu=False, memory_top=0):
+    """Profile a script run and write its report when any option is set.
+
+    The report goes to report_dir/run_report.json; the default report_dir
+    is data-pipeline/benchmarks/results/profiling rather than the public
+    output directory, so reports are never deployed. cpu dumps cProfile statistics of the calling thread to
+    report_dir/profiles/<script>.pstats (work in other threads can be
+    profiled with cpu_profile into the yielded profiles directory);
+    memory_top traces allocations and reports the top sites.
+    """
+    reset_stage_times()
+    _cpu_profiles.clear()
+    profiles_dir = Path(report_dir) / PROFILE_DIR_NAME
+    if not (profile or cpu or memory_top):
+        yield profiles_dir
+        return
+
+    started = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    stats_path = profiles_dir / f"{script}.pstats"
+    if memory_top:
+        tracemalloc.start()
+
+    try:
+        if cpu:
+            with cpu_profile(stats_path):
+                yield profiles_dir
+        else:
+            yield profiles_dir
+    finally:
+        stages = stage_times()
+        report = {
+            'script': script,
+            'started': started,
+            'wall_seconds': round(time.perf_counter() - start, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'argv': sys.argv[1:],
+            'python': platform.python_version(),
+            'stages': stages
+        }
+        if _cpu_profiles:
+            report['cpu_profiles'] = {
+                path.stem: {'file': f"{PROFILE_DIR_NAME}/{path.name}", 'top_functions': top_functions(path)}
+                for path in _cpu_profiles
+            }
+        if memory_top:
+            report['memory'] = memory_report(memory_top)
+            tracemalloc.stop()
+
+        log_stage_times(stages)
+        report_path = write_run_report(report, report_dir)
+        logger.info(f"Run report saved: {report_path}")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Shared loader for the qDMS screening CSV (master_qDMS_df.csv).
+Parses the CSV once with explicit dtypes and caches the columnar result
+as a .npz file keyed by the CSV's size, mtime and content hash.
+"""
+
+import os
+import sys
+import math
+import itertools
+import pickle
+import hashlib
+import tempfile
+import pandas as pd
+import numpy as np
+from pathlib import Path
+import logging
+
+from stage_timers import stage_timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Explicit dtypes for the screening CSV columns
+SCREENING_DTYPES = {
+    'index': 'int64',
+    'species': 'category',
+    'type': 'category',
+    'synSNP': 'bool',
+    'ref_aa': 'category',
+    'protein_start': 'int16',
+    'alt_aa': 'category',
+    'conc': 'float64',
+    'netgr_obs': 'float64',
+    'cell_line': 'category',
+    'rep': 'int8',
+    'Gene': 'category',
+    'Drug': 'category'
+}
+
+SCREENING_COLUMNS = list(SCREENING_DTYPES.keys())
+
+# Bump when the on-disk cache layout changes
+CACHE_FORMAT_VERSION = 1
+
+# Streaming defaults
+DEFAULT_CHUNK_ROWS = 200_000
+DEFAULT_MEMORY_BUDGET_MB = 512
+
+# Working memory needed per byte of a loaded partition while it is processed
+PROCESSING_OVERHEAD = 4
+
+# Frames already loaded in this process, keyed by (csv path, cache key)
+_loaded_frames = {}
+
+# Content digests already computed in this process, keyed by (csv path, size, mtime)
+_content_digests = {}
+
+class UnsortedInputError(ValueError):
+    """Raised when a CSV streamed with assume_sorted turns out to be unsorted."""
+
+def default_cache_dir(csv_path):
+    """Return the cache directory used for a CSV when none is given."""
+    return Path(csv_path).parent / ".cache"
+
+def compute_cache_key(csv_path):
+    """Build a cache key from the CSV's size, mtime and content hash.
+
+    The content hash is computed once per process for each (path, size,
+    mtime) and reused by later calls.
+    """
+    csv_path = Path(csv_path).resolve()
+    stat = os.stat(csv_path)
+    stat_key = (str(csv_path), stat.st_size, stat.st_mtime_ns)
+
+    hexdigest = _content_digests.get(stat_key)
+    if hexdigest is None:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(csv_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        hexdigest = digest.hexdigest()
+        # Drop digests for older versions of the same file
+        for key in [k for k in _content_digests if k[0] == stat_key[0]]:
+            del _content_digests[key]
+        _content_digests[stat_key] = hexdigest
+
+    return f"v{CACHE_FORMAT_VERSION}-{stat.st_size}-{stat.st_mtime_ns}-{hexdigest}"
+
+def screening_read_dtypes(csv_path):
+    """Dtypes that can be applied while pd.read_csv parses the file."""
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return {
+        col: dtype for col, dtype in SCREENING_DTYPES.items()
+        if col in header and dtype in ('category', 'float64')
+    }
+
+def apply_screening_dtypes(df):
+    """Narrow integer columns and store text columns as categoricals."""
+    # Integer and boolean columns can only be narrowed when they have no gaps
+    for col, dtype in SCREENING_DTYPES.items():
+        if col in df.columns and dtype not in ('category', 'float64') and not df[col].isna().any():
+            df[col] = df[col].astype(dtype)
+
+    # Remaining text columns are stored as categoricals too
+    for col in df.columns:
+        if df[col].dtype == object or pd.api.types.is_string_dtype(df[col].dtype):
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+
+    return df
+
+def parse_screening_csv(csv_path):
+    """Parse the screening CSV with explicit dtypes."""
+    df = pd.read_csv(csv_path, dtype=screening_read_dtypes(csv_path))
+    return apply_screening_dtypes(df)
+
+def frame_to_arrays(df):
+    """Flatten a frame into plain NumPy arrays suitable for np.savez."""
+    arrays = {'__columns__': np.array(list(df.columns), dtype=str)}
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            arrays[f"{col}__codes"] = series.cat.codes.to_numpy()
+            arrays[f"{col}__categories"] = np.array(series.cat.categories.tolist(), dtype=str)
+        else:
+            arrays[col] = series.to_numpy()
+    return arrays
+
+def arrays_to_frame(arrays):
+    """Rebuild a frame from arrays written by frame_to_arrays."""
+    columns = {}
+    for col in arrays['__columns__'].tolist():
+        if f"{col}__codes" in arrays:
+            columns[col] = pd.Categorical.from_codes(
+                arrays[f"{col}__codes"],
+                categories=arrays[f"{col}__categories"].tolist()
+            )
+        else:
+            columns[col] = arrays[col]
+    return pd.DataFrame(columns)
+
+def read_cache(cache_path, cache_key):
+    """Load a cached frame, or return None if missing or stale."""
+    if not cache_path.exists():
+        return None
+
+    try:
+        with np.load(cache_path, allow_pickle=False) as npz:
+            if str(npz['__key__']) != cache_key:
+                return None
+            return arrays_to_frame({name: npz[name] for name in npz.files})
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache {cache_path}: {e}")
+        return None
+
+def write_cache(df, cache_path, cache_key):
+    """Persist a frame to the .npz cache atomically."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = frame_to_arrays(df)
+        arrays['__key__'] = np.array(cache_key)
+
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Failed to write cache {cache_path}: {e}")
+
+@stage_timer('load')
+def load_screening_data(csv_path, cache_dir=None, use_cache=True):
+    """Load the screening CSV, reusing the parsed frame whenever possible.
+
+    The returned frame is shared between callers and must not be modified
+    in place.
+    """
+    csv_path = Path(csv_path).resolve()
+    cache_key = compute_cache_key(csv_path)
+
+    memo_key = (str(csv_path), cache_key)
+    if memo_key in _loaded_frames:
+        return _loaded_frames[memo_key]
+
+    cache_path = Path(cache_dir or default_cache_dir(csv_path)) / f"{csv_path.stem}.npz"
+    df = read_cache(cache_path, cache_key) if use_cache else None
+
+    if df is not None:
+        logger.info(f"Loaded {len(df)} rows from cache {cache_path}")
+    else:
+        df = parse_screening_csv(csv_path)
+        logger.info(f"Parsed {len(df)} rows from {csv_path}")
+        if use_cache:
+            write_cache(df, cache_path, cache_key)
+
+    # Drop frames for older versions of the same file
+    for key in [k for k in _loaded_frames if k[0] == memo_key[0]]:
+        del _loaded_frames[key]
+    _loaded_frames[memo_key] = df
+    return df
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def partition_keys(df, position_bucket):
+    """Frame of the columns that decide which partition a row belongs to."""
+    return pd.DataFrame({
+        'Gene': df['Gene'].astype(str).to_numpy(),
+        'bucket': df['protein_start'].to_numpy() // position_bucket
+    })
+
+def estimate_partition_count(csv_path, sample, memory_budget_mb):
+    """Choose how many partitions keep each one within the memory budget."""
+    with open(csv_path, 'rb') as f:
+        head = f.read(1 << 20)
+    bytes_per_line = len(head) / max(head.count(b'\n'), 1)
+    estimated_rows = os.path.getsize(csv_path) / bytes_per_line
+
+    bytes_per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    working_set = estimated_rows * bytes_per_row * PROCESSING_OVERHEAD
+    return max(1, math.ceil(working_set / (memory_budget_mb * 1024 * 1024)))
+
+def iter_sorted_partitions(chunks, position_bucket, batch_rows):
+    """Stream groups from a CSV already sorted by (Gene, position bucket).
+
+    Rows of the last key in each chunk are carried over, since that group
+    may continue in the next chunk. Raises UnsortedInputError if a key
+    reappears after its group was emitted.
+    """
+    emitted_keys = set()
+    pending = []
+    pending_rows = 0
+    carry = None
+
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        keys = partition_keys(chunk, position_bucket)
+        last_key = tuple(keys.iloc[-1])
+        is_last = (keys['Gene'] == last_key[0]).to_numpy() & (keys['bucket'] == last_key[1]).to_numpy()
+        carry = chunk[is_last]
+        complete = chunk[~is_last]
+
+        if len(complete):
+            complete_keys = set(keys[~is_last].itertuples(index=False, name=None))
+            if complete_keys & emitted_keys:
+                raise UnsortedInputError("Screening CSV is not sorted by Gene and protein_start; "
+                                         "sort it or run again without --sorted-input")
+            emitted_keys |= complete_keys
+            pending.append(complete)
+            pending_rows += len(complete)
+
+        if pending_rows >= batch_rows:
+            yield apply_screening_dtypes(pd.concat(pending, ignore_index=True))
+            pending, pending_rows = [], 0
+
+    if carry is not None and len(carry):
+        pending.append(carry)
+    if pending:
+        yield apply_screening_dtypes(pd.concat(pending, ignore_index=True))
+
+def iter_spilled_partitions(csv_path, chunks, position_bucket, memory_budget_mb, spill_dir):
+    """Hash-partition an unsorted CSV into spill files, then yield each partition."""
+    first = next(chunks, None)
+    if first is None:
+        return
+
+    n_partitions = estimate_partition_count(csv_path, first, memory_budget_mb)
+    logger.info(f"Spilling {csv_path} into {n_partitions} partitions "
+                f"(memory budget {memory_budget_mb} MB)")
+
+    with tempfile.TemporaryDirectory(prefix="qdms_spill_", dir=spill_dir) as tmp_dir:
+        spill_paths = [Path(tmp_dir) / f"partition_{i:04d}.pkl" for i in range(n_partitions)]
+
+        for chunk in itertools.chain([first], chunks):
+            hashes = pd.util.hash_pandas_object(partition_keys(chunk, position_bucket), index=False)
+            partition_ids = (hashes.to_numpy() % n_partitions).astype(np.int64)
+            for partition_id in np.unique(partition_ids):
+                with open(spill_paths[partition_id], 'ab') as f:
+                    pickle.dump(chunk[partition_ids == partition_id], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        for spill_path in spill_paths:
+            if not spill_path.exists():
+                continue
+            pieces = []
+            with open(spill_path, 'rb') as f:
+                while True:
+                    try:
+                        pieces.append(pickle.load(f))
+                    except EOFError:
+                        break
+            spill_path.unlink()
+            yield apply_screening_dtypes(pd.concat(pieces, ignore_index=True))
+
+def iter_screening_partitions(csv_path, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                              chunk_rows=DEFAULT_CHUNK_ROWS, position_bucket=1,
+                              assume_sorted=False, spill_dir=None):
+    """Stream the screening CSV as frames that each hold complete groups.
+
+    Every row sharing a Gene and protein_start // position_bucket lands in
+    the same frame, so variant (and variant-drug) groups are never split.
+    A CSV sorted by those columns is streamed directly; otherwise it is
+    hash-partitioned into spill files sized to fit memory_budget_mb.
+    Rows keep their original relative order within each frame.
+    """
+    chunks = iter(pd.read_csv(csv_path, dtype=screening_read_dtypes(csv_path), chunksize=chunk_rows))
+    if assume_sorted:
+        batch_rows = max(chunk_rows, 1)
+        yield from iter_sorted_partitions(chunks, position_bucket, batch_rows)
+    else:
+        yield from iter_spilled_partitions(csv_path, chunks, position_bucket, memory_budget_mb, spill_dir)
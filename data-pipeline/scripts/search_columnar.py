@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Columnar encoding of the search index variant entries.
+Stores variants as parallel arrays (gene index, ref_aa, position, alt_aa,
+drug bitmask, drug order) with lookup tables for genes, amino acids,
+drugs and drug orders, instead of one object per variant that repeats
+every key. Clients can load the arrays into typed arrays and filter with
+plain scans.
+"""
+
+import re
+import json
+from pathlib import Path
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump when the columnar layout changes
+COLUMNAR_FORMAT_VERSION = 2
+
+# Drugs are packed into 32-bit mask words so clients can use Uint32Array
+DRUG_MASK_BITS = 32
+
+VARIANT_STRING_PATTERN = re.compile(r'^(?P<ref>[A-Za-z*]+)(?P<position>\d+)(?P<alt>[A-Za-z*]+)$')
+
+def table_index(table, lookup, value):
+    """Index of value in a lookup table, appending it on first use."""
+    if value not in lookup:
+        lookup[value] = len(table)
+        table.append(value)
+    return lookup[value]
+
+def encode_columnar_variants(variants, drug_names):
+    """Encode variant entries as parallel arrays with lookup tables.
+
+    drug_names fixes the drug bit order; drugs not in it are appended.
+    Raises ValueError for entries that cannot be encoded losslessly (a
+    variant_string that is not ref + position + alt, or a protein_change
+    other than "p." + variant_string).
+    """
+    tables = {'genes': [], 'amino_acids': [], 'drugs': list(drug_names), 'consequences': [], 'drug_orders': []}
+    lookups = {name: {value: i for i, value in enumerate(table)} for name, table in tables.items()}
+    columns = {'gene': [], 'ref_aa': [], 'position': [], 'alt_aa': [], 'consequence': [], 'drug_order': []}
+    masks = []
+
+    for variant in variants:
+        variant_string = variant.get('variant_string', '')
+        match = VARIANT_STRING_PATTERN.match(variant_string)
+        if not match:
+            raise ValueError(f"Cannot encode variant string {variant_string!r}")
+        if variant.get('protein_change') != f"p.{variant_string}":
+            raise ValueError(f"protein_change of {variant_string!r} is not derivable from its variant string")
+
+        columns['gene'].append(table_index(tables['genes'], lookups['genes'], variant.get('gene', '')))
+        columns['ref_aa'].append(table_index(tables['amino_acids'], lookups['amino_acids'], match['ref']))
+        columns['position'].append(int(match['position']))
+        columns['alt_aa'].append(table_index(tables['amino_acids'], lookups['amino_acids'], match['alt']))
+        columns['consequence'].append(
+            table_index(tables['consequences'], lookups['consequences'], variant.get('consequence', '')))
+
+        # The mask is for filtering; drug_order keeps drugs_tested's order
+        drug_ids = tuple(table_index(tables['drugs'], lookups['drugs'], drug)
+                         for drug in variant.get('drugs_tested', []))
+        mask = 0
+        for drug_id in drug_ids:
+            mask |= 1 << drug_id
+        masks.append(mask)
+        columns['drug_order'].append(table_index(tables['drug_orders'], lookups['drug_orders'], drug_ids))
+
+    # One mask column per 32 drugs; bit b of word w is drug w * 32 + b
+    word_mask = (1 << DRUG_MASK_BITS) - 1
+    word_count = max(1, -(-len(tables['drugs']) // DRUG_MASK_BITS))
+    columns['drug_mask'] = [
+        [(mask >> (word * DRUG_MASK_BITS)) & word_mask for mask in masks]
+        for word in range(word_count)
+    ]
+
+    tables['drug_orders'] = [list(drug_ids) for drug_ids in tables['drug_orders']]
+    return {'count': len(variants), **tables, **columns}
+
+def decode_columnar_variants(columnar):
+    """Rebuild variant entries from their columnar encoding.
+
+    drugs_tested comes back in its original order.
+    """
+    genes, amino_acids = columnar['genes'], columnar['amino_acids']
+    drugs, consequences = columnar['drugs'], columnar['consequences']
+    drug_orders = columnar['drug_orders']
+
+    variants = []
+    for i in range(columnar['count']):
+        variant_string = f"{amino_acids[columnar['ref_aa'][i]]}{columnar['position'][i]}{amino_acids[columnar['alt_aa'][i]]}"
+        variants.append({
+            'gene': genes[columnar['gene'][i]],
+            'variant_string': variant_string,
+            'protein_change': f"p.{variant_string}",
+            'consequence': consequences[columnar['consequence'][i]],
+            'drugs_tested': [drugs[drug_id] for drug_id in drug_orders[columnar['drug_order'][i]]]
+        })
+    return variants
+
+def encode_columnar_index(search_index):
+    """Columnar version of a search index; genes, drugs and stats are kept as they are."""
+    return {
+        'format': 'columnar',
+        'version': COLUMNAR_FORMAT_VERSION,
+        'genes': search_index['genes'],
+        'drugs': search_index['drugs'],
+        'variants': encode_columnar_variants(search_index['variants'],
+                                             [drug['name'] for drug in search_index['drugs']]),
+        'lastUpdate': search_index['lastUpdate'],
+        'stats': search_index['stats']
+    }
+
+def decode_columnar_index(columnar_index):
+    """Row-oriented search index (as in search_index.json) from its columnar version."""
+    if columnar_index.get('version') != COLUMNAR_FORMAT_VERSION:
+        raise ValueError(f"Unsupported columnar index version: {columnar_index.get('version')}")
+
+    return {
+        'genes': columnar_index['genes'],
+        'drugs': columnar_index['drugs'],
+        'variants': decode_columnar_variants(columnar_index['variants']),
+        'lastUpdate': columnar_index['lastUpdate'],
+        'stats': columnar_index['stats']
+    }
+
+def load_columnar_index(path):
+    """Load a columnar search index file and decode it."""
+    with open(Path(path), 'r') as f:
+        return decode_columnar_index(json.load(f))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Inverted prefix index for the search index.
+Maps every prefix of every searchable term (gene symbols and names, drug
+names and synonyms, variant strings) to a sorted posting list of integer
+entry IDs, so a client search is a dictionary lookup per query word plus
+a posting-list intersection instead of a scan over every entry.
+
+The sharded layout splits this into a small root index (genes, drugs,
+stats and the shard manifest) and one variant shard per gene with its own
+postings, so clients only fetch the genes a query narrows to.
+"""
+
+import re
+import logging
+
+from json_writer import dumps_json, content_hash, safe_file_stem
+from stage_timers import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Bump when tokenization or the output layout changes
+TOKEN_INDEX_VERSION = 1
+SHARDED_INDEX_VERSION = 1
+
+SHARD_ROOT_NAME = "index.json"
+SHARD_DIR_NAME = "genes"
+
+# Shards are routed by the first few characters of each query word; longer
+# prefixes would make the root index as large as the postings it replaces
+SHARD_ROUTING_LENGTH = 3
+
+TERM_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+VARIANT_PATTERN = re.compile(r'^(?P<ref>[a-z*]+)(?P<position>\d+)(?P<alt>[a-z*]+)$')
+
+def normalize_term(term):
+    """Lowercase a term and drop a leading 'p.' protein-change prefix.
+
+    Clients apply the same normalization to each query word.
+    """
+    term = str(term).strip().lower()
+    return term[2:] if term.startswith('p.') else term
+
+def term_tokens(term):
+    """Every prefix of a term and of its alphanumeric parts."""
+    term = normalize_term(term)
+    if not term:
+        return set()
+
+    words = {term}
+    words.update(part for part in TERM_SEPARATORS.split(term) if part)
+    return {word[:length] for word in words for length in range(1, len(word) + 1)}
+
+def variant_terms(variant_string):
+    """Terms of a variant: T315I is found by 't315...' and by '315...'."""
+    term = normalize_term(variant_string)
+    terms = [term]
+    match = VARIANT_PATTERN.match(term)
+    if match:
+        terms.append(f"{match['position']}{match['alt']}")
+    return terms
+
+def build_token_index(genes, drugs, variants):
+    """Build the inverted prefix index for the search index entries.
+
+    IDs number genes, then drugs, then variants, in the order they appear
+    in the search index lists; id_ranges gives the [start, end) of each.
+    Variants are also indexed under their full gene symbol (not its
+    prefixes) so multi-word queries like "bcr-abl t315" narrow to one
+    gene; shorter gene queries are answered by the gene entry, which keeps
+    gene prefixes from carrying every variant's ID.
+    """
+    postings = {}
+
+    def add(entry_id, tokens):
+        for token in tokens:
+            postings.setdefault(token, []).append(entry_id)
+
+    entry_id = 0
+    gene_tokens = {}
+    for gene in genes:
+        tokens = term_tokens(gene['symbol']) | term_tokens(gene.get('name', ''))
+        for synonym in gene.get('synonyms', []):
+            tokens |= term_tokens(synonym)
+        gene_tokens[gene['symbol']] = {normalize_term(gene['symbol'])} - {''}
+        add(entry_id, tokens)
+        entry_id += 1
+    genes_end = entry_id
+
+    for drug in drugs:
+        tokens = term_tokens(drug['name'])
+        for synonym in drug.get('synonyms', []):
+            tokens |= term_tokens(synonym)
+        add(entry_id, tokens)
+        entry_id += 1
+    drugs_end = entry_id
+
+    for variant in variants:
+        gene = variant.get('gene', '')
+        if gene not in gene_tokens:
+            gene_tokens[gene] = {normalize_term(gene)} - {''}
+        tokens = set(gene_tokens[gene])
+        for term in variant_terms(variant.get('variant_string', '')):
+            tokens |= term_tokens(term)
+        add(entry_id, tokens)
+        entry_id += 1
+
+    logger.debug(f"Token index: {len(postings)} tokens, "
+                f"{sum(len(ids) for ids in postings.values())} postings for {entry_id} entries")
+
+    return {
+        'version': TOKEN_INDEX_VERSION,
+        'id_ranges': {
+            'genes': [0, genes_end],
+            'drugs': [genes_end, drugs_end],
+            'variants': [drugs_end, entry_id]
+        },
+        'tokens': dict(sorted(postings.items()))
+    }
+
+@stage_timer('index')
+def build_sharded_index(search_index):
+    """Split a search index into a root index and one variant shard per gene.
+
+    The root holds genes, drugs, stats and a token index over genes and
+    drugs, plus shard_tokens mapping the first 1 to SHARD_ROUTING_LENGTH
+    characters of each variant token to the shards (positions in the
+    shards list) that contain it; a query word is routed by its first
+    SHARD_ROUTING_LENGTH characters. Each shard holds one gene's variants
+    and their own token index. Returns {relative path:
+    bytes or object} ready for write_json_tree.
+    """
+    variants_by_gene = {}
+    for variant in search_index['variants']:
+        variants_by_gene.setdefault(variant.get('gene', ''), []).append(variant)
+
+    files = {}
+    shards = []
+    shard_tokens = {}
+    for gene, variants in variants_by_gene.items():
+        shard_index = build_token_index([], [], variants)
+        # Full gene symbols are posted without their prefixes, so route by
+        # the leading characters of every token rather than short tokens only
+        routes = {token[:length] for token in shard_index['tokens']
+                  for length in range(1, min(len(token), SHARD_ROUTING_LENGTH) + 1)}
+        for route in routes:
+            shard_tokens.setdefault(route, []).append(len(shards))
+
+        data = dumps_json({'gene': gene, 'variants': variants, **shard_index})
+        path = f"{SHARD_DIR_NAME}/{safe_file_stem(str(gene))}.json"
+        files[path] = data
+        shards.append({
+            'gene': gene,
+            'file': path,
+            'variant_count': len(variants),
+            'hash': content_hash(data)
+        })
+
+    root_index = build_token_index(search_index['genes'], search_index['drugs'], [])
+    files[SHARD_ROOT_NAME] = {
+        'version': SHARDED_INDEX_VERSION,
+        'lastUpdate': search_index['lastUpdate'],
+        'genes': search_index['genes'],
+        'drugs': search_index['drugs'],
+        'stats': search_index['stats'],
+        'id_ranges': root_index['id_ranges'],
+        'tokens': root_index['tokens'],
+        'shards': shards,
+        'shard_routing_length': SHARD_ROUTING_LENGTH,
+        'shard_tokens': dict(sorted(shard_tokens.items()))
+    }
+
+    logger.info(f"Sharded search index: {len(shards)} gene shards, "
+                f"{len(root_index['tokens'])} root tokens, {len(shard_tokens)} variant tokens")
+    return files
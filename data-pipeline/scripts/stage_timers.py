@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Process-wide per-stage timers.
+Each timed block costs two perf_counter calls and a locked dict update,
+cheap enough to leave on in production runs; run_profile reports them.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Stage name -> [seconds, calls], summed over every thread
+_stage_times = {}
+_stage_lock = threading.Lock()
+
+@contextmanager
+def stage_timer(name):
+    """Add the time spent in the block to the named stage.
+
+    Times are inclusive: a stage timed inside another counts towards both,
+    and stages running in several threads add up their threads' time.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _stage_lock:
+            entry = _stage_times.setdefault(name, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+
+def stage_times():
+    """{stage: {'seconds', 'calls'}} collected so far."""
+    with _stage_lock:
+        return {name: {'seconds': round(seconds, 4), 'calls': calls}
+                for name, (seconds, calls) in _stage_times.items()}
+
+def reset_stage_times():
+    """Forget the stage times collected so far."""
+    with _stage_lock:
+        _stage_times.clear()
@@ -7,11 +7,16 @@ Validates CSV input files and JSON schemas.
 import os
 import sys
 import json
+import argparse
 import pandas as pd
 from pathlib import Path
 from jsonschema import validate, ValidationError
 import logging
 
+from screening_data import load_screening_data, SCREENING_COLUMNS
+from stage_timers import stage_timer
+from run_profile import add_profile_arguments, profile_run
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,10 +33,11 @@ def load_schema(schema_path):
         logger.error(f"Invalid JSON schema: {e}")
         sys.exit(1)
 
-def validate_csv_structure(csv_path, required_columns):
+def validate_csv_structure(csv_path, required_columns, df=None):
     """Validate CSV file structure and required columns."""
     try:
-        df = pd.read_csv(csv_path)
+        if df is None:
+            df = pd.read_csv(csv_path)
         
         # Check for required columns
         missing_cols = set(required_columns) - set(df.columns)
@@ -110,10 +116,16 @@ def validate_ic50_values(df):
     
     return issues
 
-def main():
-    """Main validation routine."""
-    project_root = Path(__file__).parent.parent.parent
+@stage_timer('validate')
+def validate_project_data(project_root, screening_csv=None):
+    """Validate the raw CSV files and the existing search index.
+    
+    Only the master screen the pipeline consumes (screening_csv, default
+    data/raw/master_qDMS_df.csv) is loaded; other qDMS CSVs are skipped.
+    Returns True when every check passed.
+    """
     data_dir = project_root / "data" / "raw"
+    screening_csv = Path(screening_csv or data_dir / "master_qDMS_df.csv").resolve()
     config_dir = project_root / "data-pipeline" / "config"
     
     logger.info("Starting data validation...")
@@ -156,14 +168,33 @@ def main():
                 logger.info(f"Validating CSV file: {csv_file}")
                 
                 # Determine file type and validate accordingly
-                if 'variant' in csv_file.name.lower() or 'mutation' in csv_file.name.lower():
-                    if not validate_csv_structure(csv_file, variant_csv_columns):
+                if csv_file.resolve() == screening_csv:
+                    try:
+                        df = load_screening_data(csv_file)
+                    except Exception as e:
+                        logger.error(f"Error reading CSV {csv_file}: {e}")
                         validation_passed = False
                         continue
                     
-                    # Additional variant-specific validation
-                    df = pd.read_csv(csv_file)
+                    if not validate_csv_structure(csv_file, SCREENING_COLUMNS, df=df):
+                        validation_passed = False
+                
+                elif 'qdms' in csv_file.name.lower():
+                    logger.info(f"Skipping {csv_file}: not the master screen {screening_csv.name}")
+                
+                elif 'variant' in csv_file.name.lower() or 'mutation' in csv_file.name.lower():
+                    try:
+                        df = pd.read_csv(csv_file)
+                    except Exception as e:
+                        logger.error(f"Error reading CSV {csv_file}: {e}")
+                        validation_passed = False
+                        continue
                     
+                    if not validate_csv_structure(csv_file, variant_csv_columns, df=df):
+                        validation_passed = False
+                        continue
+                    
+                    # Additional variant-specific validation
                     issues = []
                     issues.extend(validate_gene_symbols(df))
                     issues.extend(validate_variant_notation(df))
@@ -181,7 +212,24 @@ def main():
     else:
         logger.info("No raw data directory found - skipping CSV validation")
     
-    if validation_passed:
+    return validation_passed
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Validate the screening data and generated outputs")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    """Main validation routine."""
+    args = parse_args()
+    project_root = Path(__file__).parent.parent.parent
+    
+    with profile_run('validate_data', profile=args.profile,
+                     cpu=args.profile_cpu, memory_top=args.profile_memory):
+        passed = validate_project_data(project_root)
+    
+    if passed:
         logger.info("✅ All validation checks passed!")
         sys.exit(0)
     else:
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Parallel scanner for variant datacard directories.
+Reads every datacard under a variants directory with a thread pool and
+keeps a summary of each file in an on-disk cache keyed by its mtime and
+size, so files that have not changed are not parsed again. Understands
+the flat {Gene}_{variant}.json layout written by process_data.py, the
+older {Gene}/{variant}.json directories and position-sharded bundles.
+"""
+
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from json_writer import loads_json, write_json_file
+from variant_shards import SHARD_INDEX_NAME, parse_variant_key
+from stage_timers import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached summary fields change
+SCAN_CACHE_VERSION = 1
+
+def datacard_summary(card, gene):
+    """Fields of a datacard the search index needs."""
+    return {
+        'gene': card.get('gene') or gene,
+        'variant_string': card.get('variant_string', ''),
+        'protein_change': card.get('protein_change', ''),
+        'ic50': card.get('ic50_estimate', 'N/A'),
+        'qc_pass': card.get('qc_pass', False),
+        'drugs_tested': card.get('drugs_tested', [])
+    }
+
+def summarize_file(path, gene):
+    """Summaries of the datacards in one file.
+
+    A file holds a single datacard, or a shard mapping variant strings to
+    datacards; anything else (such as a shard index) yields nothing.
+    """
+    with open(path, 'rb') as f:
+        data = loads_json(f.read())
+
+    if not isinstance(data, dict):
+        return []
+    if 'variant_string' in data:
+        return [datacard_summary(data, gene)]
+    return [datacard_summary(card, gene) for card in data.values()
+            if isinstance(card, dict) and 'variant_string' in card]
+
+def list_datacard_files(variants_dir):
+    """(relative path, gene, stat) for every datacard file.
+
+    Top-level files are flat {Gene}_{variant}.json datacards; each
+    subdirectory holds one gene's datacards or shards. Flat files come
+    first, then gene directories, each sorted by path, so the layout
+    process_data.py writes today wins over older copies. Hidden entries
+    (file listings, temporary files) and shard indexes are skipped.
+    """
+    found = []
+
+    def add(entry, relative_path, gene):
+        if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.name != SHARD_INDEX_NAME:
+            found.append((relative_path, gene, entry.stat()))
+
+    with os.scandir(variants_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                with os.scandir(entry.path) as gene_entries:
+                    for gene_entry in gene_entries:
+                        if gene_entry.is_file():
+                            add(gene_entry, f"{entry.name}/{gene_entry.name}", entry.name)
+            elif entry.is_file():
+                parsed = parse_variant_key(Path(entry.name).stem)
+                add(entry, entry.name, parsed[0] if parsed else '')
+
+    found.sort(key=lambda item: ('/' in item[0], item[0]))
+    return found
+
+def load_scan_cache(cache_path):
+    """Cached file summaries from a previous scan, or an empty cache."""
+    if cache_path is None or not Path(cache_path).exists():
+        return {}
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = loads_json(f.read())
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable scan cache {cache_path}: {e}")
+        return {}
+    if cache.get('version') != SCAN_CACHE_VERSION:
+        return {}
+    return cache.get('files', {})
+
+@stage_timer('scan')
+def scan_variant_summaries(variants_dir, cache_path=None, workers=None):
+    """Summaries of every datacard under variants_dir, in list_datacard_files order.
+
+    Files whose mtime and size match the cache are not parsed again; the
+    cache is rewritten when anything changed.
+    """
+    variants_dir = Path(variants_dir)
+    cached = load_scan_cache(cache_path)
+    files = list_datacard_files(variants_dir)
+
+    results = {}
+    stale = []
+    for relative_path, gene, stat in files:
+        entry = cached.get(relative_path)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            results[relative_path] = entry
+        else:
+            stale.append((relative_path, gene, stat))
+
+    def parse(item):
+        relative_path, gene, stat = item
+        try:
+            summaries = summarize_file(variants_dir / relative_path, gene)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to process variant file {variants_dir / relative_path}: {e}")
+            summaries = None
+        return relative_path, {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'summaries': summaries}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for relative_path, entry in executor.map(parse, stale):
+            results[relative_path] = entry
+
+    logger.info(f"Scanned {len(files)} variant files in {variants_dir} "
+                f"({len(stale)} parsed, {len(files) - len(stale)} from cache)")
+
+    if cache_path is not None and (stale or len(cached) != len(files)):
+        # Unreadable files are not cached so they are retried next time
+        entries = {path: entry for path, entry in results.items() if entry['summaries'] is not None}
+        try:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            write_json_file(cache_path, {'version': SCAN_CACHE_VERSION, 'files': entries})
+        except OSError as e:
+            logger.warning(f"Could not write scan cache {cache_path}: {e}")
+
+    return [summary for relative_path, _, _ in files for summary in results[relative_path]['summaries'] or []]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Position-sharded variant bundles.
+Groups datacards into one JSON object per gene and position range
+(e.g. variants/BCR-ABL/shard_0250-0299.json) plus a per-gene index.json
+recording the byte offset and length of every datacard inside its shard,
+so clients can fetch a whole shard or range-request a single variant.
+"""
+
+import re
+import json
+from pathlib import Path
+import logging
+
+from json_writer import dumps_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_SIZE = 50
+
+SHARD_INDEX_NAME = "index.json"
+
+VARIANT_KEY_PATTERN = re.compile(r'^(?P<gene>.+)_(?P<ref>\D+)(?P<position>-?\d+)(?P<alt>\D+)$')
+
+def shard_start(position, shard_size):
+    """First position of the shard holding position."""
+    return (int(position) // shard_size) * shard_size
+
+def shard_file_name(start, shard_size):
+    """File name of the shard starting at start."""
+    return f"shard_{start:04d}-{start + shard_size - 1:04d}.json"
+
+def parse_variant_key(variant_key):
+    """Split a Gene_variant datacard key into (gene, variant_string, position)."""
+    match = VARIANT_KEY_PATTERN.match(variant_key)
+    if not match:
+        return None
+    variant_string = f"{match['ref']}{match['position']}{match['alt']}"
+    return match['gene'], variant_string, int(match['position'])
+
+def shard_of_key(variant_key, shard_size):
+    """(gene, shard start) of a datacard key, or None if it cannot be parsed."""
+    parsed = parse_variant_key(variant_key)
+    if parsed is None:
+        return None
+    gene, _, position = parsed
+    return gene, shard_start(position, shard_size)
+
+def encode_shard(cards, indent=None):
+    """Encode {variant_string: datacard} as one JSON object.
+
+    Returns the shard bytes and {variant_string: (offset, length)} locating
+    each datacard's JSON value within them.
+    """
+    parts = [b'{']
+    offset = 1
+    locations = {}
+    for i, (variant_string, card) in enumerate(cards.items()):
+        prefix = (b',' if i else b'') + dumps_json(variant_string) + b':'
+        data = dumps_json(card, indent=indent)
+        offset += len(prefix)
+        locations[variant_string] = (offset, len(data))
+        offset += len(data)
+        parts.extend([prefix, data])
+    parts.append(b'}')
+    return b''.join(parts), locations
+
+def group_into_shards(variants, shard_size):
+    """Group datacards by gene and shard start, ordered by position."""
+    shards = {}
+    ordered = sorted(variants.values(), key=lambda card: (card['gene'], int(card['position']), card['variant_string']))
+    for card in ordered:
+        key = (card['gene'], shard_start(card['position'], shard_size))
+        shards.setdefault(key, {})[card['variant_string']] = card
+    return shards
+
+def build_shard_files(variants, shard_size=DEFAULT_SHARD_SIZE, indent=None):
+    """Build shard files and per-gene indexes for a set of datacards.
+
+    Returns (files, indexes): files maps paths relative to the variants
+    directory to encoded shard bytes, and indexes maps each gene to its
+    index dict (not yet added to files).
+    """
+    files = {}
+    indexes = {}
+    for (gene, start), cards in group_into_shards(variants, shard_size).items():
+        name = shard_file_name(start, shard_size)
+        data, locations = encode_shard(cards, indent=indent)
+        files[f"{gene}/{name}"] = data
+
+        index = indexes.setdefault(gene, new_shard_index(gene, shard_size))
+        index['shards'][name] = {
+            'start': start,
+            'end': start + shard_size - 1,
+            'variant_count': len(cards),
+            'bytes': len(data)
+        }
+        for variant_string, (offset, length) in locations.items():
+            index['variants'][variant_string] = {'shard': name, 'offset': offset, 'length': length}
+
+    return files, indexes
+
+def new_shard_index(gene, shard_size):
+    """Empty shard index for a gene."""
+    return {'gene': gene, 'shard_size': shard_size, 'shards': {}, 'variants': {}}
+
+def add_index_files(files, indexes):
+    """Add each gene's index.json to files, with shards sorted by position."""
+    for gene, index in indexes.items():
+        index['shards'] = dict(sorted(index['shards'].items(), key=lambda item: item[1]['start']))
+        files[f"{gene}/{SHARD_INDEX_NAME}"] = index
+    return files
+
+def load_shard_indexes(output_dir):
+    """Load every gene's shard index from a variants directory."""
+    output_dir = Path(output_dir)
+    indexes = {}
+    if not output_dir.exists():
+        return indexes
+
+    for index_path in output_dir.glob(f"*/{SHARD_INDEX_NAME}"):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            indexes[index['gene']] = index
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable shard index {index_path}: {e}")
+    return indexes
+
+def sharded_datacard_keys(indexes):
+    """Datacard keys present in a set of shard indexes."""
+    return {f"{gene}_{variant_string}" for gene, index in indexes.items() for variant_string in index['variants']}
+
+def merge_shard_indexes(previous, rebuilt, replaced_shards, shard_size):
+    """Replace the given (gene, start) shards of previous indexes with rebuilt ones.
+
+    Returns the merged indexes and the shard paths that no longer exist.
+    """
+    merged = {}
+    for gene in set(previous) | set(rebuilt) | {gene for gene, _ in replaced_shards}:
+        index = new_shard_index(gene, shard_size)
+        old = previous.get(gene, new_shard_index(gene, shard_size))
+        replaced = {shard_file_name(start, shard_size) for g, start in replaced_shards if g == gene}
+
+        for name, shard in old['shards'].items():
+            if name not in replaced:
+                index['shards'][name] = shard
+        for variant_string, location in old['variants'].items():
+            if location['shard'] not in replaced:
+                index['variants'][variant_string] = location
+
+        new = rebuilt.get(gene, new_shard_index(gene, shard_size))
+        index['shards'].update(new['shards'])
+        index['variants'].update(new['variants'])
+
+        if index['variants']:
+            merged[gene] = index
+
+    removed = [
+        f"{gene}/{shard_file_name(start, shard_size)}" for gene, start in replaced_shards
+        if shard_file_name(start, shard_size) not in rebuilt.get(gene, {}).get('shards', {})
+    ]
+    removed.extend(f"{gene}/{SHARD_INDEX_NAME}" for gene in previous if gene not in merged)
+    return merged, removed
@@ -0,0 +1,23 @@
+"""Shared pytest setup for the data pipeline tests."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+PROJECT_ROOT = SCRIPTS_DIR.parent.parent
+
+# The pipeline scripts import each other as top-level modules
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+@pytest.fixture
+def bundled_csv(tmp_path):
+    """Copy of the bundled screen, so its parse cache stays under tmp_path."""
+    source = PROJECT_ROOT / "data" / "raw" / "master_qDMS_df.csv"
+    if not source.exists():
+        pytest.skip("bundled screen data/raw/master_qDMS_df.csv is not available")
+    csv_path = tmp_path / "raw" / source.name
+    csv_path.parent.mkdir()
+    csv_path.write_bytes(source.read_bytes())
+    return csv_path
@@ -0,0 +1,33 @@
+"""Round trips of the columnar search index encoding."""
+
+from build_search_index import build_search_index
+from json_writer import dumps_json, loads_json
+from search_columnar import decode_columnar_index, encode_columnar_index
+
+def test_round_trip_of_bundled_index(bundled_csv, tmp_path):
+    search_index = build_search_index(bundled_csv, tmp_path / "variants", tmp_path / "search_index.json",
+                                      formats=['full'])
+    assert search_index['variants']
+
+    columnar_index = encode_columnar_index(search_index)
+    assert decode_columnar_index(columnar_index) == search_index
+    assert decode_columnar_index(loads_json(dumps_json(columnar_index))) == search_index
+
+def test_round_trip_keeps_drugs_tested_order():
+    drugs = [{'name': 'Imatinib'}, {'name': 'Dasatinib'}, {'name': 'Nilotinib'}]
+    variants = [
+        {'gene': 'ABL1', 'variant_string': 'T315I', 'protein_change': 'p.T315I',
+         'consequence': 'missense_variant', 'drugs_tested': ['Nilotinib', 'Imatinib']},
+        {'gene': 'ABL1', 'variant_string': 'E255K', 'protein_change': 'p.E255K',
+         'consequence': 'missense_variant', 'drugs_tested': ['Imatinib', 'Nilotinib', 'Dasatinib']},
+        {'gene': 'ABL1', 'variant_string': 'Y253H', 'protein_change': 'p.Y253H',
+         'consequence': 'missense_variant', 'drugs_tested': []}
+    ]
+    search_index = {'genes': [], 'drugs': drugs, 'variants': variants, 'lastUpdate': '2024-01-01T00:00:00+00:00',
+                    'stats': {'total_genes': 0, 'total_drugs': 3, 'total_variants': 3}}
+
+    decoded = decode_columnar_index(encode_columnar_index(search_index))
+    assert [variant['drugs_tested'] for variant in decoded['variants']] == [
+        ['Nilotinib', 'Imatinib'], ['Imatinib', 'Nilotinib', 'Dasatinib'], []
+    ]
+    assert decoded == search_index
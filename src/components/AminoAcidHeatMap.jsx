@@ -3,6 +3,34 @@ import * as d3 from 'd3';
 import { useNavigate } from 'react-router-dom';
 import './AminoAcidHeatMap.css';
 
+const HEATMAP_SPLIT_DIR = 'data/v1.0/heatmap';
+
+// Expand one drug of heatmap_compact.json (flat row-major [position][amino acid]
+// arrays per dose) into the nested {position: {aa: {dose: {value, std, count}, ref_aa}}} matrix.
+// Doses that have not been loaded yet are left out.
+const expandCompactMatrix = (data, drug) => {
+  const drugData = data.drugs[drug];
+  if (!drugData) return null;
+
+  const aminoAcids = data.amino_acids;
+  const matrix = {};
+  data.positions.forEach((position, p) => {
+    const cells = {};
+    aminoAcids.forEach((aa, a) => {
+      const index = p * aminoAcids.length + a;
+      const cell = { ref_aa: data.ref_aa[p] };
+      data.dose_levels.forEach(dose => {
+        const doseData = drugData[dose];
+        if (!doseData) return;
+        cell[dose] = { value: doseData.value[index], std: doseData.std[index], count: doseData.count[index] };
+      });
+      cells[aa] = cell;
+    });
+    matrix[position.toString()] = cells;
+  });
+  return matrix;
+};
+
 const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDrug }) => {
   const svgRef = useRef();
   const navigate = useNavigate();
@@ -16,8 +44,16 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
     { name: 'Hollyniacine', fda_approved: false, approval_date: null }
   ]);
 
+  // Dose levels come from the data; older files only have low/medium/high
+  const doseLevels = heatmapData?.metadata?.dose_levels || ['low', 'medium', 'high'];
+
   // Map concentration to dose labels for better UX
   const getConcentrationForDose = (dose) => {
+    const concentrations = heatmapData?.metadata?.dose_concentrations?.[selectedDrug];
+    const level = doseLevels.indexOf(dose);
+    if (concentrations && level >= 0 && level < concentrations.length) {
+      return `${concentrations[level]} µM`;
+    }
     switch (dose) {
       case 'low': return '5 µM';
       case 'medium': return '30 µM';
@@ -31,6 +67,24 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
     const loadHeatmapData = async () => {
       try {
         const baseUrl = import.meta.env.BASE_URL || '';
+
+        // Prefer the per-drug split files, whose matrices are loaded on demand,
+        // then the compact encoding, then the nested heatmap_data.json
+        const manifestResponse = await fetch(`${baseUrl}${HEATMAP_SPLIT_DIR}/manifest.json`);
+        if (manifestResponse.ok) {
+          const manifest = await manifestResponse.json();
+          setHeatmapData({ ...manifest, drugs: {} });
+          setLoading(false);
+          return;
+        }
+
+        const compactResponse = await fetch(`${baseUrl}data/v1.0/heatmap_compact.json`);
+        if (compactResponse.ok) {
+          setHeatmapData(await compactResponse.json());
+          setLoading(false);
+          return;
+        }
+
         const response = await fetch(`${baseUrl}data/v1.0/heatmap_data.json`);
         
         if (!response.ok) {
@@ -50,6 +104,46 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
     loadHeatmapData();
   }, []);
 
+  // Load the selected drug and dose from the split heat map files
+  useEffect(() => {
+    if (!heatmapData || heatmapData.format !== 'split') return;
+    if (heatmapData.drugs[selectedDrug]?.[selectedDose]) return;
+
+    const entries = (heatmapData.files[selectedDrug] || []).filter(entry => entry.doses.includes(selectedDose));
+    if (entries.length === 0) return;
+
+    let cancelled = false;
+    const baseUrl = import.meta.env.BASE_URL || '';
+    Promise.all(entries.map(async entry => {
+      // The content hash busts stale caches when the matrix changes
+      const response = await fetch(`${baseUrl}${HEATMAP_SPLIT_DIR}/${entry.path}?v=${entry.hash}`);
+      if (!response.ok) {
+        throw new Error(`Failed to load heat map data for ${selectedDrug}: ${response.status}`);
+      }
+      return response.json();
+    }))
+      .then(parts => {
+        if (cancelled) return;
+        setHeatmapData(prev => ({
+          ...prev,
+          drugs: { ...prev.drugs, [selectedDrug]: Object.assign({}, prev.drugs[selectedDrug], ...parts) }
+        }));
+      })
+      .catch(err => {
+        console.error('Error loading heat map data:', err);
+        setError(err.message);
+      });
+
+    return () => { cancelled = true; };
+  }, [heatmapData, selectedDrug, selectedDose]);
+
+  // Fall back to the first dose level when the data has no level of that name
+  useEffect(() => {
+    if (heatmapData && !doseLevels.includes(selectedDose)) {
+      setSelectedDose(doseLevels[0]);
+    }
+  }, [heatmapData, doseLevels, selectedDose]);
+
   // Update selected drug when initialDrug changes
   useEffect(() => {
     if (initialDrug && availableDrugs.some(d => d.name === initialDrug)) {
@@ -59,10 +153,15 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
 
   // Create the 2D matrix heat map visualization
   useEffect(() => {
-    if (!heatmapData || loading || error || !heatmapData.matrices || !heatmapData.positions) return;
+    if (!heatmapData || loading || error || !(heatmapData.matrices || heatmapData.drugs) || !heatmapData.positions) return;
+
+    // Split files for this drug and dose are still loading
+    if (heatmapData.format === 'split' && !heatmapData.drugs[selectedDrug]?.[selectedDose]) return;
 
     // Get the matrix for the selected drug
-    const currentMatrix = heatmapData.matrices[selectedDrug];
+    const currentMatrix = heatmapData.matrices
+      ? heatmapData.matrices[selectedDrug]
+      : expandCompactMatrix(heatmapData, selectedDrug);
     if (!currentMatrix) {
       console.error(`No matrix data found for drug: ${selectedDrug}`);
       return;
@@ -111,8 +210,8 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
     const allValues = [];
     Object.values(currentMatrix).forEach(posData => {
       Object.values(posData).forEach(aaData => {
-        // Include values from all doses (low, medium, high)
-        ['low', 'medium', 'high'].forEach(dose => {
+        // Include values from all doses
+        doseLevels.forEach(dose => {
           if (aaData[dose] && aaData[dose].value !== null && aaData[dose].value !== undefined) {
             allValues.push(aaData[dose].value);
           }
@@ -120,10 +219,12 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
       });
     });
 
-    // Create color scale - consistent for all doses of this drug
+    // Create color scale - consistent for all doses of this drug. The precomputed
+    // range covers every dose even when only the selected one has been loaded
+    const valueRange = heatmapData.metadata.value_ranges?.[selectedDrug];
     const colorScale = d3.scaleSequential()
       .interpolator(d3.interpolateViridis)
-      .domain(d3.extent(allValues));
+      .domain(valueRange && allValues.length ? [valueRange.min, valueRange.max] : d3.extent(allValues));
 
     // Tooltip
     const tooltip = d3.select('body').append('div')
@@ -234,9 +335,12 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
               .style('opacity', 0);
           })
           .on("click", function() {
-            if (value !== null && heatmapData.variant_lookup) {
+            if (value !== null) {
               const lookupKey = `${position}_${aa}`;
-              const variantInfo = heatmapData.variant_lookup[lookupKey];
+              // The compact encoding has no lookup table; the id is ref + position + alt
+              const variantInfo = heatmapData.variant_lookup
+                ? heatmapData.variant_lookup[lookupKey]
+                : { id: `${cellData.ref_aa}${position}${aa}` };
               
               if (variantInfo) {
                 const gene = heatmapData.metadata.gene;
@@ -331,7 +435,8 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
     const numStops = 10;
     for (let i = 0; i <= numStops; i++) {
       const offset = (i / numStops) * 100;
-      const value = d3.min(allValues) + (d3.max(allValues) - d3.min(allValues)) * (i / numStops);
+      const [domainMin, domainMax] = colorScale.domain();
+      const value = domainMin + (domainMax - domainMin) * (i / numStops);
       gradient.append("stop")
         .attr("offset", `${offset}%`)
         .attr("stop-color", colorScale(value));
@@ -349,7 +454,7 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
 
     // Add legend scale - vertical axis on the right
     const legendScale = d3.scaleLinear()
-      .domain(d3.extent(allValues))
+      .domain(colorScale.domain())
       .range([legendY + legendHeight, legendY]);  // Reversed for bottom-to-top
 
     const legendAxis = d3.axisRight(legendScale)
@@ -466,7 +571,7 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
     );
   }
 
-  if (!heatmapData || !heatmapData.matrices) {
+  if (!heatmapData || !(heatmapData.matrices || heatmapData.drugs)) {
     return (
       <div className="heatmap-container">
         <div className="heatmap-error">
@@ -539,7 +644,7 @@ const AminoAcidHeatMap = ({ proteinId, hoveredResidue, onResidueHover, initialDr
         {/* Concentration Toggle Controls */}
         <div className="dose-controls" style={{ marginBottom: '1rem' }}>
           <span style={{ marginRight: '1rem', fontWeight: 'bold' }}>Concentration:</span>
-          {['low', 'medium', 'high'].map((dose) => (
+          {doseLevels.map((dose) => (
             <button
               key={dose}
               onClick={() => setSelectedDose(dose)}
@@ -12,8 +12,10 @@ const DrugTable = () => {
   const [filterText, setFilterText] = useState('')
 
   useEffect(() => {
-    // Load drug data from search index
-    fetch(`${import.meta.env.BASE_URL}data/v1.0/search_index.json`)
+    // Load drug data from the root search index
+    fetch(`${import.meta.env.BASE_URL}data/v1.0/search/index.json`)
+      // Older builds only have the full search index
+      .then(res => res.ok ? res : fetch(`${import.meta.env.BASE_URL}data/v1.0/search_index.json`))
       .then(res => res.json())
       .then(data => {
         setRowData(data.drugs || [])
@@ -2,28 +2,118 @@ import React, { useState, useRef, useEffect } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { Search, X } from 'lucide-react'
 
+// Same normalization build_search_index.py applies to indexed terms
+const normalizeTerm = (term) => {
+  const lower = term.trim().toLowerCase()
+  return lower.startsWith('p.') ? lower.slice(2) : lower
+}
+
+// Entry IDs present in every posting list (each list is sorted ascending)
+const intersectPostings = (lists) => {
+  if (lists.length === 0) return []
+  const [shortest, ...rest] = [...lists].sort((a, b) => a.length - b.length)
+  const others = rest.map(list => new Set(list))
+  return shortest.filter(id => others.every(set => set.has(id)))
+}
+
+const SEARCH_DIR = '/AtlasBioTech/data/v1.0/search'
+
 const GlobalSearch = () => {
   const [query, setQuery] = useState('')
   const [suggestions, setSuggestions] = useState([])
   const [isOpen, setIsOpen] = useState(false)
+  const [rootIndex, setRootIndex] = useState(null)
   const [searchIndex, setSearchIndex] = useState(null)
+  const shardCache = useRef(new Map())
+  const latestQuery = useRef('')
   const inputRef = useRef()
   const navigate = useNavigate()
 
   useEffect(() => {
-    // Load search index
-    fetch(`/AtlasBioTech/data/v1.0/search_index.json`)
-      .then(res => res.json())
-      .then(data => setSearchIndex(data))
-      .catch(err => console.error('Error loading search index:', err))
+    // Load the small root index; variant shards are fetched per gene on demand
+    fetch(`${SEARCH_DIR}/index.json`)
+      .then(res => {
+        if (!res.ok) throw new Error(`HTTP ${res.status}`)
+        return res.json()
+      })
+      .then(data => setRootIndex(data))
+      .catch(err => {
+        // Without the sharded index, fall back to scanning the full search index
+        console.error('Error loading sharded search index:', err)
+        fetch(`/AtlasBioTech/data/v1.0/search_index.json`)
+          .then(res => res.json())
+          .then(data => setSearchIndex(data))
+          .catch(err => console.error('Error loading search index:', err))
+      })
   }, [])
 
-  const handleSearch = (searchQuery) => {
-    if (!searchIndex || !searchQuery.trim()) {
-      setSuggestions([])
-      return
+  const geneResult = (gene) => ({
+    type: 'gene',
+    id: gene.symbol,
+    title: gene.symbol,
+    subtitle: gene.name,
+    url: `/protein/${gene.symbol}`
+  })
+
+  const drugResult = (drug) => ({
+    type: 'drug',
+    id: drug.name,
+    title: drug.name,
+    subtitle: `FDA Status: ${drug.fda_status}`,
+    url: `/drugs?filter=${encodeURIComponent(drug.name)}`
+  })
+
+  const variantResult = (variant) => ({
+    type: 'variant',
+    id: `${variant.gene}_${variant.variant_string}`,
+    title: `${variant.gene} ${variant.variant_string}`,
+    subtitle: variant.protein_change,
+    url: `/variant/${variant.gene}/${encodeURIComponent(variant.variant_string)}`
+  })
+
+  const loadShard = (shard) => {
+    if (!shardCache.current.has(shard.file)) {
+      const request = fetch(`${SEARCH_DIR}/${shard.file}?v=${shard.hash}`)
+        .then(res => res.json())
+        .catch(err => {
+          shardCache.current.delete(shard.file)
+          throw err
+        })
+      shardCache.current.set(shard.file, request)
     }
+    return shardCache.current.get(shard.file)
+  }
+
+  // Look up each query word and intersect the posting lists: genes and drugs
+  // in the root index, variants in the gene shards every word routes to
+  const searchSharded = async (searchQuery) => {
+    const words = searchQuery.split(/\s+/).map(normalizeTerm).filter(Boolean)
+    const lookup = (tokens, word) => tokens[word] || []
+    const results = []
+
+    const { genes, drugs } = rootIndex.id_ranges
+    intersectPostings(words.map(word => lookup(rootIndex.tokens, word))).forEach(id => {
+      if (id < genes[1]) results.push(geneResult(rootIndex.genes[id - genes[0]]))
+      else results.push(drugResult(rootIndex.drugs[id - drugs[0]]))
+    })
 
+    const routingLength = rootIndex.shard_routing_length
+    const shardIds = intersectPostings(
+      words.map(word => lookup(rootIndex.shard_tokens, word.slice(0, routingLength)))
+    )
+    for (const shardId of shardIds) {
+      if (results.length >= 10) break
+      const shard = await loadShard(rootIndex.shards[shardId])
+      const start = shard.id_ranges.variants[0]
+      intersectPostings(words.map(word => lookup(shard.tokens, word))).forEach(id => {
+        results.push(variantResult(shard.variants[id - start]))
+      })
+    }
+
+    return results.slice(0, 10)
+  }
+
+  const searchFullIndex = (searchQuery) => {
     const query = searchQuery.toLowerCase()
     const results = []
 
@@ -31,13 +121,7 @@ const GlobalSearch = () => {
     searchIndex.genes.forEach(gene => {
       if (gene.symbol.toLowerCase().includes(query) || 
           gene.name.toLowerCase().includes(query)) {
-        results.push({
-          type: 'gene',
-          id: gene.symbol,
-          title: gene.symbol,
-          subtitle: gene.name,
-          url: `/protein/${gene.symbol}`
-        })
+        results.push(geneResult(gene))
       }
     })
 
@@ -45,13 +129,7 @@ const GlobalSearch = () => {
     searchIndex.drugs.forEach(drug => {
       if (drug.name.toLowerCase().includes(query) ||
           (drug.synonyms && drug.synonyms.some(syn => syn.toLowerCase().includes(query)))) {
-        results.push({
-          type: 'drug',
-          id: drug.name,
-          title: drug.name,
-          subtitle: `FDA Status: ${drug.fda_status}`,
-          url: `/drugs?filter=${encodeURIComponent(drug.name)}`
-        })
+        results.push(drugResult(drug))
       }
     })
 
@@ -60,17 +138,29 @@ const GlobalSearch = () => {
       if (variant.gene.toLowerCase().includes(query) ||
           variant.variant_string.toLowerCase().includes(query) ||
           variant.protein_change.toLowerCase().includes(query)) {
-        results.push({
-          type: 'variant',
-          id: `${variant.gene}_${variant.variant_string}`,
-          title: `${variant.gene} ${variant.variant_string}`,
-          subtitle: variant.protein_change,
-          url: `/variant/${variant.gene}/${encodeURIComponent(variant.variant_string)}`
-        })
+        results.push(variantResult(variant))
       }
     })
 
-    setSuggestions(results.slice(0, 10)) // Limit to 10 results
+    return results.slice(0, 10) // Limit to 10 results
+  }
+
+  const handleSearch = async (searchQuery) => {
+    latestQuery.current = searchQuery
+    if ((!rootIndex && !searchIndex) || !searchQuery.trim()) {
+      setSuggestions([])
+      return
+    }
+
+    try {
+      const results = rootIndex ? await searchSharded(searchQuery) : searchFullIndex(searchQuery)
+      // Ignore results for a query the user has already typed past
+      if (latestQuery.current === searchQuery) {
+        setSuggestions(results)
+      }
+    } catch (err) {
+      console.error('Error searching:', err)
+    }
   }
 
   const handleInputChange = (e) => {
@@ -11,8 +11,10 @@ const HomePage = () => {
   })
 
   useEffect(() => {
-    // Load search index to get stats
-    fetch(`${import.meta.env.BASE_URL}data/v1.0/search_index.json`)
+    // Load the root search index to get stats
+    fetch(`${import.meta.env.BASE_URL}data/v1.0/search/index.json`)
+      // Older builds only have the full search index
+      .then(res => res.ok ? res : fetch(`${import.meta.env.BASE_URL}data/v1.0/search_index.json`))
       .then(res => res.json())
       .then(data => setStats(data.stats))
       .catch(err => console.error('Error loading stats:', err))
@@ -5,6 +5,36 @@ import StructureViewer from './StructureViewer'
 import DoseResponsePlot from './DoseResponsePlot'
 import DoseResponseTable from './DoseResponseTable'
 
+const VARIANTS_URL = '/AtlasBioTech/data/v1.0/variants'
+
+// Shard indexes and shards are fetched once and shared by neighbouring variants
+const shardRequests = new Map()
+
+const fetchJsonOnce = (url) => {
+  if (!shardRequests.has(url)) {
+    const request = fetch(url).then(res => {
+      if (!res.ok) {
+        throw new Error(`Failed to load ${url}`)
+      }
+      return res.json()
+    })
+    request.catch(() => shardRequests.delete(url))
+    shardRequests.set(url, request)
+  }
+  return shardRequests.get(url)
+}
+
+// Look up a variant in the position-sharded bundles (process_data.py --layout shards)
+const loadVariantFromShard = async (gene, id) => {
+  const index = await fetchJsonOnce(`${VARIANTS_URL}/${gene}/index.json`)
+  const location = index.variants[id]
+  if (!location) {
+    throw new Error('Variant not found')
+  }
+  const shard = await fetchJsonOnce(`${VARIANTS_URL}/${gene}/${location.shard}`)
+  return shard[id]
+}
+
 const VariantCard = () => {
   const { gene, id } = useParams()
   const navigate = useNavigate()
@@ -23,11 +53,10 @@ const VariantCard = () => {
         const decodedId = decodeURIComponent(id)
         // Load variant data from the correct file path  
         const fileName = `${decodedGene}_${decodedId}.json`
-        const response = await fetch(`/AtlasBioTech/data/v1.0/variants/${fileName}`)
-        if (!response.ok) {
-          throw new Error('Variant not found')
-        }
-        const data = await response.json()
+        const response = await fetch(`${VARIANTS_URL}/${fileName}`)
+        const data = response.ok
+          ? await response.json()
+          : await loadVariantFromShard(decodedGene, decodedId)
         setVariantData(data)
         // Initialize selectedDrugs with available drugs
         setSelectedDrugs(data.drugs_tested || [])